@@ -0,0 +1,192 @@
+import asyncio
+import json
+import math
+import random
+from dataclasses import dataclass
+
+import httpx
+
+# Description: Local stand-ins for the Tavily and OpenAI APIs, served through httpx mock transports
+
+WORDS = (
+    "research market energy policy quantum battery climate model data growth analysis report "
+    "industry revenue investment risk technology adoption regulation supply demand forecast"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+@dataclass
+class Scenario:
+    name: str = "default"
+    sources: int = 10
+    sections: int = 5
+    extract_urls: int = 5
+    content_words: int = 80
+    raw_content_words: int = 2000
+    section_words: int = 600
+    tavily_latency: float = 0.05
+    llm_latency: float = 0.2
+    stream_chunks: int = 20
+    batch_sections: bool = True
+    seed: int = 0
+
+
+class FakeTavily:
+    """
+    Answers POST /search and /extract with generated results of the scenario's size.
+    """
+    def __init__(self, scenario: Scenario):
+        self.scenario = scenario
+        self.rng = random.Random(scenario.seed)
+        self.calls = {"search": 0, "extract": 0}
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content or b"{}")
+        await asyncio.sleep(self.scenario.tavily_latency)
+        if request.url.path.endswith("/search"):
+            self.calls["search"] += 1
+            query_id = body["query"].split()[1]
+            results = [{
+                "url": f"https://example.com/{query_id}/{i}",
+                "title": f"Result {query_id}-{i}",
+                "content": _text(self.rng, self.scenario.content_words),
+                "score": 0.5 + self.rng.random() / 2,
+                "published_date": "2024-01-01",
+            } for i in range(body.get("max_results", 10))]
+            return httpx.Response(200, json={"query": body["query"], "results": results, "response_time": 0.1})
+        if request.url.path.endswith("/extract"):
+            self.calls["extract"] += 1
+            urls = body["urls"] if isinstance(body["urls"], list) else [body["urls"]]
+            results = [{"url": url, "raw_content": _text(self.rng, self.scenario.raw_content_words)} for url in urls]
+            return httpx.Response(200, json={"results": results, "failed_results": [], "response_time": 0.1})
+        return httpx.Response(404, json={"detail": "not found"})
+
+
+class FakeOpenAI:
+    """
+    OpenAI compatible /chat/completions endpoint that plays the agent's script:
+    search, extract, outline, review, write the sections and confirm.
+    """
+    def __init__(self, scenario: Scenario):
+        self.scenario = scenario
+        self.rng = random.Random(scenario.seed + 1)
+        self.calls = {"router": 0, "outline": 0, "section": 0}
+        self.prompt_chars = {"router": 0, "outline": 0, "section": 0}
+
+    def _router_reply(self, messages: list):
+        tool_names = {}
+        for message in messages:
+            for tool_call in message.get("tool_calls") or []:
+                tool_names[tool_call["id"]] = tool_call["function"]["name"]
+        last = messages[-1]
+        last_tool = tool_names.get(last.get("tool_call_id")) if last["role"] == "tool" else None
+
+        if last["role"] == "system" or (last["role"] == "developer" and "reviewed the proposal" in str(last.get("content"))):
+            if self.scenario.batch_sections:
+                return "section_batch_writer", {"research_query": "benchmark"}
+            return "section_writer", {"research_query": "benchmark", "section_title": "Section 0", "idx": 0}
+        if last_tool is None and last["role"] == "user":
+            queries = math.ceil(self.scenario.sources / 10)
+            return "tavily_search", {"sub_queries": [
+                {"query": f"query q{i}", "topic": "general", "days": 30} for i in range(queries)
+            ]}
+        if last_tool == "tavily_search" and self.scenario.extract_urls:
+            return "tavily_extract", {"urls": [f"https://example.com/q0/{i}" for i in range(self.scenario.extract_urls)]}
+        if last_tool in ("tavily_search", "tavily_extract"):
+            return "outline_writer", {"research_query": "benchmark"}
+        if last_tool == "outline_writer":
+            return "review_proposal", {"proposal": "proposal"}
+        if last_tool == "section_writer":
+            written = sum(1 for name in tool_names.values() if name == "section_writer")
+            if written < self.scenario.sections:
+                return "section_writer", {"research_query": "benchmark", "section_title": f"Section {written}", "idx": written}
+        return None, "I have completed the report. Would you like me to change anything?"
+
+    def _outline(self) -> str:
+        return json.dumps({"sections": {
+            f"section{i}": {"title": f"Section {i}", "description": _text(self.rng, 12), "approved": True}
+            for i in range(self.scenario.sections)
+        }})
+
+    def _section(self, body: dict) -> dict:
+        prompt = body["messages"][-1].get("content") or ""
+        title = prompt.split("Section Title: ", 1)[1].split("\n", 1)[0] if "Section Title: " in prompt else "Section"
+        return {
+            "title": title,
+            "content": _text(self.rng, self.scenario.section_words),
+            "footer": "[^1]: [S1]",
+            "section_number": 0,
+        }
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        tools = [tool["function"]["name"] for tool in body.get("tools") or []]
+        prompt_chars = sum(len(str(message.get("content") or "")) for message in body["messages"])
+
+        if "WriteSection" in tools:
+            kind, tool_name, payload = "section", "WriteSection", self._section(body)
+        elif tools:
+            kind = "router"
+            tool_name, payload = self._router_reply(body["messages"])
+        else:
+            kind, tool_name, payload = "outline", None, self._outline()
+        self.calls[kind] += 1
+        self.prompt_chars[kind] += prompt_chars
+
+        text = json.dumps(payload) if tool_name else payload
+        usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(text) // 4,
+                 "total_tokens": (prompt_chars + len(text)) // 4}
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  content=self._stream(body["model"], tool_name, text, usage))
+
+        await asyncio.sleep(self.scenario.llm_latency)
+        message = {"role": "assistant", "content": None if tool_name else text}
+        if tool_name:
+            message["tool_calls"] = [{"id": f"call_{self.rng.getrandbits(32)}", "type": "function",
+                                      "function": {"name": tool_name, "arguments": text}}]
+        return httpx.Response(200, json={
+            "id": "chatcmpl-benchmark", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_name else "stop"}],
+            "usage": usage,
+        })
+
+    async def _stream(self, model: str, tool_name, text: str, usage: dict):
+        def chunk(delta, finish_reason=None):
+            data = {"id": "chatcmpl-benchmark", "object": "chat.completion.chunk", "created": 0, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(data)}\n\n".encode()
+
+        pieces = max(self.scenario.stream_chunks, 1)
+        size = math.ceil(len(text) / pieces) or 1
+        delay = self.scenario.llm_latency / pieces
+        if tool_name:
+            yield chunk({"role": "assistant", "tool_calls": [{"index": 0, "id": "call_stream", "type": "function",
+                                                              "function": {"name": tool_name, "arguments": ""}}]})
+        else:
+            yield chunk({"role": "assistant", "content": ""})
+        for start in range(0, len(text), size):
+            await asyncio.sleep(delay)
+            piece = text[start:start + size]
+            if tool_name:
+                yield chunk({"tool_calls": [{"index": 0, "function": {"arguments": piece}}]})
+            else:
+                yield chunk({"content": piece})
+        yield chunk({}, "tool_calls" if tool_name else "stop")
+        yield f"data: {json.dumps({'id': 'chatcmpl-benchmark', 'object': 'chat.completion.chunk', 'created': 0, 'model': model, 'choices': [], 'usage': usage})}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+
+def install_fake_services(scenario: Scenario):
+    """
+    Route the shared OpenAI and Tavily clients to local stand-ins for the scenario.
+    """
+    from clients import clients
+
+    tavily, openai = FakeTavily(scenario), FakeOpenAI(scenario)
+    clients.set_transport("tavily", httpx.MockTransport(tavily.handle))
+    clients.set_transport("openai", httpx.MockTransport(openai.handle))
+    return tavily, openai
@@ -0,0 +1,311 @@
+"""
+Offline end-to-end benchmark of the ResearchAgent graph.
+
+Runs search -> extract -> outline -> review interrupt -> section writing against local stand-ins for
+Tavily and OpenAI and reports per-node wall time, event loop blocking, emitted state bytes and peak memory.
+
+Usage (from the agent directory):
+    python -m benchmarks.run                         # all scenarios
+    python -m benchmarks.run --scenario sources-100  # a single scenario
+    python -m benchmarks.run --output results.json --baseline benchmarks/baseline.json
+    python -m benchmarks.run --repeat 3 --baseline benchmarks/baseline.json  # gate on the median of 3 runs
+"""
+import argparse
+import asyncio
+import json
+import atexit
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from dataclasses import asdict, replace
+
+# Keep the agent's caches and stores out of the working tree and make the clients start without real keys
+_workdir = tempfile.mkdtemp(prefix="agent-benchmark-")
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("TAVILY_API_KEY", "benchmark")
+os.environ.setdefault("CONTENT_STORE_PATH", os.path.join(_workdir, "content"))
+os.environ.setdefault("SEARCH_CACHE_ENABLED", "false")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.types import Command
+
+from benchmarks.fake_services import Scenario, install_fake_services
+
+NODES = ("call_model_node", "tool_node", "process_feedback_node")
+
+SCENARIOS = {
+    "sources-10": Scenario(name="sources-10", sources=10, sections=5),
+    "sources-100": Scenario(name="sources-100", sources=100, sections=5),
+    "sources-1000": Scenario(name="sources-1000", sources=1000, sections=5),
+    "sections-5": Scenario(name="sections-5", sources=30, sections=5),
+    "sections-20": Scenario(name="sections-20", sources=30, sections=20),
+    "sections-50": Scenario(name="sections-50", sources=30, sections=50),
+}
+
+# Metrics compared against the baseline; higher is worse for all of them
+GATED_METRICS = ("wall_time", "loop_blocked_time", "emitted_state_bytes", "emits", "peak_memory_mb", "llm_prompt_chars")
+
+
+class MetricsHandler(AsyncCallbackHandler):
+    """
+    Collects node wall times and emitted state sizes from the graph's callbacks.
+    """
+    def __init__(self):
+        self.started = {}
+        self.node_times = defaultdict(list)
+        self.emits = 0
+        self.emitted_bytes = 0
+        self.max_emit_bytes = 0
+
+    async def on_chain_start(self, serialized, inputs, *, run_id, name=None, **kwargs):
+        if name in NODES:
+            self.started[run_id] = (name, time.perf_counter())
+
+    async def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    async def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def _finish(self, run_id):
+        if run_id in self.started:
+            name, start = self.started.pop(run_id)
+            self.node_times[name].append(time.perf_counter() - start)
+
+    async def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name == "copilotkit_manually_emit_intermediate_state":
+            size = len(json.dumps({k: v for k, v in data.items() if k != "messages"}, default=str))
+            self.emits += 1
+            self.emitted_bytes += size
+            self.max_emit_bytes = max(self.max_emit_bytes, size)
+
+
+class LoopMonitor:
+    """
+    Measures how long the event loop is blocked by sleeping in small steps and recording the oversleep.
+    """
+    def __init__(self, interval: float = 0.005, threshold: float = 0.002):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked = 0.0
+        self.max_block = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - start - self.interval
+            if lag > self.threshold:
+                self.blocked += lag
+                self.max_block = max(self.max_block, lag)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def warm_up():
+    """
+    Load what the agent loads lazily on first use, so one-time import costs do not count as request time.
+    """
+    import langchain_openai  # noqa: F401
+    import tavily  # noqa: F401
+    from tokens import count_tokens
+
+    count_tokens("warm up")
+
+
+async def run_scenario(scenario: Scenario, trace_memory: bool = True, sqlite_checkpointer: bool = False,
+                       fake_services: bool = True) -> dict:
+    """
+    Drive one full research session through the graph and return its metrics. Without fake services the
+    requests go to the real providers, or to the cassette being replayed.
+    """
+    from checkpointer import ResearchCheckpointer
+    from clients import aclose_clients
+    from graph import ResearchAgent
+
+    warm_up()
+    await aclose_clients()
+    tavily, openai = install_fake_services(scenario) if fake_services else (None, None)
+    # The interrupt needs a checkpointer to resume from, the LangGraph server provides one in production
+    if sqlite_checkpointer:
+        checkpointer = ResearchCheckpointer(os.path.join(_workdir, f"checkpoints-{scenario.name}.sqlite"))
+    else:
+        checkpointer = MemorySaver()
+    graph = ResearchAgent().graph.builder.compile(checkpointer=checkpointer)
+
+    handler = MetricsHandler()
+    config = {"configurable": {"thread_id": f"benchmark-{scenario.name}"}, "callbacks": [handler],
+              "recursion_limit": 1000}
+    monitor = LoopMonitor()
+    if trace_memory:
+        tracemalloc.start()
+    monitor.start()
+    start = time.perf_counter()
+
+    initial = {"messages": [{"role": "user", "content": "Write a report about the benchmark topic"}],
+               "sources": {}, "sections": [], "logs": [], "outline": {}, "proposal": {}, "title": "", "tool": ""}
+    await graph.ainvoke(initial, config)
+
+    # Approve the proposal at the review interrupt, as the frontend would
+    snapshot = await graph.aget_state(config)
+    proposal = snapshot.values.get("proposal", {})
+    reviewed = {**proposal, "approved": True,
+                "sections": {k: {**v, "approved": True} for k, v in proposal.get("sections", {}).items()}}
+    await graph.ainvoke(Command(resume=reviewed), config)
+
+    wall_time = time.perf_counter() - start
+    await monitor.stop()
+    peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+    if trace_memory:
+        tracemalloc.stop()
+
+    final = (await graph.aget_state(config)).values
+    await aclose_clients()
+    return {
+        "scenario": asdict(scenario),
+        "wall_time": round(wall_time, 4),
+        "nodes": {name: {"calls": len(times), "total": round(sum(times), 4), "max": round(max(times), 4)}
+                  for name, times in handler.node_times.items()},
+        "loop_blocked_time": round(monitor.blocked, 4),
+        "loop_max_block": round(monitor.max_block, 4),
+        "emits": handler.emits,
+        "emitted_state_bytes": handler.emitted_bytes,
+        "max_emit_bytes": handler.max_emit_bytes,
+        "peak_memory_mb": round(peak_memory / 2 ** 20, 2),
+        "llm_calls": openai.calls if openai else None,
+        "llm_prompt_chars": sum(openai.prompt_chars.values()) if openai else 0,
+        "tavily_calls": tavily.calls if tavily else None,
+        "sources": len(final.get("sources", {})),
+        "sections": len(final.get("sections", [])),
+        "checkpoint_bytes": checkpointer.stats()["bytes"] if sqlite_checkpointer else None,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Return a description of every gated metric that regressed beyond the tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        for metric in GATED_METRICS:
+            old, new = expected.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            # Small absolute values are dominated by noise, allow them some slack
+            if new > old * (1 + tolerance) and new - old > 0.05:
+                regressions.append(f"{name}: {metric} {old} -> {new} (+{(new - old) / max(old, 1e-9):.0%})")
+    return regressions
+
+
+def median_result(runs: list) -> dict:
+    """
+    Combine repeated runs of a scenario: the median of every gated metric, the rest from the first run.
+    Blocked time in particular varies a lot between runs on a busy machine.
+    """
+    result = dict(runs[0])
+    for metric in GATED_METRICS:
+        values = [run[metric] for run in runs if run.get(metric) is not None]
+        if values:
+            result[metric] = statistics.median(values)
+    return result
+
+
+def print_table(results: dict):
+    print(f"{'scenario':<14}{'wall s':>9}{'blocked s':>11}{'emits':>7}{'emit MB':>9}{'peak MB':>9}{'prompt kchars':>15}")
+    for name, result in results.items():
+        print(f"{name:<14}{result['wall_time']:>9.2f}{result['loop_blocked_time']:>11.3f}{result['emits']:>7}"
+              f"{result['emitted_state_bytes'] / 2 ** 20:>9.2f}{result['peak_memory_mb']:>9.1f}"
+              f"{result['llm_prompt_chars'] / 1000:>15.1f}")
+        for node, timing in result["nodes"].items():
+            print(f"    {node:<24}{timing['calls']:>5} calls {timing['total']:>8.3f}s total {timing['max']:>8.3f}s max")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario to run, repeatable")
+    parser.add_argument("--llm-latency", type=float, help="Override the simulated LLM latency in seconds")
+    parser.add_argument("--tavily-latency", type=float, help="Override the simulated Tavily latency in seconds")
+    parser.add_argument("--sequential-sections", action="store_true", help="Write sections one by one instead of in batch")
+    parser.add_argument("--sqlite-checkpointer", action="store_true", help="Checkpoint to SQLite instead of memory")
+    parser.add_argument("--no-memory", action="store_true", help="Do not trace memory, it slows the run down")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Fail when a gated metric regresses against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression (default 0.25)")
+    parser.add_argument("--repeat", type=int, default=1, help="Run each scenario this many times and report the "
+                                                              "median of the gated metrics (default 1)")
+    parser.add_argument("--live", action="store_true", help="Call the real providers instead of the stand-ins, "
+                                                            "needs OPENAI_API_KEY and TAVILY_API_KEY")
+    parser.add_argument("--record", metavar="CASSETTE", help="Record the provider traffic into this cassette file")
+    parser.add_argument("--replay", metavar="CASSETTE", help="Answer provider requests from this cassette file")
+    parser.add_argument("--replay-timing", choices=("instant", "original"), default="instant",
+                        help="Replay responses instantly or with their recorded timing (default instant)")
+    args = parser.parse_args()
+
+    from cassette import configure_cassette, get_cassette
+
+    if args.record:
+        configure_cassette("record", args.record)
+    elif args.replay:
+        configure_cassette("replay", args.replay, args.replay_timing)
+    fake_services = not (args.live or args.replay)
+
+    # A small untimed run first, so the first scenario does not pay for one-time setup costs
+    asyncio.run(run_scenario(Scenario(name="warm-up", sources=10, sections=1, tavily_latency=0, llm_latency=0),
+                             trace_memory=False, fake_services=fake_services))
+
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        scenario = SCENARIOS[name]
+        overrides = {"llm_latency": args.llm_latency, "tavily_latency": args.tavily_latency}
+        scenario = replace(scenario, **{k: v for k, v in overrides.items() if v is not None},
+                           batch_sections=not args.sequential_sections)
+        runs = [asyncio.run(run_scenario(scenario, trace_memory=not args.no_memory,
+                                         sqlite_checkpointer=args.sqlite_checkpointer,
+                                         fake_services=fake_services))
+                for _ in range(max(args.repeat, 1))]
+        results[name] = median_result(runs)
+
+    print_table(results)
+    cassette = get_cassette()
+    if cassette is not None:
+        cassette.close()
+        if args.replay:
+            print(f"\nReplayed {cassette.hits} responses, {cassette.misses} requests were not in the cassette.")
+        else:
+            print(f"\nRecorded {len(cassette)} responses into {args.record}.")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            print("\n".join(f"  {regression}" for regression in regressions))
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
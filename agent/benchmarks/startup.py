@@ -0,0 +1,125 @@
+"""
+Cold start benchmark of the agent package.
+
+Imports graph.py, which builds the compiled graph, in fresh interpreters with `python -X importtime` and
+reports the median import time and the modules that cost the most. Fails when the import time exceeds the
+budget, or when a module that should only be loaded on first use is imported at startup.
+
+Usage (from the agent directory):
+    python -m benchmarks.startup                                     # check against benchmarks/startup_budget.json
+    python -m benchmarks.startup --runs 10 --top 20
+    python -m benchmarks.startup --budget benchmarks/startup_budget.json --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET = os.path.join(AGENT_DIR, "benchmarks", "startup_budget.json")
+
+
+def import_profile(module: str) -> List[Tuple[str, int, int, int]]:
+    """
+    Import the module in a fresh interpreter and return (name, depth, self us, cumulative us) for every module it loaded.
+    """
+    env = {**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "benchmark"),
+           "TAVILY_API_KEY": os.getenv("TAVILY_API_KEY", "benchmark")}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=AGENT_DIR, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return modules
+
+
+def measure(module: str, runs: int) -> Dict:
+    """
+    Median import time of the module over several runs, with the modules loaded and the profile of the last run.
+    """
+    # The first run compiles bytecode and warms the OS file cache, it is not counted
+    import_profile(module)
+    totals, profile = [], []
+    for _ in range(runs):
+        profile = import_profile(module)
+        totals.append(next(cumulative for name, _, _, cumulative in profile if name == module) / 1e6)
+    return {
+        "module": module,
+        "import_seconds": round(statistics.median(totals), 4),
+        "runs": [round(total, 4) for total in totals],
+        "loaded_modules": sorted({name for name, _, _, _ in profile}),
+        "profile": profile,
+    }
+
+
+def check_budget(result: Dict, budget: Dict) -> List[str]:
+    """
+    Return a description of every way the result exceeds the budget.
+    """
+    violations = []
+    if result["import_seconds"] > budget["import_seconds"]:
+        violations.append(f"import of {result['module']} took {result['import_seconds']:.3f}s, "
+                          f"the budget is {budget['import_seconds']:.3f}s")
+    loaded = set(result["loaded_modules"])
+    for name in budget.get("lazy_modules", []):
+        if name in loaded:
+            violations.append(f"{name} is imported at startup, it should only be loaded on first use")
+    return violations
+
+
+def print_report(result: Dict, top: int):
+    print(f"import {result['module']}: {result['import_seconds']:.3f}s median over {len(result['runs'])} runs "
+          f"({', '.join(f'{total:.3f}' for total in result['runs'])})")
+    print("\nSlowest imports of the last run (cumulative):")
+    # The module's imports are listed right before it, the interpreter's own startup imports come earlier
+    end = max(i for i, entry in enumerate(result["profile"]) if entry[0] == result["module"] and entry[1] == 0)
+    start = end
+    while start > 0 and result["profile"][start - 1][1] > 0:
+        start -= 1
+    first_level = [entry for entry in result["profile"][start:end] if entry[1] == 1]
+    for name, _, _, cumulative in sorted(first_level, key=lambda entry: -entry[3])[:top]:
+        print(f"    {name:<44}{cumulative / 1000:>9.1f} ms")
+    print("\nSlowest modules of the last run (self):")
+    for name, _, self_us, _ in sorted(result["profile"], key=lambda entry: -entry[2])[:top]:
+        print(f"    {name:<44}{self_us / 1000:>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="graph", help="Module to import (default graph)")
+    parser.add_argument("--runs", type=int, default=5, help="Number of timed imports (default 5)")
+    parser.add_argument("--top", type=int, default=10, help="Number of modules listed in the report (default 10)")
+    parser.add_argument("--budget", default=DEFAULT_BUDGET, help="Budget file to check against, empty to skip")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    result = measure(args.module, args.runs)
+    print_report(result, args.top)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({key: value for key, value in result.items() if key != "profile"}, f, indent=2)
+
+    if args.budget:
+        with open(args.budget) as f:
+            violations = check_budget(result, json.load(f))
+        if violations:
+            print("\nStartup budget exceeded:")
+            print("\n".join(f"  {violation}" for violation in violations))
+            sys.exit(1)
+        print("\nWithin the startup budget.")
+
+
+if __name__ == "__main__":
+    main()
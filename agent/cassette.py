@@ -0,0 +1,251 @@
+import asyncio
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from llm_cache import normalize_prompt
+
+# Description: Record and replay of provider HTTP traffic, for deterministic runs of recorded sessions
+
+# off, record or replay
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", ".cache/cassette.jsonl.gz")
+# instant, or original to replay responses and streamed chunks with their recorded timing
+CASSETTE_TIMING = os.getenv("CASSETTE_TIMING", "instant").lower()
+
+# Response headers worth replaying, the others are per request noise or account details
+KEPT_HEADERS = ("content-type", "content-encoding", "retry-after", "retry-after-ms")
+# Parts of request bodies that change between runs of the same session
+VOLATILE_BODY_PATTERNS = (
+    (re.compile(r"call_[A-Za-z0-9]{8,}"), "call_<id>"),
+    (re.compile(r"\b\d{2}-\d{4}\b"), "<month>"),
+)
+
+
+class CassetteMiss(httpx.RequestError):
+    pass
+
+
+def request_key(request: httpx.Request) -> str:
+    """
+    Identify a request by its method, URL and body, ignoring credentials and volatile parts of the body.
+    """
+    body = request.content.decode("utf-8", errors="replace")
+    try:
+        data = json.loads(body)
+        if isinstance(data, dict):
+            data.pop("api_key", None)
+        body = json.dumps(data, sort_keys=True)
+    except ValueError:
+        pass
+    body = normalize_prompt(body)
+    for pattern, replacement in VOLATILE_BODY_PATTERNS:
+        body = pattern.sub(replacement, body)
+    url = request.url.copy_with(query=None)
+    query = sorted((k, v) for k, v in request.url.params.multi_items() if k != "api_key")
+    return hashlib.sha256(f"{request.method} {url} {query} {body}".encode("utf-8")).hexdigest()
+
+
+def _encode_chunk(delay: float, chunk: bytes) -> list:
+    try:
+        return [round(delay, 4), chunk.decode("utf-8")]
+    except UnicodeDecodeError:
+        return [round(delay, 4), base64.b64encode(chunk).decode("ascii"), 1]
+
+
+def _decode_chunk(entry: list) -> bytes:
+    return base64.b64decode(entry[1]) if len(entry) > 2 else entry[1].encode("utf-8")
+
+
+class Cassette:
+    """
+    Gzipped JSON lines file with one recorded interaction per line: the request key, the response status and
+    headers, the time to the response headers and every body chunk with its delay. Identical requests are
+    replayed in the order they were recorded.
+    """
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._interactions: Dict[str, List[dict]] = defaultdict(list)
+        self._positions: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._file = None
+
+        if mode == "record":
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = gzip.open(path, "wt", encoding="utf-8")
+        else:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        self._interactions[interaction["key"]].append(interaction)
+
+    def __len__(self):
+        return sum(len(interactions) for interactions in self._interactions.values())
+
+    def record(self, interaction: dict):
+        with self._lock:
+            self._interactions[interaction["key"]].append(interaction)
+            if self._file is not None:
+                self._file.write(json.dumps(interaction, separators=(",", ":")) + "\n")
+                self._file.flush()
+
+    def next(self, key: str) -> Optional[dict]:
+        """
+        Return the next recorded interaction for the request key, repeating the last one once they are used up.
+        """
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if not interactions:
+                self.misses += 1
+                return None
+            position = self._positions[key]
+            self._positions[key] = position + 1
+            self.hits += 1
+            return interactions[min(position, len(interactions) - 1)]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+        self.chunks = []
+        self.last = time.monotonic()
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            now = time.monotonic()
+            self.chunks.append(_encode_chunk(now - self.last, chunk))
+            self.last = now
+            yield chunk
+
+    async def aclose(self):
+        # Recorded on close rather than at the end of the body, SSE consumers stop reading at their end marker
+        await self.stream.aclose()
+        if self.on_close is not None:
+            self.on_close(self.chunks)
+            self.on_close = None
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: List[list], timed: bool):
+        self.chunks = chunks
+        self.timed = timed
+
+    async def __aiter__(self):
+        for entry in self.chunks:
+            if self.timed and entry[0] > 0:
+                await asyncio.sleep(entry[0])
+            yield _decode_chunk(entry)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    Sends requests through the wrapped transport and records every response into the cassette.
+    """
+    def __init__(self, transport: httpx.AsyncBaseTransport, cassette: Cassette, provider: str):
+        self.transport = transport
+        self.cassette = cassette
+        self.provider = provider
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request)
+        started = time.monotonic()
+        response = await self.transport.handle_async_request(request)
+        interaction = {
+            "key": key,
+            "provider": self.provider,
+            "method": request.method,
+            "url": str(request.url.copy_with(query=None)),
+            "status": response.status_code,
+            "headers": [[k, v] for k, v in response.headers.items() if k.lower() in KEPT_HEADERS],
+            "ttfb": round(time.monotonic() - started, 4),
+        }
+
+        def on_close(chunks):
+            self.cassette.record({**interaction, "chunks": chunks})
+
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=_RecordingStream(response.stream, on_close), extensions=response.extensions)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Answers requests from the cassette without any network access, instantly or with the recorded timing.
+    """
+    def __init__(self, cassette: Cassette, timed: bool = False):
+        self.cassette = cassette
+        self.timed = timed
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        interaction = self.cassette.next(request_key(request))
+        if interaction is None:
+            print(f"Error occurred during replay: no recorded response for {request.method} {request.url.copy_with(query=None)}")
+            raise CassetteMiss("No recorded response for this request", request=request)
+        if self.timed and interaction["ttfb"] > 0:
+            await asyncio.sleep(interaction["ttfb"])
+        return httpx.Response(interaction["status"], headers=interaction["headers"],
+                              stream=_ReplayStream(interaction["chunks"], self.timed))
+
+
+_cassette: Optional[Cassette] = None
+
+
+def configure_cassette(mode: str = CASSETTE_MODE, path: str = CASSETTE_PATH, timing: str = CASSETTE_TIMING):
+    """
+    Switch recording or replay on or off for the clients created from now on.
+    """
+    global _cassette, CASSETTE_MODE, CASSETTE_TIMING
+    if _cassette is not None:
+        _cassette.close()
+        _cassette = None
+    CASSETTE_MODE, CASSETTE_TIMING = mode.lower(), timing.lower()
+    if CASSETTE_MODE in ("record", "replay"):
+        _cassette = Cassette(path, CASSETTE_MODE)
+
+
+@atexit.register
+def _close_cassette():
+    if _cassette is not None:
+        _cassette.close()
+
+
+def get_cassette() -> Optional[Cassette]:
+    if _cassette is None and CASSETTE_MODE in ("record", "replay"):
+        configure_cassette(CASSETTE_MODE, CASSETTE_PATH, CASSETTE_TIMING)
+    return _cassette
+
+
+def wrap_transport(provider: str, transport: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+    """
+    Record the provider's traffic through the transport, or replace the transport with the recording, per CASSETTE_MODE.
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return transport
+    if cassette.mode == "record":
+        return RecordingTransport(transport, cassette, provider)
+    return ReplayTransport(cassette, timed=CASSETTE_TIMING == "original")
@@ -0,0 +1,400 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+# Description: SQLite checkpointer for ResearchState that stores sources, sections and messages once by hash
+
+# Channels stored item by item in a content-addressed table. Steps usually change a few items of these
+# collections, so the unchanged items are not written again.
+SHARED_CHANNELS = ("sources", "sections", "messages")
+# Serialized values at least this large are zlib-compressed
+COMPRESS_MIN_BYTES = int(os.getenv("CHECKPOINT_COMPRESS_MIN_BYTES", 512))
+# Serialized objects kept in memory, so resuming a thread does not read them from disk again
+OBJECT_CACHE_BYTES = int(os.getenv("CHECKPOINT_OBJECT_CACHE_BYTES", 64 * 2 ** 20))
+# Digests of items written in earlier steps, looked up by the item's content so unchanged items are not serialized
+# again. The keys share the strings of the live state, their size is estimated by the serialized size of the item.
+ITEM_CACHE_BYTES = int(os.getenv("CHECKPOINT_ITEM_CACHE_BYTES", 64 * 2 ** 20))
+# (thread, hash) pairs known to be stored, so their rows are not inserted again. Entries have a fixed size.
+KNOWN_OBJECTS_MAX = 100000
+
+MANIFEST = "manifest"
+
+
+class _Unfreezable(Exception):
+    pass
+
+
+def _freeze(value: Any) -> Any:
+    """
+    Hashable, type-exact copy of a state item built from references to its values. Strings cache their hash,
+    so looking an unchanged item up is much cheaper than serializing it. Raises _Unfreezable for other objects.
+    """
+    if isinstance(value, str):
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return type(value), value
+    if isinstance(value, dict):
+        return dict, tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(_freeze(item) for item in value)
+    if hasattr(value, "__pydantic_fields__"):
+        # Messages, their fields are plain values
+        return type(value), _freeze(vars(value))
+    raise _Unfreezable(type(value).__name__)
+
+
+class ResearchCheckpointer(BaseCheckpointSaver[str]):
+    """
+    Local SQLite checkpoint saver tuned for ResearchState.
+
+    Like LangGraph's savers, only channels that changed in a step are written. The items of the
+    SHARED_CHANNELS collections are additionally stored once, keyed by the hash of their serialized form,
+    and a channel value is saved as a manifest of item hashes. Large values are compressed.
+    """
+    def __init__(self, path: str, *, serde=None):
+        super().__init__(serde=serde)
+        self.path = path
+        self._lock = threading.Lock()
+        self._known_objects: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        self._object_cache: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._object_cache_bytes = 0
+        self._item_digests: "OrderedDict[tuple, Tuple[str, int]]" = OrderedDict()
+        self._item_digests_bytes = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, parent_id TEXT, "
+            "type TEXT NOT NULL, checkpoint BLOB NOT NULL, metadata BLOB NOT NULL, "
+            "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id));"
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, channel TEXT NOT NULL, version TEXT NOT NULL, "
+            "type TEXT NOT NULL, compressed INTEGER NOT NULL, data BLOB, "
+            "PRIMARY KEY (thread_id, checkpoint_ns, channel, version));"
+            "CREATE TABLE IF NOT EXISTS writes ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, task_id TEXT NOT NULL, "
+            "idx INTEGER NOT NULL, channel TEXT NOT NULL, type TEXT NOT NULL, compressed INTEGER NOT NULL, data BLOB, "
+            "task_path TEXT NOT NULL DEFAULT '', "
+            "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx));"
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "hash TEXT PRIMARY KEY, type TEXT NOT NULL, compressed INTEGER NOT NULL, data BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS object_refs ("
+            "thread_id TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (thread_id, hash));"
+        )
+        self._conn.commit()
+
+    # Encoding
+
+    @staticmethod
+    def _compress(data: bytes) -> Tuple[int, bytes]:
+        if len(data) >= COMPRESS_MIN_BYTES:
+            return 1, zlib.compress(data, 6)
+        return 0, data
+
+    @staticmethod
+    def _decompress(compressed: int, data: bytes) -> bytes:
+        return zlib.decompress(data) if compressed else data
+
+    def _put_object(self, thread_id: str, value: Any) -> str:
+        try:
+            key = (thread_id, _freeze(value))
+        except _Unfreezable:
+            key = None
+        if key is not None and key in self._item_digests:
+            self._item_digests.move_to_end(key)
+            return self._item_digests[key][0]
+
+        type_, data = self.serde.dumps_typed(value)
+        digest = hashlib.blake2b(type_.encode("utf-8") + b"\0" + data, digest_size=16).hexdigest()
+        if (thread_id, digest) in self._known_objects:
+            self._known_objects.move_to_end((thread_id, digest))
+        else:
+            compressed, stored = self._compress(data)
+            self._conn.execute("INSERT OR IGNORE INTO objects (hash, type, compressed, data) VALUES (?, ?, ?, ?)",
+                               (digest, type_, compressed, stored))
+            self._conn.execute("INSERT OR IGNORE INTO object_refs (thread_id, hash) VALUES (?, ?)", (thread_id, digest))
+            self._known_objects[(thread_id, digest)] = None
+            while len(self._known_objects) > KNOWN_OBJECTS_MAX:
+                self._known_objects.popitem(last=False)
+        self._cache_object(digest, (type_, data))
+        if key is not None:
+            self._item_digests[key] = (digest, len(data))
+            self._item_digests_bytes += len(data)
+            while self._item_digests_bytes > ITEM_CACHE_BYTES:
+                self._item_digests_bytes -= self._item_digests.popitem(last=False)[1][1]
+        return digest
+
+    def _cache_object(self, digest: str, typed: Tuple[str, bytes]):
+        if digest in self._object_cache:
+            self._object_cache.move_to_end(digest)
+            return
+        self._object_cache[digest] = typed
+        self._object_cache_bytes += len(typed[1])
+        while self._object_cache_bytes > OBJECT_CACHE_BYTES:
+            self._object_cache_bytes -= len(self._object_cache.popitem(last=False)[1][1])
+
+    def _encode(self, thread_id: str, channel: str, value: Any) -> Tuple[str, int, bytes]:
+        """
+        Serialize a channel value into (type, compressed, data) for the blobs and writes tables.
+        """
+        if channel in SHARED_CHANNELS and isinstance(value, (dict, list)):
+            if isinstance(value, dict):
+                manifest = {"kind": "dict", "items": [[key, self._put_object(thread_id, item)] for key, item in value.items()]}
+            else:
+                manifest = {"kind": "list", "items": [self._put_object(thread_id, item) for item in value]}
+            return (MANIFEST, *self._compress(json.dumps(manifest).encode("utf-8")))
+        type_, data = self.serde.dumps_typed(value)
+        return (type_, *self._compress(data))
+
+    def _load_objects(self, digests: set) -> Dict[str, Tuple[str, bytes]]:
+        found = {digest: self._object_cache[digest] for digest in digests if digest in self._object_cache}
+        missing = list(digests - found.keys())
+        for start in range(0, len(missing), 500):
+            batch = missing[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT hash, type, compressed, data FROM objects WHERE hash IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            for digest, type_, compressed, data in rows:
+                found[digest] = (type_, self._decompress(compressed, data))
+                self._cache_object(digest, found[digest])
+        return found
+
+    def _decode_many(self, rows: List[Tuple[str, int, bytes]]) -> List[Any]:
+        """
+        Deserialize (type, compressed, data) rows, loading the objects of all manifests in one pass.
+        """
+        manifests = [json.loads(self._decompress(compressed, data)) if type_ == MANIFEST else None
+                     for type_, compressed, data in rows]
+        digests = set()
+        for manifest in manifests:
+            if manifest is not None:
+                digests.update(item[1] if manifest["kind"] == "dict" else item for item in manifest["items"])
+        objects = self._load_objects(digests) if digests else {}
+
+        values = []
+        for (type_, compressed, data), manifest in zip(rows, manifests):
+            if manifest is None:
+                values.append(self.serde.loads_typed((type_, self._decompress(compressed, data))))
+            elif manifest["kind"] == "dict":
+                values.append({key: self.serde.loads_typed(objects[digest]) for key, digest in manifest["items"]})
+            else:
+                values.append([self.serde.loads_typed(objects[digest]) for digest in manifest["items"]])
+        return values
+
+    # Reads
+
+    def _load_tuple(self, thread_id: str, checkpoint_ns: str, row) -> CheckpointTuple:
+        checkpoint_id, parent_id, type_, checkpoint_data, metadata_data = row
+        checkpoint = self.serde.loads_typed((type_, checkpoint_data))
+        metadata = json.loads(metadata_data)
+
+        versions = checkpoint["channel_versions"]
+        blob_rows = []
+        if versions:
+            blob_rows = self._conn.execute(
+                "SELECT channel, version, type, compressed, data FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? "
+                f"AND (channel, version) IN (VALUES {','.join('(?, ?)' for _ in versions)})",
+                (thread_id, checkpoint_ns, *(str(v) for item in versions.items() for v in item)),
+            ).fetchall()
+        blob_rows = [r for r in blob_rows if r[2] != "empty"]
+        channel_values = dict(zip((r[0] for r in blob_rows), self._decode_many([r[2:] for r in blob_rows])))
+
+        write_rows = self._conn.execute(
+            "SELECT task_id, channel, type, compressed, data FROM writes WHERE thread_id = ? AND checkpoint_ns = ? "
+            "AND checkpoint_id = ? ORDER BY task_path, task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        write_values = self._decode_many([r[2:] for r in write_rows])
+
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=metadata,
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=[(r[0], r[1], value) for r, value in zip(write_rows, write_values)],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self._conn.execute(
+                    "SELECT checkpoint_id, parent_id, type, checkpoint, metadata FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT checkpoint_id, parent_id, type, checkpoint, metadata FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            if row is None:
+                return None
+            return self._load_tuple(thread_id, checkpoint_ns, row)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        query = "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata FROM checkpoints"
+        clauses, params = [], []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            clauses.append("checkpoint_id < ?")
+            params.append(before_id)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        for row in rows:
+            if filter and not all(json.loads(row[6]).get(k) == v for k, v in filter.items()):
+                continue
+            if limit is not None:
+                if limit <= 0:
+                    break
+                limit -= 1
+            with self._lock:
+                yield self._load_tuple(row[0], row[1], row[2:])
+
+    # Writes
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        stored = checkpoint.copy()
+        values = stored.pop("channel_values")
+        type_, data = self.serde.dumps_typed(stored)
+        with self._lock:
+            # Only channels that changed in this step are written, the others point to earlier versions
+            for channel, version in new_versions.items():
+                if channel in values:
+                    blob = self._encode(thread_id, channel, values[channel])
+                else:
+                    blob = ("empty", 0, None)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, type, compressed, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, channel, str(version), *blob),
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"), type_, data,
+                 json.dumps(get_checkpoint_metadata(config, metadata), default=str)),
+            )
+            self._conn.commit()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with self._lock:
+            for idx, (channel, value) in enumerate(writes):
+                write_idx = WRITES_IDX_MAP.get(channel, idx)
+                # Special writes (errors, interrupts) replace earlier ones, regular writes are only saved once
+                verb = "INSERT OR REPLACE" if write_idx < 0 else "INSERT OR IGNORE"
+                self._conn.execute(
+                    f"{verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, compressed, data, task_path) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint_id, task_id, write_idx, channel,
+                     *self._encode(thread_id, channel, value), task_path),
+                )
+            self._conn.commit()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            for table in ("checkpoints", "blobs", "writes", "object_refs"):
+                self._conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            # Objects are shared between threads, drop only those no thread refers to anymore
+            self._conn.execute("DELETE FROM objects WHERE hash NOT IN (SELECT hash FROM object_refs)")
+            self._conn.commit()
+            self._known_objects = OrderedDict((key, None) for key in self._known_objects if key[0] != thread_id)
+            self._item_digests = OrderedDict((key, entry) for key, entry in self._item_digests.items() if key[0] != thread_id)
+            self._item_digests_bytes = sum(size for _, size in self._item_digests.values())
+            self._object_cache.clear()
+            self._object_cache_bytes = 0
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # Async variants. SQLite calls are short, they run in a worker thread to keep the event loop free.
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        for item in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit))):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ("checkpoints", "blobs", "writes", "objects")}
+        size = sum(os.path.getsize(path) for path in (self.path, f"{self.path}-wal") if os.path.exists(path))
+        return {**counts, "bytes": size}
+
+
+def get_checkpointer() -> Optional[ResearchCheckpointer]:
+    """
+    Return a ResearchCheckpointer when CHECKPOINT_DB_PATH is set. Otherwise the graph is compiled without
+    one and uses the checkpointer provided by the LangGraph server.
+    """
+    path = os.getenv("CHECKPOINT_DB_PATH")
+    return ResearchCheckpointer(path) if path else None
@@ -0,0 +1,174 @@
+import atexit
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+import httpx
+
+# Description: Shared, lazily created LLM and Tavily clients with pooled HTTP connections
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 100))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+
+# Request timeouts in seconds, per provider
+TIMEOUTS = {
+    "openai": float(os.getenv("OPENAI_TIMEOUT", 120)),
+    "tavily": float(os.getenv("TAVILY_TIMEOUT", 30)),
+}
+
+
+class ClientRegistry:
+    """
+    Creates every client on first use and shares it across graph.py and the tools.
+    Each provider gets one HTTP connection pool, so connections and TLS sessions are reused between calls.
+    """
+    def __init__(self):
+        self._async_http: Dict[str, httpx.AsyncClient] = {}
+        self._sync_http: Dict[str, httpx.Client] = {}
+        self._chat_models: Dict[str, object] = {}
+        self._llm_metrics = None
+        self._tavily = None
+        self._transports: Dict[str, httpx.AsyncBaseTransport] = {}
+        self._lock = threading.Lock()
+
+    def set_transport(self, provider: str, transport: Optional[httpx.AsyncBaseTransport]):
+        """
+        Route a provider's async requests through a custom transport, e.g. a local stand-in for benchmarks.
+        Must be called before the provider's clients are first used.
+        """
+        if transport is None:
+            self._transports.pop(provider, None)
+        else:
+            self._transports[provider] = transport
+
+    def _client_options(self, provider: str) -> dict:
+        return {
+            "limits": httpx.Limits(
+                max_connections=HTTP_POOL_SIZE,
+                max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            "timeout": httpx.Timeout(TIMEOUTS[provider], connect=10.0),
+        }
+
+    def _async_transport(self, provider: str) -> httpx.AsyncBaseTransport:
+        """
+        The provider's transport, behind the process-wide rate limiter shared by every session, and recorded or
+        replayed when CASSETTE_MODE is set.
+        """
+        from cassette import wrap_transport
+        from request_scheduler import ScheduledTransport, get_scheduler
+
+        transport = self._transports.get(provider) or httpx.AsyncHTTPTransport(limits=self._client_options(provider)["limits"])
+        # Recorded sessions are captured below the rate limiter, and replayed through it like live traffic
+        transport = wrap_transport(provider, transport)
+        scheduler = get_scheduler(provider)
+        return ScheduledTransport(transport, scheduler) if scheduler else transport
+
+    def async_http_client(self, provider: str) -> httpx.AsyncClient:
+        with self._lock:
+            if provider not in self._async_http:
+                self._async_http[provider] = httpx.AsyncClient(
+                    transport=self._async_transport(provider), **self._client_options(provider)
+                )
+            return self._async_http[provider]
+
+    def http_client(self, provider: str) -> httpx.Client:
+        """
+        Synchronous client, it bypasses the scheduler: it only serves synchronous ChatOpenAI calls, which the agent
+        does not make, and the asyncio scheduler cannot hold back a caller that is not on the event loop.
+        """
+        with self._lock:
+            if provider not in self._sync_http:
+                self._sync_http[provider] = httpx.Client(**self._client_options(provider))
+            return self._sync_http[provider]
+
+    def chat_model(self, model: str = "gpt-4o-mini", **kwargs):
+        """
+        Return a shared ChatOpenAI instance for the given model and parameters.
+        """
+        key = json.dumps({"model": model, **kwargs}, sort_keys=True, default=str)
+        if key not in self._chat_models:
+            from langchain_openai import ChatOpenAI
+            from metrics import llm_callback_handler
+
+            if self._llm_metrics is None:
+                self._llm_metrics = llm_callback_handler()
+            chat_model = ChatOpenAI(
+                model=model,
+                timeout=TIMEOUTS["openai"],
+                http_client=self.http_client("openai"),
+                http_async_client=self.async_http_client("openai"),
+                # Report token usage on streamed responses too, and record latency and tokens of every call
+                stream_usage=True,
+                callbacks=[self._llm_metrics],
+                **kwargs,
+            )
+            with self._lock:
+                self._chat_models.setdefault(key, chat_model)
+        return self._chat_models[key]
+
+    def tavily(self):
+        """
+        Return the shared AsyncTavilyClient.
+        """
+        if self._tavily is None:
+            from tavily import AsyncTavilyClient
+
+            http_client = httpx.AsyncClient(
+                base_url="https://api.tavily.com", transport=self._async_transport("tavily"), **self._client_options("tavily")
+            )
+            try:
+                tavily_client = AsyncTavilyClient(client=http_client)
+            except TypeError:
+                # Older tavily-python releases do not accept an external HTTP client
+                tavily_client = AsyncTavilyClient()
+            with self._lock:
+                if self._tavily is None:
+                    self._async_http["tavily"] = http_client
+                    self._tavily = tavily_client
+        return self._tavily
+
+    async def aclose(self):
+        """
+        Close every HTTP connection pool. Clients are recreated on next use.
+        """
+        with self._lock:
+            async_clients = list(self._async_http.values())
+            sync_clients = list(self._sync_http.values())
+            self._async_http.clear()
+            self._sync_http.clear()
+            self._chat_models.clear()
+            self._tavily = None
+        for client in async_clients:
+            await client.aclose()
+        for client in sync_clients:
+            client.close()
+
+    def close(self):
+        """
+        Close the synchronous connection pools, used at interpreter exit when no event loop is available.
+        """
+        with self._lock:
+            sync_clients = list(self._sync_http.values())
+            self._sync_http.clear()
+        for client in sync_clients:
+            client.close()
+
+
+clients = ClientRegistry()
+atexit.register(clients.close)
+
+
+def get_chat_model(model: str = "gpt-4o-mini", **kwargs):
+    return clients.chat_model(model, **kwargs)
+
+
+def get_tavily_client():
+    return clients.tavily()
+
+
+async def aclose_clients():
+    await clients.aclose()
@@ -1,11 +1,33 @@
-from langchain_openai import ChatOpenAI
+from typing import Optional
+
+from clients import get_chat_model
 
 # Description: Configuration file
 class Config:
     def __init__(self):
         """
-        Initializes the configuration for the agent
+        Initializes the configuration for the agent. The LLMs are created on first use and shared
+        through the client registry.
         """
-        self.BASE_LLM = ChatOpenAI(model="gpt-4", temperature=0.2)
-        self.FACTUAL_LLM = ChatOpenAI(model="gpt-4o-mini", temperature=0.0)
-        self.DEBUG = False
\ No newline at end of file
+        self.DEBUG = False
+
+    @property
+    def BASE_LLM(self):
+        return get_chat_model("gpt-4", temperature=0.2)
+
+    @property
+    def FACTUAL_LLM(self):
+        return get_chat_model("gpt-4o-mini", temperature=0.0)
+
+
+_config: Optional[Config] = None
+
+
+def get_config() -> Config:
+    """
+    Return the shared configuration, created on first use.
+    """
+    global _config
+    if _config is None:
+        _config = Config()
+    return _config
@@ -0,0 +1,141 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+import zlib
+from typing import Optional
+
+# Description: Content-addressed store for extracted page bodies
+
+PREVIEW_LENGTH = 280
+# Blobs neither written nor read for this many days are removed when the store is opened. Spilled sources and
+# checkpoints refer to blobs by digest, so keep this longer than threads are resumed after. 0 keeps blobs forever
+CONTENT_STORE_MAX_AGE_DAYS = float(os.getenv("CONTENT_STORE_MAX_AGE_DAYS", 0))
+
+
+class ContentStore:
+    """
+    Stores text blobs once on disk, keyed by their sha256 digest and zlib-compressed.
+    Reads are served through a memory map so large bodies are not copied twice.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, text: str) -> str:
+        """
+        Save the text if it is not stored yet and return its digest.
+        """
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not self._refresh(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partial blob
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(data, 6))
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        """
+        Load the text stored under the digest, or None if it is missing.
+        """
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return ""
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    text = zlib.decompress(mm).decode("utf-8")
+        except FileNotFoundError:
+            return None
+        self._refresh(path)
+        return text
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+    def touch(self, digest: str) -> bool:
+        """
+        Mark the blob as used now, so it is not collected. Returns False if it is missing.
+        """
+        return self._refresh(self._path(digest))
+
+    @staticmethod
+    def _refresh(path: str) -> bool:
+        """
+        Mark the blob as used now, so collect_garbage() keeps it. Returns False if it does not exist.
+        """
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError:
+            # A read-only store is still readable, its blobs just never age
+            return os.path.exists(path)
+
+    def collect_garbage(self, max_age: float) -> int:
+        """
+        Remove the blobs that were neither written nor read in the last max_age seconds and return how many.
+        Blobs are shared by every thread and checkpoint, so they are only ever reclaimed by age.
+        """
+        cutoff = time.time() - max_age
+        removed = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+_content_store: Optional[ContentStore] = None
+
+
+def get_content_store() -> ContentStore:
+    """
+    Return the process-wide content store, creating it on first use.
+    """
+    global _content_store
+    if _content_store is None:
+        _content_store = ContentStore(os.getenv("CONTENT_STORE_PATH", ".cache/content"))
+        if CONTENT_STORE_MAX_AGE_DAYS > 0:
+            threading.Thread(target=_content_store.collect_garbage, args=(CONTENT_STORE_MAX_AGE_DAYS * 86400,),
+                             daemon=True).start()
+    return _content_store
+
+
+def make_content_ref(text: str) -> dict:
+    """
+    Store the text and return the small reference that is kept in state instead of the body.
+    """
+    digest = get_content_store().put(text)
+    return {
+        "digest": digest,
+        "length": len(text),
+        "preview": text[:PREVIEW_LENGTH],
+    }
+
+
+def load_raw_content(source: dict) -> str:
+    """
+    Return the extracted body of a source, loading it from the content store when state only holds a reference.
+    """
+    if source.get("raw_content"):
+        return source["raw_content"]
+    ref = source.get("raw_content_ref")
+    if not ref:
+        return ""
+    return get_content_store().get(ref["digest"]) or ref.get("preview", "")
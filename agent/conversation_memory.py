@@ -0,0 +1,132 @@
+import os
+from collections import OrderedDict
+from typing import List, Optional
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage, ToolMessage
+
+# Description: Bounded view of the conversation sent to the router, older turns are folded into a running summary
+
+# Number of most recent turns, each starting at a user message, that are sent verbatim
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", 4))
+# Tool outputs the model has already answered to are cut to this many characters
+TOOL_OUTPUT_MAX_CHARS = int(os.getenv("TOOL_OUTPUT_MAX_CHARS", 500))
+MEMORY_SUMMARY_MAX_CHARS = int(os.getenv("MEMORY_SUMMARY_MAX_CHARS", 4000))
+SUMMARY_ITEM_CHARS = 300
+SUMMARY_CACHE_SIZE = 256
+
+# Running summaries keyed by the id of the last message they cover. Message ids are unique, so a key
+# also identifies every turn before it and a summary only has to be extended with the turns folded since.
+_summary_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+def _clip(text: str, limit: int = SUMMARY_ITEM_CHARS) -> str:
+    text = " ".join(text.split())
+    return text[:limit] + ("..." if len(text) > limit else "")
+
+
+def split_turns(messages: List[AnyMessage]) -> List[List[AnyMessage]]:
+    """
+    Group messages into turns, each starting at a user message. Tool calls and their results never
+    cross a turn boundary.
+    """
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def summarize_turn(turn: List[AnyMessage]) -> str:
+    """
+    One entry of the running summary: the user's request, the tools used and the assistant's last reply.
+    """
+    request = next((_text(m.content) for m in turn if isinstance(m, HumanMessage)), "")
+    tools = [call["name"] for m in turn if isinstance(m, AIMessage) for call in m.tool_calls]
+    reply = next((_text(m.content) for m in reversed(turn) if isinstance(m, AIMessage) and _text(m.content).strip()), "")
+    lines = [f"- User: {_clip(request)}"] if request else []
+    if tools:
+        lines.append(f"  Tools used: {', '.join(dict.fromkeys(tools))}")
+    if reply:
+        lines.append(f"  Assistant: {_clip(reply)}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _cap_summary(summary: str) -> str:
+    if len(summary) <= MEMORY_SUMMARY_MAX_CHARS:
+        return summary
+    # Drop the oldest entries first, cutting at a line boundary
+    tail = summary[-MEMORY_SUMMARY_MAX_CHARS:]
+    return "[earlier turns omitted]\n" + tail[tail.find("\n") + 1:]
+
+
+def running_summary(turns: List[List[AnyMessage]]) -> str:
+    """
+    Summary of the given turns, extending the longest cached summary of a prefix of them.
+    """
+    summary, start = "", 0
+    for i in range(len(turns) - 1, -1, -1):
+        key = turns[i][-1].id
+        if key and key in _summary_cache:
+            _summary_cache.move_to_end(key)
+            summary, start = _summary_cache[key], i + 1
+            break
+    for turn in turns[start:]:
+        summary = _cap_summary(summary + summarize_turn(turn))
+        if turn[-1].id:
+            _summary_cache[turn[-1].id] = summary
+            while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+                _summary_cache.popitem(last=False)
+    return summary
+
+
+def stub_tool_output(message: ToolMessage) -> ToolMessage:
+    content = _text(message.content)
+    if len(content) <= TOOL_OUTPUT_MAX_CHARS:
+        return message
+    omitted = len(content) - TOOL_OUTPUT_MAX_CHARS
+    return message.model_copy(update={
+        "content": f"{content[:TOOL_OUTPUT_MAX_CHARS]}\n[... {omitted} more characters of {message.name or 'tool'} output omitted]"
+    })
+
+
+def compact_messages(messages: List[AnyMessage], recent_turns: Optional[int] = None) -> List[AnyMessage]:
+    """
+    Messages to send to the router: the most recent turns, at least one, preceded by a summary of the older ones.
+    Tool outputs the model has already responded to are cut short, their content lives in the state anyway.
+    """
+    recent_turns = MEMORY_RECENT_TURNS if recent_turns is None else recent_turns
+    turns = split_turns(messages)
+    split = max(len(turns) - max(recent_turns, 1), 0)
+    older, recent = turns[:split], turns[split:]
+
+    compacted = []
+    summary = running_summary(older) if older else ""
+    if summary:
+        compacted.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
+
+    recent_messages = [message for turn in recent for message in turn]
+    last_ai = max((i for i, message in enumerate(recent_messages) if isinstance(message, AIMessage)), default=-1)
+    for i, message in enumerate(recent_messages):
+        compacted.append(stub_tool_output(message) if isinstance(message, ToolMessage) and i < last_ai else message)
+    return compacted
+
+
+def tool_messages_view(messages: List[AnyMessage]) -> dict:
+    """
+    The messages struct tools read from the state: the content of the last user message and of the last
+    message of any other type.
+    """
+    view = {}
+    for message in reversed(messages):
+        key = 'HumanMessage' if type(message) == HumanMessage else 'AIMessage'
+        view.setdefault(key, message.content)
+        if len(view) == 2:
+            break
+    return view
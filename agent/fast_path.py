@@ -0,0 +1,67 @@
+import os
+import uuid
+from typing import Callable, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from metrics import ROUTER_CALLS_SAVED
+from section_store import SectionStore
+
+# Description: Rule-based routing of predictable steps, taken without a router LLM call
+
+FAST_PATH_ROUTING = os.getenv("FAST_PATH_ROUTING", "false").lower() in ("1", "true", "yes")
+
+REPORT_DONE_MESSAGE = "I have completed the report. Would you like me to change anything?"
+
+
+def _pending_sections(state: dict) -> List[int]:
+    store = SectionStore.from_state(state)
+    return [idx for idx in range(len(state.get("outline", {}))) if idx not in store]
+
+
+def _tool_call(name: str, args: dict) -> AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:24]}"}])
+
+
+def write_approved_sections(state: dict) -> Optional[AIMessage]:
+    """
+    The user approved the outline without remarks: write every approved section.
+    """
+    last_message = state["messages"][-1]
+    proposal = state.get("proposal", {})
+    if not isinstance(last_message, SystemMessage) or not proposal.get("approved") or proposal.get("remarks"):
+        return None
+    if not _pending_sections(state):
+        return None
+    research_query = next((m.content for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), "")
+    return _tool_call("section_batch_writer", {"research_query": str(research_query)})
+
+
+def confirm_report_done(state: dict) -> Optional[AIMessage]:
+    """
+    The batch writer wrote every section of the outline: only a short confirmation is left to send.
+    """
+    last_message = state["messages"][-1]
+    if not isinstance(last_message, ToolMessage) or last_message.name != "section_batch_writer":
+        return None
+    if "Error" in str(last_message.content) or _pending_sections(state):
+        return None
+    return AIMessage(content=REPORT_DONE_MESSAGE)
+
+
+# Checked in order, the first rule that returns a message decides the step
+RULES: Tuple[Callable[[dict], Optional[AIMessage]], ...] = (write_approved_sections, confirm_report_done)
+
+
+def fast_route(state: dict) -> Optional[AIMessage]:
+    """
+    Return the router's next message when a rule determines it, or None when the router LLM must decide.
+    """
+    if not FAST_PATH_ROUTING or not state.get("messages"):
+        return None
+    for rule in RULES:
+        message = rule(state)
+        if message is not None:
+            ROUTER_CALLS_SAVED.inc(rule=rule.__name__)
+            return message
+    return None
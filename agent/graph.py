@@ -7,19 +7,29 @@ from langchain_core.messages import AIMessage, SystemMessage, HumanMessage, Tool
 from langgraph.graph import StateGraph
 from langgraph.types import Command, interrupt
 from langchain_core.runnables import RunnableConfig
-from copilotkit.langchain import copilotkit_emit_state, copilotkit_customize_config
+from copilotkit.langchain import copilotkit_customize_config
 from langchain_core.tools import tool
 
+# Loaded once, before the agent's modules read their settings from the environment at import
+load_dotenv('.env')
+
 from state import ResearchState
-from config import Config
+from config import get_config
+from checkpointer import get_checkpointer
+from conversation_memory import compact_messages, tool_messages_view
+from fast_path import fast_route
+from metrics import InstrumentedTool, instrument_node
+from state_emitter import StateEmitter, set_state_emitter, reset_state_emitter
+from request_scheduler import request_context, reset_request_session, set_request_session
+from section_store import SectionStore
+from source_memory import enforce_source_limits
+from speculative_drafts import start_drafts, take_drafts
+from prompt_builder import SYSTEM_PROMPT_TOKEN_BUDGET, build_report, find_focus_section, log_prompt_usage, render_outline
+from tokens import count_tokens
 from tools.tavily_search import tavily_search
 from tools.tavily_extract import tavily_extract
 from tools.outline_writer import outline_writer
-from tools.section_writer import section_writer
-
-load_dotenv('.env')
-
-cfg = Config()
+from tools.section_writer import section_writer, section_batch_writer
 
 @tool
 def review_proposal(proposal: str) -> str:
@@ -40,8 +50,8 @@ class ResearchAgent:
         """
         Initialize the available tools and create a name-to-tool mapping.
         """
-        self.tools = [tavily_search, tavily_extract, outline_writer, section_writer, review_proposal]
-        self.tools_by_name = {tool.name: tool for tool in self.tools} # for easy lookup
+        self.tools = [tavily_search, tavily_extract, outline_writer, section_writer, section_batch_writer, review_proposal]
+        self.tools_by_name = {tool.name: InstrumentedTool(tool) for tool in self.tools} # for easy lookup, records tool metrics
 
     def _build_workflow(self):
         """
@@ -49,10 +59,10 @@ class ResearchAgent:
         """
         workflow = StateGraph(ResearchState)
         
-        # Add nodes
-        workflow.add_node("call_model_node", self.call_model_node)
-        workflow.add_node("tool_node", self.tool_node)
-        workflow.add_node("process_feedback_node", self.process_feedback_node)
+        # Add nodes, each one wrapped to record its latency and errors
+        workflow.add_node("call_model_node", instrument_node("call_model_node", self.call_model_node))
+        workflow.add_node("tool_node", instrument_node("tool_node", self.tool_node))
+        workflow.add_node("process_feedback_node", instrument_node("process_feedback_node", self.process_feedback_node))
 
         # Define graph structure
         workflow.set_entry_point("call_model_node")
@@ -60,14 +70,16 @@ class ResearchAgent:
         workflow.add_edge("tool_node", "call_model_node")
         workflow.add_edge("process_feedback_node", "call_model_node")
 
-        self.graph = workflow.compile()
+        # Use the local SQLite checkpointer when CHECKPOINT_DB_PATH is set, the LangGraph server provides one otherwise
+        self.graph = workflow.compile(checkpointer=get_checkpointer())
 
     def _build_system_prompt(self, state: ResearchState) -> str:
         """
         Build the system prompt based on current state.
         """
         outline = state.get("outline", {})
-        sections = state.get("sections", [])
+        # The store hashes sections edited on the frontend, the prompt builder caches section renderings by hash
+        sections = SectionStore.from_state(state).sections
         proposal = state.get("proposal", {})
         
         # The LLM is only aware of what it is told. When we build the system prompt, we give
@@ -80,7 +92,8 @@ class ResearchAgent:
             "2. Use the tavily_extract tool to extract additional content from relevant URLs.\n"
             "3. Use the outline_writer tool to analyze the gathered information and organize it into a clear, logical **outline proposal**. Break the content into meaningful sections that will guide the report structure. You must use the outline_writer EVERY time you need to write an outline for the report\n"
             "4. Use the review_proposal tool to review the outline proposal and get feedback from the user.\n"
-            f"5. After the review_proposal tool is called if any sections are approved, use the section_writer tool to write ONLY the sections of the report based on the **Approved Outline**{':' + str([outline[section]['title'] for section in outline]) if outline else ''} generated from the review_proposal tool. Ensure the report is well-written, properly sourced, and easy to understand. Avoid responding with the text of the report directly, always use the section_writer tool for the final product.\n\n"
+            f"5. After the review_proposal tool is called if any sections are approved, use the section_writer tool to write ONLY the sections of the report based on the **Approved Outline**{':' + str([outline[section]['title'] for section in outline]) if outline else ''} generated from the review_proposal tool. Ensure the report is well-written, properly sourced, and easy to understand. Avoid responding with the text of the report directly, always use the section_writer tool for the final product.\n"
+            "6. When several approved sections are not written yet, use the section_batch_writer tool to write all of them at once instead of calling the section_writer tool for each section. Use the section_writer tool to write or edit a single section.\n\n"
             "After using the section_writer tool, actively engage with the user to discuss next steps. **Do not summarize your completed work**, as the user has full access to the research progress.\n"
             "Instead of sharing details like generated outlines or reports, simply confirm the task is ready and ask for feedback or next steps. For example:\n"
             "'I have completed [..MAX additional 5 words]. Would you like me to [..MAX additional 5 words]?'\n\n"
@@ -88,9 +101,12 @@ class ResearchAgent:
             "Your role is to provide support, maintain clear communication, and ensure the final report aligns with the user's expectations.\n\n"
         ]
 
+        # Each optional part is tracked by name so its token usage can be logged
+        optional_parts = {"proposal": "", "outline": "", "report": ""}
+
         # If the proposal has remarks and no outline, we add the proposal to the prompt
         if proposal.get('remarks') and not outline:
-            prompt_parts.append(
+            optional_parts["proposal"] = (
                 f"**\nReviewed Proposal:**\n"
                 f"Approved: {proposal['approved']}\n"
                 f"Sections: {proposal['sections']}\n"
@@ -100,22 +116,23 @@ class ResearchAgent:
 
         # If the outline is present, we add it to the prompt
         if outline:
-            prompt_parts.append(
+            optional_parts["outline"] = (
                 f"### Current State of the Report\n"
-                f"\n**Approved Outline**:\n{outline}\n\n"
+                f"\n**Approved Outline**:\n{render_outline(outline)}\n\n"
             )
 
-        # If the sections are present, we add them to the prompt
+        # If the sections are present, we add a digest of each one to the prompt. Only the section the user is
+        # asking about is included in full, so the prompt does not grow with the report.
         if sections:
-            report_content = "\n".join(
-                f"section {section['idx']} : {section['title']}\n"
-                f"content : {section['content']}"
-                f"footer : {section['footer']}\n"
-                for section in sections
-            )
-            prompt_parts.append(f"**Report**:\n\n{report_content}")
+            last_request = next((m.content for m in reversed(state.get("messages", [])) if isinstance(m, HumanMessage)), "")
+            focus = find_focus_section(sections, last_request if isinstance(last_request, str) else "")
+            used_tokens = count_tokens("\n".join([*prompt_parts, *optional_parts.values()]))
+            report_budget = max(SYSTEM_PROMPT_TOKEN_BUDGET - used_tokens, 0)
+            optional_parts["report"] = f"**Report**:\n\n{build_report(sections, focus, report_budget)}"
+
+        log_prompt_usage([("instructions", "\n".join(prompt_parts)), *optional_parts.items()], SYSTEM_PROMPT_TOKEN_BUDGET)
 
-        return "\n".join(prompt_parts)
+        return "\n".join([*prompt_parts, *(part for part in optional_parts.values() if part)])
 
     async def call_model_node(self, state: ResearchState, config: RunnableConfig) -> Command[Literal["tool_node", "__end__"]]:
         """
@@ -127,13 +144,17 @@ class ResearchAgent:
             last_message = HumanMessage(content=last_message.content)
             state['messages'][-1] = last_message
         
-        # Call LLM
-        model = cfg.FACTUAL_LLM.bind_tools(self.tools, parallel_tool_calls=False)
-        response = await model.ainvoke([
-            SystemMessage(content=self._build_system_prompt(state)),
-            *state["messages"],
-        ], config)
-
+        # Predictable steps are taken without calling the LLM when fast-path routing is enabled
+        response = fast_route(state)
+        if response is None:
+            # Call LLM. Router turns are interactive, they go ahead of bulk requests in the provider's rate limits.
+            # Looked up at call time: the graph compiler inspects the attributes nodes read, which would create the client at import
+            model = get_config().FACTUAL_LLM.bind_tools(self.tools, parallel_tool_calls=False)
+            with request_context(priority="interactive", session=config.get("configurable", {}).get("thread_id")):
+                response = await model.ainvoke([
+                    SystemMessage(content=self._build_system_prompt(state)),
+                    *compact_messages(state["messages"]),
+                ], config)
 
         response = cast(AIMessage, response)
 
@@ -149,39 +170,56 @@ class ResearchAgent:
         """
         config = copilotkit_customize_config(config, emit_messages=False) # Disable emitting messages to the frontend since these messages will be intermediate
 
+        # All state emits of this node, including the tools' ones, go through a single emitter so
+        # bursts are coalesced and emits that change nothing are skipped.
+        emitter = StateEmitter()
+        emitter_token = set_state_emitter(emitter)
+
         msgs = []
         tool_state = {}
-        for tool_call in state["messages"][-1].tool_calls:
-            if tool_call["name"] == "review_proposal":
-                return Command(goto="process_feedback_node", update={"messages": ToolMessage(tool_call_id=tool_call["id"], content="")})
-
-            # Temporary messages struct that are accessible only to tools.
-            state['messages'] = {'HumanMessage' if type(message) == HumanMessage else 'AIMessage' : message.content for message in state['messages']}
-
-            # Add a state key to the tool call so the tool can access state
-            tool_call["args"]["state"] = state
-            
-            # Manually invoke the tool that the LLM decided to use with the args it provided.
-            # Keep in mind, the state key we added above will be apart of args.
-            tool = self.tools_by_name[tool_call["name"]]
-            new_state, tool_msg = await tool.ainvoke(tool_call["args"]) # new_state will be the result of the tool call
-
-            # Remove the state key since we don't need to commit it into the saved state
-            tool_call["args"]["state"] = None
-            msgs.append(ToolMessage(content=tool_msg, name=tool_call["name"], tool_call_id=tool_call["id"]))
-
-            # Build the tool state so we can emit it and commit it into the saved state
-            tool_state = {
-                "title": new_state.get("title", ""),
-                "outline": new_state.get("outline", {}),
-                "sections": new_state.get("sections", []),
-                "sources": new_state.get("sources", {}),
-                "proposal": new_state.get("proposal", {}),
-                "logs": new_state.get("logs", []),
-                "tool": new_state.get("tool", {}),
-                "messages": msgs
-            }
-            await copilotkit_emit_state(config, tool_state)
+        tool_calls = state["messages"][-1].tool_calls
+        # Temporary messages struct that are accessible only to tools.
+        state['messages'] = tool_messages_view(state['messages'])
+        # The tools' provider requests are queued fairly with the other sessions' ones
+        session_token = set_request_session(config.get("configurable", {}).get("thread_id"))
+        try:
+            for tool_call in tool_calls:
+                if tool_call["name"] == "review_proposal":
+                    return Command(goto="process_feedback_node", update={"messages": ToolMessage(tool_call_id=tool_call["id"], content="")})
+
+                # Add a state key to the tool call so the tool can access state
+                tool_call["args"]["state"] = state
+
+                # Manually invoke the tool that the LLM decided to use with the args it provided.
+                # Keep in mind, the state key we added above will be apart of args.
+                tool = self.tools_by_name[tool_call["name"]]
+                new_state, tool_msg = await tool.ainvoke(tool_call["args"]) # new_state will be the result of the tool call
+
+                # Remove the state key since we don't need to commit it into the saved state
+                tool_call["args"]["state"] = None
+                msgs.append(ToolMessage(content=tool_msg, name=tool_call["name"], tool_call_id=tool_call["id"]))
+                # Keep the sources committed to the state bounded, the least valuable ones are spilled to disk
+                await enforce_source_limits(new_state)
+
+                # Build the tool state so we can emit it and commit it into the saved state
+                tool_state = {
+                    "title": new_state.get("title", ""),
+                    "outline": new_state.get("outline", {}),
+                    "sections": new_state.get("sections", []),
+                    "sections_version": new_state.get("sections_version", 0),
+                    "sources": new_state.get("sources", {}),
+                    "evicted_sources": new_state.get("evicted_sources", {}),
+                    "proposal": new_state.get("proposal", {}),
+                    "logs": new_state.get("logs", []),
+                    "tool": new_state.get("tool", {}),
+                    "messages": msgs
+                }
+                # Forcing the emit supersedes any trailing emit the tool left pending
+                await emitter.emit(config, tool_state, force=True)
+        finally:
+            await emitter.flush()
+            reset_state_emitter(emitter_token)
+            reset_request_session(session_token)
 
         return tool_state
 
@@ -191,6 +229,10 @@ class ResearchAgent:
         Node for retrieving and processing feedback from the user via the frontend.
         """
 
+        # When enabled, the sections approved by default are drafted in the background while the user reviews
+        thread_id = config.get("configurable", {}).get("thread_id")
+        start_drafts(thread_id, state)
+
         # Interrupt the graph and wait for feedback. CopilotKit will render a form and wait for the user to submit it on
         # the frontend.
         reviewed_outline = interrupt(state.get("proposal", {}))
@@ -202,9 +244,18 @@ class ResearchAgent:
                         if isinstance(v, dict) and v.get('approved')}
             state['outline'] = outline
 
+        # Commit the drafts of the sections that were approved unchanged, without overwriting written sections
+        drafts = await take_drafts(thread_id, state['outline'] if reviewed_outline.get("approved") else {})
+        store = SectionStore.from_state(state)
+        drafted = [store.upsert(draft)['title'] for draft in drafts if draft['idx'] not in store]
+        store.save(state)
+
         # Update proposal and commit the state. Add a system message so the LLM knows that this interaction took place.
         state["proposal"] = reviewed_outline
-        state["messages"] = [SystemMessage(content="User has reviewed the proposal, please process their feedback and act accordingly.")]
+        feedback = "User has reviewed the proposal, please process their feedback and act accordingly."
+        if drafted:
+            feedback += f" The following sections are already written, do not write them again: {drafted}."
+        state["messages"] = [SystemMessage(content=feedback)]
         return Command(goto="call_model_node", update={**state})
 
 graph = ResearchAgent().graph
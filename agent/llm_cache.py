@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from metrics import CACHE_REQUESTS
+
+# Description: Exact-match cache for LLM responses keyed by a normalized prompt hash
+
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 60 * 60))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 256))
+LLM_CACHE_DISK_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", 5000))
+
+# Parts of a prompt that change between otherwise identical requests
+VOLATILE_PATTERNS = (
+    (re.compile(r"Today's date is \d{2}/\d{2}/\d{4}"), "Today's date is <date>"),
+    (re.compile(r'("?timestamp"?\s*:\s*)"[^"]*"'), r'\1"<timestamp>"'),
+)
+
+
+def normalize_prompt(text: str) -> str:
+    for pattern, replacement in VOLATILE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def make_prompt_key(model: str, messages: List[dict], **params) -> str:
+    """
+    Build a cache key from the model, its parameters and the OpenAI style prompt messages, ignoring volatile parts.
+    """
+    normalized = {
+        "model": model,
+        "params": params,
+        "messages": [{"role": m["role"], "content": normalize_prompt(str(m["content"]))} for m in messages],
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    LLM response cache with a TTL and least-recently-used eviction. Entries live in memory, and in a larger
+    SQLite tier too when a path is given, so they survive restarts. Values must be JSON serializable.
+    """
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl: int = LLM_CACHE_TTL, path: Optional[str] = None,
+                 disk_max_entries: int = LLM_CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+            self._conn.commit()
+
+    def _remember(self, key: str, value: Any, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str, name: str = "llm") -> Optional[Any]:
+        """
+        Return the cached value or None. name labels the hit/miss metrics.
+        """
+        now = time.time()
+        value = None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] > now:
+                self._memory.move_to_end(key)
+                value = entry[0]
+            elif self._conn is not None:
+                row = self._conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_REQUESTS.inc(cache=name, result="miss" if value is None else "hit")
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now + self.ttl)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now + self.ttl, now),
+                )
+                # Drop expired rows first, then the least recently used ones over the size limit
+                self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_max_entries,),
+                )
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._memory)}
+
+
+_llm_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """
+    Return the process-wide LLM response cache, creating it on first use. Set LLM_CACHE_PATH to also keep
+    entries on disk, and LLM_CACHE_ENABLED=false to disable caching.
+    """
+    global _llm_cache
+    if os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    if _llm_cache is None:
+        _llm_cache = LLMResponseCache(path=os.getenv("LLM_CACHE_PATH"))
+    return _llm_cache
@@ -0,0 +1,352 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from langgraph.errors import GraphBubbleUp
+
+# Description: In-process metrics with Prometheus text and OpenTelemetry (OTLP JSON) file exporters
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(9))  # 1KB .. 64MB
+RATIO_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1, 2)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[dict]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values: Dict[Labels, float] = {}
+
+    def set(self, value: float, **labels):
+        key = _labels(labels)
+        with _lock:
+            self.values[key] = value
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.values: Dict[Labels, dict] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with _lock:
+            series = self.values.setdefault(key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0})
+            series["counts"][bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+
+_lock = threading.Lock()
+_metrics: Dict[str, object] = {}
+
+
+def counter(name: str, description: str) -> Counter:
+    return _metrics.setdefault(name, Counter(name, description))
+
+
+def gauge(name: str, description: str) -> Gauge:
+    return _metrics.setdefault(name, Gauge(name, description))
+
+
+def histogram(name: str, description: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+    return _metrics.setdefault(name, Histogram(name, description, buckets))
+
+
+# Metrics recorded by the agent
+NODE_LATENCY = histogram("agent_node_latency_seconds", "Wall time of graph nodes")
+NODE_ERRORS = counter("agent_node_errors_total", "Graph node invocations that raised")
+TOOL_LATENCY = histogram("agent_tool_latency_seconds", "Wall time of tool calls")
+TOOL_ERRORS = counter("agent_tool_errors_total", "Tool calls that raised")
+LLM_LATENCY = histogram("agent_llm_latency_seconds", "Wall time of LLM calls")
+LLM_TOKENS = counter("agent_llm_tokens_total", "Prompt and completion tokens reported by the LLM provider")
+LLM_PROMPT_TOKENS = histogram("agent_llm_prompt_tokens", "Prompt tokens per LLM call", TOKEN_BUCKETS)
+STATE_EMITS = counter("agent_state_emits_total", "State emit requests by outcome (sent, skipped, coalesced)")
+STATE_EMIT_BYTES = histogram("agent_state_emit_bytes", "Approximate serialized size of each state sent to the frontend", BYTES_BUCKETS)
+CACHE_REQUESTS = counter("agent_cache_requests_total", "Cache lookups by cache and result (hit, miss)")
+SEARCH_EVENTS = counter("agent_search_executor_events_total", "Search retries, hedged requests and deadline cancellations")
+SECTION_EDITS = counter("agent_section_edits_total", "Section edits by outcome (patched, or fallback to a full rewrite)")
+SECTION_PATCH_RATIO = histogram("agent_section_patch_ratio", "Size of applied section edits relative to the full section",
+                                RATIO_BUCKETS)
+SPECULATIVE_DRAFTS = counter("agent_speculative_drafts_total",
+                             "Sections drafted during the proposal review by outcome (started, committed, discarded)")
+SCHEDULER_QUEUE_DEPTH = gauge("agent_scheduler_queue_depth", "Requests waiting for a provider's rate limits")
+SCHEDULER_WAIT = histogram("agent_scheduler_wait_seconds", "Time requests waited for a provider's rate limits")
+RATE_LIMITED_RESPONSES = counter("agent_rate_limited_responses_total", "Responses with HTTP 429 by provider")
+ROUTER_CALLS_SAVED = counter("agent_router_calls_saved_total", "Router LLM calls skipped by fast-path rules")
+SOURCE_EVICTIONS = counter("agent_source_evictions_total",
+                           "Sources by outcome (spilled out of the state, rehydrated into it, missing on rehydrate)")
+TAVILY_RESULTS = counter("agent_tavily_results_total", "Tavily search results returned and kept after score filtering")
+
+
+def instrument_node(name: str, func):
+    """
+    Wrap an async graph node so its latency and errors are recorded. The signature is kept for LangGraph.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        maybe_start_metrics_server()
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except GraphBubbleUp:
+            # Interrupts and parent commands are control flow, not errors
+            raise
+        except Exception:
+            NODE_ERRORS.inc(node=name)
+            raise
+        finally:
+            NODE_LATENCY.observe(time.perf_counter() - start, node=name)
+            await maybe_export()
+    return wrapper
+
+
+class InstrumentedTool:
+    """
+    Proxy for a LangChain tool that records the latency and errors of every ainvoke call.
+    """
+    def __init__(self, tool):
+        self._tool = tool
+
+    def __getattr__(self, item):
+        return getattr(self._tool, item)
+
+    async def ainvoke(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self._tool.ainvoke(*args, **kwargs)
+        except Exception:
+            TOOL_ERRORS.inc(tool=self._tool.name)
+            raise
+        finally:
+            TOOL_LATENCY.observe(time.perf_counter() - start, tool=self._tool.name)
+
+
+def llm_callback_handler():
+    """
+    LangChain callback handler recording LLM latency and token usage. Attached to every shared chat model.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class LLMMetricsHandler(BaseCallbackHandler):
+        def __init__(self):
+            self.started = {}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self.started[run_id] = time.perf_counter()
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            start = self.started.pop(run_id, None)
+            model = (response.llm_output or {}).get("model_name")
+            usage = {}
+            for generations in response.generations:
+                for generation in generations:
+                    message = getattr(generation, "message", None)
+                    if getattr(message, "usage_metadata", None):
+                        usage = message.usage_metadata
+                    model = model or getattr(message, "response_metadata", {}).get("model_name")
+            model = model or "unknown"
+            if start is not None:
+                LLM_LATENCY.observe(time.perf_counter() - start, model=model)
+            if usage:
+                LLM_TOKENS.inc(usage.get("input_tokens", 0), model=model, kind="prompt")
+                LLM_TOKENS.inc(usage.get("output_tokens", 0), model=model, kind="completion")
+                LLM_PROMPT_TOKENS.observe(usage.get("input_tokens", 0), model=model)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self.started.pop(run_id, None)
+
+    return LLMMetricsHandler()
+
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus() -> str:
+    """
+    Render every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            if isinstance(metric, Counter):
+                lines.append(f"# TYPE {metric.name} counter")
+                for labels, value in metric.values.items():
+                    lines.append(f"{metric.name}{_format_labels(labels)} {value}")
+            elif isinstance(metric, Gauge):
+                lines.append(f"# TYPE {metric.name} gauge")
+                for labels, value in metric.values.items():
+                    lines.append(f"{metric.name}{_format_labels(labels)} {value}")
+            else:
+                lines.append(f"# TYPE {metric.name} histogram")
+                for labels, series in metric.values.items():
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), series["counts"]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else str(bound)
+                        lines.append(f"{metric.name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_format_labels(labels)} {series['sum']}")
+                    lines.append(f"{metric.name}_count{_format_labels(labels)} {series['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def render_otlp_json() -> dict:
+    """
+    Render every metric as an OTLP JSON metrics export, the format of the OpenTelemetry collector's file exporter.
+    """
+    now = str(time.time_ns())
+
+    def attributes(labels: Labels):
+        return [{"key": k, "value": {"stringValue": v}} for k, v in labels]
+
+    otlp_metrics = []
+    with _lock:
+        for metric in _metrics.values():
+            if isinstance(metric, Counter):
+                otlp_metrics.append({"name": metric.name, "description": metric.description, "sum": {
+                    "aggregationTemporality": 2,
+                    "isMonotonic": True,
+                    "dataPoints": [{"attributes": attributes(labels), "asDouble": value, "timeUnixNano": now}
+                                   for labels, value in metric.values.items()],
+                }})
+            elif isinstance(metric, Gauge):
+                otlp_metrics.append({"name": metric.name, "description": metric.description, "gauge": {
+                    "dataPoints": [{"attributes": attributes(labels), "asDouble": value, "timeUnixNano": now}
+                                   for labels, value in metric.values.items()],
+                }})
+            else:
+                otlp_metrics.append({"name": metric.name, "description": metric.description, "histogram": {
+                    "aggregationTemporality": 2,
+                    "dataPoints": [{
+                        "attributes": attributes(labels),
+                        "count": str(series["count"]),
+                        "sum": series["sum"],
+                        "bucketCounts": [str(count) for count in series["counts"]],
+                        "explicitBounds": list(metric.buckets),
+                        "timeUnixNano": now,
+                    } for labels, series in metric.values.items()],
+                }})
+    return {"resourceMetrics": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "research-agent"}}]},
+        "scopeMetrics": [{"scope": {"name": "agent.metrics"}, "metrics": otlp_metrics}],
+    }]}
+
+
+_last_export = 0.0
+# The OTLP file is rotated to <file>.1 once it grows past this size, only one rotated file is kept
+METRICS_OTLP_MAX_BYTES = int(os.getenv("METRICS_OTLP_MAX_BYTES", 10 * 1024 * 1024))
+
+
+def _write_metric_files(prometheus_file: Optional[str], prometheus_text: str, otlp_file: Optional[str], otlp_line: str):
+    if prometheus_file:
+        tmp_path = f"{prometheus_file}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(prometheus_text)
+        os.replace(tmp_path, prometheus_file)
+    if otlp_file:
+        if os.path.exists(otlp_file) and os.path.getsize(otlp_file) >= METRICS_OTLP_MAX_BYTES:
+            os.replace(otlp_file, f"{otlp_file}.1")
+        with open(otlp_file, "a") as f:
+            f.write(otlp_line)
+
+
+async def maybe_export(force: bool = False):
+    """
+    Write the configured metric files, at most once per METRICS_EXPORT_INTERVAL seconds.
+    METRICS_PROMETHEUS_FILE is rewritten in place (for the node_exporter textfile collector) and
+    METRICS_OTLP_FILE gets one OTLP JSON export appended per line, rotated past METRICS_OTLP_MAX_BYTES.
+    The metrics are rendered on the event loop, where they are updated, and the files written from a thread.
+    """
+    global _last_export
+    prometheus_file = os.getenv("METRICS_PROMETHEUS_FILE")
+    otlp_file = os.getenv("METRICS_OTLP_FILE")
+    if not prometheus_file and not otlp_file:
+        return
+    now = time.monotonic()
+    if not force and now - _last_export < float(os.getenv("METRICS_EXPORT_INTERVAL", 15)):
+        return
+    _last_export = now
+    prometheus_text = render_prometheus() if prometheus_file else ""
+    otlp_line = json.dumps(render_otlp_json()) + "\n" if otlp_file else ""
+    try:
+        await asyncio.to_thread(_write_metric_files, prometheus_file, prometheus_text, otlp_file, otlp_line)
+    except OSError as e:
+        print(f"Error occurred while exporting metrics: {str(e)}")
+
+
+def start_metrics_server(port: int):
+    """
+    Serve the Prometheus text format on http://0.0.0.0:<port>/metrics from a background thread.
+    """
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+_metrics_server_started = False
+
+
+def maybe_start_metrics_server():
+    """
+    Start the metrics server on METRICS_PORT, if set, the first time a node runs rather than when the graph is
+    imported. A port that cannot be bound is reported and the agent runs on without the server.
+    """
+    global _metrics_server_started
+    if _metrics_server_started:
+        return
+    _metrics_server_started = True
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return
+    try:
+        start_metrics_server(int(port))
+    except (OSError, ValueError) as e:
+        print(f"Error occurred while starting the metrics server on port {port}: {str(e)}")
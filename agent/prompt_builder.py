@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from section_store import section_hash
+from tokens import count_tokens
+
+# Description: Helpers to keep the router's system prompt within a token budget
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT_TOKEN_BUDGET = int(os.getenv("SYSTEM_PROMPT_TOKEN_BUDGET", 6000))
+SUMMARY_LENGTH = 200
+
+
+# Renderings of sections keyed by their content hash, so unchanged sections are not summarized or counted again
+RENDER_CACHE_SIZE = 1024
+_render_cache: "OrderedDict[tuple, str]" = OrderedDict()
+
+
+def _cached_rendering(key: tuple, render: Callable[[], str]) -> str:
+    if key in _render_cache:
+        _render_cache.move_to_end(key)
+        return _render_cache[key]
+    rendering = _render_cache[key] = render()
+    while len(_render_cache) > RENDER_CACHE_SIZE:
+        _render_cache.popitem(last=False)
+    return rendering
+
+
+def _section_key(section: dict) -> str:
+    return section.get('hash') or section_hash(section)
+
+
+def section_digest(section: dict, with_summary: bool = True) -> str:
+    """
+    Short, cached description of a written section: title, length, content hash and an optional summary.
+    """
+    def render():
+        content = section.get('content', '')
+        # Only the text is hashed here, so the digest does not change with the section's random id
+        content_hash = hashlib.sha256(f"{section['title']}\n{content}\n{section.get('footer', '')}".encode("utf-8")).hexdigest()
+        digest = f"section {section['idx']} : {section['title']} (length: {len(content)} chars, hash: {content_hash[:12]})\n"
+        if with_summary:
+            # Strip markdown markup and keep the beginning of the section as its summary
+            text = " ".join(re.sub(r"[#*_>`|\[\]]+", " ", content).split())
+            summary = text[:SUMMARY_LENGTH] + ("..." if len(text) > SUMMARY_LENGTH else "")
+            digest += f"summary : {summary}\n"
+        return digest
+
+    return _cached_rendering(("digest", _section_key(section), with_summary), render)
+
+
+def render_section(section: dict, max_tokens: Optional[int] = None) -> str:
+    """
+    Full text of a section, optionally cut to roughly max_tokens. Cached by content hash.
+    """
+    def render():
+        content = section.get('content', '')
+        if max_tokens is not None and count_tokens(content) > max_tokens:
+            content = content[:max(max_tokens, 0) * 4] + "\n[...truncated]"
+        return (
+            f"section {section['idx']} : {section['title']}\n"
+            f"content : {content}"
+            f"footer : {section.get('footer', '')}\n"
+        )
+
+    return _cached_rendering(("section", _section_key(section), max_tokens), render)
+
+
+def render_outline(outline: dict) -> str:
+    """
+    Compact outline: one line per section with its title and description.
+    """
+    return "\n".join(
+        f"- {section.get('title', key)}: {section.get('description', '')}" for key, section in outline.items()
+    )
+
+
+def find_focus_section(sections: List[dict], last_request: str) -> Optional[dict]:
+    """
+    Return the section the user's last request is about, matched by title or by "section <idx>", if any.
+    """
+    if not last_request:
+        return None
+    request = last_request.lower()
+    for section in sections:
+        if section['title'] and section['title'].lower() in request:
+            return section
+    for section in sections:
+        if re.search(rf"\bsection\s*{section['idx']}\b", request):
+            return section
+    return None
+
+
+def build_report(sections: List[dict], focus: Optional[dict], budget: int) -> str:
+    """
+    Render the report with digests for every section and full text only for the focus section,
+    compacting further until it fits in the token budget. When even the most compact rendering does not fit,
+    the last sections are left out and replaced by a note, or the whole report when not even the note fits.
+    """
+    for with_summary, focus_tokens in ((True, None), (False, None), (False, max(budget // 2, 0))):
+        parts = [
+            render_section(section, focus_tokens) if focus is not None and section['idx'] == focus['idx']
+            else section_digest(section, with_summary)
+            for section in sections
+        ]
+        report = "\n".join(parts)
+        if count_tokens(report) <= budget:
+            return report
+
+    lines, used = [], 0
+    for i, part in enumerate(parts):
+        omitted = f"... {len(parts) - i} more sections omitted"
+        tokens = count_tokens(part)
+        # Room is kept for the note about the sections left out
+        if used + tokens + count_tokens(omitted) > budget:
+            if used + count_tokens(omitted) <= budget:
+                lines.append(omitted)
+            break
+        lines.append(part)
+        used += tokens
+    if not lines:
+        logger.warning("Report left out of the system prompt, %d tokens left for it", budget)
+    return "\n".join(lines)
+
+
+def log_prompt_usage(parts: List[Tuple[str, str]], budget: int) -> int:
+    """
+    Log the token count of every part of a prompt and return the total.
+    """
+    counts = {name: count_tokens(text) for name, text in parts}
+    total = sum(counts.values())
+    logger.info(
+        "System prompt uses %d/%d tokens (%s)",
+        total, budget, ", ".join(f"{name}: {count}" for name, count in counts.items()),
+    )
+    return total
@@ -0,0 +1,242 @@
+import asyncio
+import contextvars
+import itertools
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+
+from metrics import RATE_LIMITED_RESPONSES, SCHEDULER_QUEUE_DEPTH, SCHEDULER_WAIT
+
+# Description: Process-wide rate limiting of provider requests, shared by every session of the deployment
+
+SCHEDULER_ENABLED = os.getenv("REQUEST_SCHEDULER_ENABLED", "true").lower() not in ("0", "false", "no")
+
+# Requests and tokens per minute allowed per provider, 0 means unlimited. They depend on the account's
+# usage tier, so they are unlimited by default. A provider without limits gets no scheduler, its requests are
+# sent directly and 429 responses are left to the clients' own retries.
+RATE_LIMITS = {
+    "openai": (int(os.getenv("OPENAI_RPM", 0)), int(os.getenv("OPENAI_TPM", 0))),
+    "tavily": (int(os.getenv("TAVILY_RPM", 0)), 0),
+}
+# Completion tokens counted for a request that does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = int(os.getenv("SCHEDULER_COMPLETION_TOKENS", 1000))
+# Pause after a 429 response without a Retry-After header, in seconds
+RATE_LIMIT_PAUSE = float(os.getenv("RATE_LIMIT_PAUSE", 1))
+
+# Lower values are served first
+PRIORITIES = {"interactive": 0, "normal": 1, "bulk": 2, "speculative": 3}
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("request_priority", default="normal")
+_session: contextvars.ContextVar = contextvars.ContextVar("request_session", default="")
+
+
+@contextmanager
+def request_context(priority: Optional[str] = None, session: Optional[str] = None):
+    """
+    Set the priority and session of the provider requests made inside the block, including by tasks it starts.
+    """
+    tokens = [(var, var.set(value)) for var, value in ((_priority, priority), (_session, session)) if value is not None]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def set_request_session(session: Optional[str]):
+    """
+    Make session the session of the provider requests made in this context. Returns a token for reset_request_session().
+    """
+    return _session.set(session or "")
+
+
+def reset_request_session(token):
+    _session.reset(token)
+
+
+def current_session() -> str:
+    """
+    The session of the provider requests made in this context, empty outside of a session.
+    """
+    return _session.get()
+
+
+class TokenBucket:
+    """
+    Allows per_minute units per minute, with bursts of up to a minute's worth.
+    """
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # A request larger than the bucket waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+
+@dataclass
+class _Waiter:
+    priority: int
+    seq: int
+    session: str
+    tokens: int
+    future: asyncio.Future = field(repr=False)
+
+
+class ProviderScheduler:
+    """
+    Grants requests to one provider under its requests-per-minute and tokens-per-minute limits. Waiting
+    requests are served by priority, then round robin across sessions so a bulk session cannot starve the
+    others, then in arrival order.
+    """
+    def __init__(self, provider: str, rpm: int, tpm: int):
+        self.provider = provider
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.paused_until = 0.0
+        self._waiters: List[_Waiter] = []
+        self._last_served: Dict[str, int] = {}
+        self._grants = 0
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, tokens: int, priority: str = "normal", session: str = "") -> float:
+        """
+        Wait until the request may be sent. Returns the time waited.
+        """
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(PRIORITIES.get(priority, PRIORITIES["normal"]), next(self._seq), session, tokens,
+                         loop.create_future())
+        self._waiters.append(waiter)
+        started = time.monotonic()
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._dispatch()
+            raise
+        waited = time.monotonic() - started
+        SCHEDULER_WAIT.observe(waited, provider=self.provider, priority=priority)
+        return waited
+
+    def penalize(self, retry_after: float):
+        """
+        Hold every request back after the provider answered with a rate limit error.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        RATE_LIMITED_RESPONSES.inc(provider=self.provider)
+        self._dispatch()
+
+    def _next_waiter(self) -> _Waiter:
+        return min(self._waiters, key=lambda w: (w.priority, self._last_served.get(w.session, 0), w.seq))
+
+    def _dispatch(self):
+        now = time.monotonic()
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.refill(now)
+
+        while self._waiters:
+            waiter = self._next_waiter()
+            delay = max(
+                self.paused_until - now,
+                self.requests.wait_time(1) if self.requests else 0.0,
+                self.tokens.wait_time(waiter.tokens) if self.tokens else 0.0,
+            )
+            if delay > 0:
+                # Strict priority: later requests wait behind the head of the queue even if they are smaller
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                break
+            self._waiters.remove(waiter)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(waiter.tokens)
+            self._grants += 1
+            self._last_served[waiter.session] = self._grants
+            if not waiter.future.done():
+                waiter.future.set_result(None)
+
+        if len(self._last_served) > 10000:
+            waiting = {w.session for w in self._waiters}
+            self._last_served = {k: v for k, v in self._last_served.items() if k in waiting}
+        SCHEDULER_QUEUE_DEPTH.set(len(self._waiters), provider=self.provider)
+
+
+_schedulers: Dict[str, ProviderScheduler] = {}
+
+
+def get_scheduler(provider: str) -> Optional[ProviderScheduler]:
+    """
+    Return the process-wide scheduler of a provider, or None when scheduling is disabled or the provider has no limits.
+    """
+    if not SCHEDULER_ENABLED or not any(RATE_LIMITS.get(provider, ())):
+        return None
+    if provider not in _schedulers:
+        _schedulers[provider] = ProviderScheduler(provider, *RATE_LIMITS[provider])
+    return _schedulers[provider]
+
+
+def estimate_tokens(request: httpx.Request) -> int:
+    """
+    Rough token count of a request: its body size, about 4 characters per token, plus the completion it may produce.
+    """
+    try:
+        body = request.content
+    except httpx.RequestNotRead:
+        return DEFAULT_COMPLETION_TOKENS
+    completion = DEFAULT_COMPLETION_TOKENS
+    for key in (b'"max_completion_tokens":', b'"max_tokens":'):
+        position = body.find(key)
+        if position >= 0:
+            digits = body[position + len(key):position + len(key) + 12].strip().split(b",")[0].rstrip(b"}")
+            if digits.isdigit():
+                completion = int(digits)
+                break
+    return len(body) // 4 + completion
+
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        return float(response.headers.get("retry-after", RATE_LIMIT_PAUSE))
+    except ValueError:
+        return RATE_LIMIT_PAUSE
+
+
+class ScheduledTransport(httpx.AsyncBaseTransport):
+    """
+    Transport that waits for the provider's scheduler before sending each request, and pauses it on 429 responses.
+    """
+    def __init__(self, transport: httpx.AsyncBaseTransport, scheduler: ProviderScheduler):
+        self.transport = transport
+        self.scheduler = scheduler
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.scheduler.acquire(estimate_tokens(request), _priority.get(), _session.get())
+        response = await self.transport.handle_async_request(request)
+        if response.status_code == 429:
+            self.scheduler.penalize(_retry_after(response))
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+# Description: Persistent cache for Tavily search results
+
+# Seconds a cached search stays fresh, per Tavily topic. News goes stale quickly, general results do not.
+DEFAULT_TTLS = {
+    "news": int(os.getenv("SEARCH_CACHE_TTL_NEWS", 15 * 60)),
+    "general": int(os.getenv("SEARCH_CACHE_TTL_GENERAL", 24 * 60 * 60)),
+}
+
+
+def make_search_key(query: str, topic: str, days: int, domains: Optional[List[str]], max_results: int) -> str:
+    """
+    Build a stable cache key from the parameters that shape a Tavily search response.
+    """
+    normalized = {
+        "query": " ".join(query.lower().split()),
+        "topic": topic,
+        "days": days,
+        "domains": sorted({d.lower().strip() for d in domains}) if domains else [],
+        "max_results": max_results,
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class SearchCache:
+    """
+    Interface for search caches. The default implementation caches nothing.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        self.misses += 1
+        return None
+
+    def set(self, key: str, topic: str, results: List[dict]) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class SQLiteSearchCache(SearchCache):
+    """
+    On-disk search cache with per-topic TTLs and least-recently-used eviction.
+    """
+    def __init__(self, path: str, max_entries: int = 5000, ttls: Optional[dict] = None):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "key TEXT PRIMARY KEY, results TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS search_cache_last_access ON search_cache (last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results, expires_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE search_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, topic: str, results: List[dict]) -> None:
+        now = time.time()
+        ttl = self.ttls.get(topic, self.ttls["general"])
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, results, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(results), now + ttl, now),
+            )
+            # Drop expired rows first, then the least recently used ones over the size limit
+            self._conn.execute("DELETE FROM search_cache WHERE expires_at <= ?", (now,))
+            overflow = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM search_cache WHERE key IN "
+                    "(SELECT key FROM search_cache ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+        return {**super().stats(), "evictions": self.evictions, "size": size}
+
+
+_search_cache: Optional[SearchCache] = None
+
+
+def get_search_cache() -> SearchCache:
+    """
+    Return the process-wide search cache, creating it on first use.
+    Set SEARCH_CACHE_ENABLED=false to disable caching.
+    """
+    global _search_cache
+    if _search_cache is None:
+        if os.getenv("SEARCH_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+            _search_cache = SearchCache()
+        else:
+            _search_cache = SQLiteSearchCache(
+                path=os.getenv("SEARCH_CACHE_PATH", ".cache/search_cache.sqlite"),
+                max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 5000)),
+            )
+    return _search_cache
+
+
+def set_search_cache(cache: SearchCache) -> None:
+    """
+    Replace the process-wide search cache, e.g. with a custom backend.
+    """
+    global _search_cache
+    _search_cache = cache
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, List
+
+import httpx
+
+from metrics import SEARCH_EVENTS
+
+# Description: Bounded, retrying and hedging executor for concurrent search requests
+
+logger = logging.getLogger(__name__)
+
+# Requests per tool in flight. Provider rate limits are enforced process-wide by request_scheduler.py
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", 16))
+SEARCH_QUERY_TIMEOUT = float(os.getenv("SEARCH_QUERY_TIMEOUT", 20))
+SEARCH_RETRIES = int(os.getenv("SEARCH_RETRIES", 2))
+SEARCH_RETRY_BACKOFF = float(os.getenv("SEARCH_RETRY_BACKOFF", 0.5))
+SEARCH_RETRY_BACKOFF_MAX = float(os.getenv("SEARCH_RETRY_BACKOFF_MAX", 8))
+# Seconds after which a second copy of a slow request is sent, 0 disables hedging
+SEARCH_HEDGE_AFTER = float(os.getenv("SEARCH_HEDGE_AFTER", 0))
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", 60))
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Whether a failed request is worth retrying: timeouts, connection errors, rate limits and server errors.
+    An exhausted usage quota is not, retrying it only burns time and requests.
+    """
+    from tavily.errors import TimeoutError as TavilyTimeoutError
+
+    if isinstance(error, (asyncio.TimeoutError, TavilyTimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+class SearchExecutor:
+    """
+    Runs search requests with a cap on requests in flight, a timeout per attempt, jittered exponential
+    retries on transient errors and optional hedging. All requests share one overall deadline.
+    """
+    def __init__(self, concurrency: int = SEARCH_CONCURRENCY, query_timeout: float = SEARCH_QUERY_TIMEOUT,
+                 retries: int = SEARCH_RETRIES, backoff: float = SEARCH_RETRY_BACKOFF,
+                 backoff_max: float = SEARCH_RETRY_BACKOFF_MAX, hedge_after: float = SEARCH_HEDGE_AFTER,
+                 deadline: float = SEARCH_DEADLINE):
+        self.semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self.query_timeout = query_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.deadline_at = time.monotonic() + deadline
+
+    def remaining(self) -> float:
+        return self.deadline_at - time.monotonic()
+
+    async def _hedged(self, request: Callable[[], Awaitable]):
+        """
+        Run one attempt. When hedging is enabled and the request is still running after hedge_after seconds,
+        a duplicate is sent and whichever finishes first successfully wins.
+        """
+        if not self.hedge_after:
+            return await request()
+        tasks = {asyncio.ensure_future(request())}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done:
+                SEARCH_EVENTS.inc(event="hedge")
+                tasks.add(asyncio.ensure_future(request()))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def submit(self, request: Callable[[], Awaitable]):
+        """
+        Run a request, given as a function returning a new awaitable per attempt. Raises the last error
+        once retries are exhausted, or DeadlineExceeded when the overall deadline does not allow another attempt.
+        """
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                timeout = min(self.query_timeout, self.remaining())
+                if timeout <= 0:
+                    raise DeadlineExceeded()
+                try:
+                    return await asyncio.wait_for(self._hedged(request), timeout)
+                except Exception as e:
+                    if attempt == self.retries or not is_transient(e):
+                        raise
+                    delay = random.uniform(0, min(self.backoff * 2 ** attempt, self.backoff_max))
+                    if delay >= self.remaining():
+                        raise
+                    SEARCH_EVENTS.inc(event="retry")
+                    logger.warning("Retrying search after error: %s", str(e) or type(e).__name__)
+                    await asyncio.sleep(delay)
+
+    async def gather(self, awaitables: List[Awaitable], default=None) -> List:
+        """
+        Await all awaitables until the overall deadline. Those still running are cancelled and yield default.
+        """
+        tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+        if not tasks:
+            return []
+        _, pending = await asyncio.wait(tasks, timeout=max(self.remaining(), 0))
+        for task in pending:
+            SEARCH_EVENTS.inc(event="deadline")
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        return [default if task in pending or task.cancelled() or task.exception() is not None else task.result()
+                for task in tasks]
+
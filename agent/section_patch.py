@@ -0,0 +1,100 @@
+import re
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+# Description: Structured edits to a written section, applied locally instead of regenerating the section
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+\S")
+FOOTNOTE_REF_PATTERN = re.compile(r"\[\^([^\]]+)\](?!:)")
+FOOTNOTE_DEF_PATTERN = re.compile(r"^\[\^([^\]]+)\]:", re.MULTILINE)
+
+
+class SectionEdit(BaseModel):
+    op: Literal["replace", "insert_before", "insert_after", "delete"] = Field(
+        description="replace or delete the anchor, or insert text before or after it")
+    field: Literal["content", "footer"] = Field(default="content", description="Part of the section to edit")
+    anchor: str = Field(description="Exact text copied from the section that identifies the location of the edit. "
+                                    "A full markdown heading line refers to the whole block under that heading")
+    text: str = Field(default="", description="New markdown text, empty for delete")
+
+
+class PatchError(Exception):
+    pass
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def locate(text: str, anchor: str) -> tuple:
+    """
+    Return the (start, end) offsets of the anchor in the text. The anchor must occur exactly once, an exact
+    match is tried first and then a match ignoring whitespace differences. A heading line extends to the next
+    heading of the same or a higher level.
+    """
+    if not anchor.strip():
+        raise PatchError("Empty anchor")
+    count = text.count(anchor)
+    if count == 1:
+        start = text.index(anchor)
+        end = start + len(anchor)
+    elif count > 1:
+        raise PatchError(f"Anchor is not unique: {anchor[:80]!r}")
+    else:
+        words = [re.escape(word) for word in anchor.split()]
+        matches = list(re.finditer(r"\s+".join(words), text))
+        if len(matches) != 1:
+            raise PatchError(f"Anchor {'is not unique' if matches else 'not found'}: {anchor[:80]!r}")
+        start, end = matches[0].span()
+
+    heading = HEADING_PATTERN.match(anchor.strip())
+    if heading and (start == 0 or text[start - 1] == "\n"):
+        level = len(heading.group(1))
+        following = re.compile(rf"^#{{1,{level}}}\s+\S", re.MULTILINE)
+        next_heading = following.search(text, end)
+        end = next_heading.start() if next_heading else len(text)
+    return start, end
+
+
+def apply_edits(section: dict, edits: List[SectionEdit]) -> dict:
+    """
+    Apply the edits in order to a copy of the section. Raises PatchError when an edit cannot be applied
+    unambiguously or the result is not a valid section.
+    """
+    if not edits:
+        raise PatchError("No edits")
+    patched = {**section}
+    for edit in edits:
+        text = patched.get(edit.field) or ""
+        start, end = locate(text, edit.anchor)
+        if edit.op == "replace":
+            text = text[:start] + edit.text + text[end:]
+        elif edit.op == "delete":
+            text = text[:start] + text[end:]
+        elif edit.op == "insert_before":
+            text = text[:start] + edit.text + text[start:]
+        else:
+            text = text[:end] + edit.text + text[end:]
+        patched[edit.field] = re.sub(r"\n{3,}", "\n\n", text)
+    validate_section(patched)
+    return patched
+
+
+def validate_section(section: dict):
+    """
+    Check that an edited section still has content and that every footnote it cites is defined in the footer.
+    """
+    if not (section.get("content") or "").strip():
+        raise PatchError("The edited section has no content")
+    cited = set(FOOTNOTE_REF_PATTERN.findall(section.get("content") or ""))
+    defined = set(FOOTNOTE_DEF_PATTERN.findall(section.get("footer") or ""))
+    if cited - defined:
+        raise PatchError(f"Footnotes cited but not defined: {sorted(cited - defined)}")
+
+
+def edits_size(edits: List[SectionEdit], title: Optional[str] = None) -> int:
+    """
+    Number of characters the model generated for the edits, to compare against a full rewrite.
+    """
+    return sum(len(edit.anchor) + len(edit.text) for edit in edits) + len(title or "")
@@ -0,0 +1,80 @@
+import bisect
+import hashlib
+import json
+from typing import Dict, List, Optional
+
+# Description: Indexed, versioned view over state["sections"]
+
+# Fields that are not part of a section's content hash: the store's own fields and the random id of the section
+HASH_EXCLUDED_FIELDS = ("version", "hash", "id")
+
+
+def section_hash(section: dict) -> str:
+    """
+    Hash of a section's content, i.e. everything except HASH_EXCLUDED_FIELDS.
+    """
+    data = {key: value for key, value in section.items() if key not in HASH_EXCLUDED_FIELDS}
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+class SectionStore:
+    """
+    Wraps the state["sections"] list, which stays a plain list ordered by idx for the frontend,
+    with lookups by idx. Every section carries a "version", the store-wide version at which it last
+    changed, and a "hash" of its content, so consumers can cache renderings of unchanged sections by hash.
+
+    The stored hash and version of a section are trusted, only sections without them, e.g. new ones or ones
+    edited on the frontend, which drops the hash, are hashed and get a new version. Sections are never modified
+    in place, changed sections are new dicts in a new list. Versions only increase: the highest version given
+    out is kept in state["sections_version"], so a version is not reused after a section is removed.
+    """
+    def __init__(self, sections: Optional[List[dict]] = None, version: int = 0):
+        self.sections: List[dict] = sorted(sections or [], key=lambda sec: sec['idx'])
+        self.version = max([version, *(sec.get("version", 0) for sec in self.sections)])
+        for position, section in enumerate(self.sections):
+            if section.get("hash") is None or "version" not in section:
+                self.version += 1
+                self.sections[position] = {**section, "hash": section_hash(section), "version": self.version}
+        self._idxs: List[int] = [sec['idx'] for sec in self.sections]
+        self._by_idx: Dict[int, dict] = {sec['idx']: sec for sec in self.sections}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "SectionStore":
+        return cls(state.get("sections", []), state.get("sections_version", 0))
+
+    def save(self, state: dict):
+        """
+        Write the sections and the store version back into the state.
+        """
+        state["sections"] = self.sections
+        state["sections_version"] = self.version
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __contains__(self, idx: int) -> bool:
+        return idx in self._by_idx
+
+    def get(self, idx: int) -> Optional[dict]:
+        return self._by_idx.get(idx)
+
+    def upsert(self, section: dict) -> dict:
+        """
+        Insert the section, or replace the section with the same idx. The version is only bumped when the
+        content changed. Returns the stored section.
+        """
+        digest = section_hash(section)
+        existing = self._by_idx.get(section['idx'])
+        if existing is not None and existing.get("hash") == digest:
+            return existing
+        self.version += 1
+        section = {**section, "hash": digest, "version": self.version}
+
+        position = bisect.bisect_left(self._idxs, section['idx'])
+        if existing is not None:
+            self.sections[position] = section
+        else:
+            self._idxs.insert(position, section['idx'])
+            self.sections.insert(position, section)
+        self._by_idx[section['idx']] = section
+        return section
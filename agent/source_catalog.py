@@ -0,0 +1,76 @@
+import os
+import re
+from typing import Dict, Iterable, Optional
+
+from tokens import count_tokens
+
+# Description: Short, stable source ids (S1, S2, ...) and a compact source table for prompts
+
+CATALOG_TOKEN_BUDGET = int(os.getenv("CATALOG_TOKEN_BUDGET", 3000))
+CATALOG_SNIPPET_CHARS = int(os.getenv("CATALOG_SNIPPET_CHARS", 200))
+
+# A bracketed id that is not already the text of a markdown link
+CITATION_PATTERN = re.compile(r"\[(S\d+)\](?!\()")
+
+
+def assign_source_ids(sources: Dict[str, dict], evicted: Optional[Dict[str, dict]] = None) -> Dict[str, str]:
+    """
+    Give every source without one the next free id, in discovery order, and return the id of every source key.
+    Ids are stored on the sources, so they stay the same for the whole research. The ids of evicted sources,
+    which may be restored later, are not reused.
+    """
+    used = max((int(source["sid"][1:]) for source in [*sources.values(), *(evicted or {}).values()] if source.get("sid")),
+               default=0)
+    for source in sources.values():
+        if not source.get("sid"):
+            used += 1
+            source["sid"] = f"S{used}"
+    return {key: source["sid"] for key, source in sources.items()}
+
+
+def _snippet(text: str) -> str:
+    text = " ".join((text or "").split())
+    return text[:CATALOG_SNIPPET_CHARS] + ("..." if len(text) > CATALOG_SNIPPET_CHARS else "")
+
+
+def render_catalog(sources: Dict[str, dict], keys: Optional[Iterable[str]] = None, token_budget: int = CATALOG_TOKEN_BUDGET,
+                   with_url: bool = False, evicted: Optional[Dict[str, dict]] = None) -> str:
+    """
+    One line per source with its id, title, optionally its URL, and a snippet. The best scoring sources are
+    listed first until the token budget is used up. evicted are the stubs of spilled sources, whose ids are not reused.
+    """
+    assign_source_ids(sources, evicted)
+    keys = list(sources) if keys is None else [key for key in keys if key in sources]
+    ranked = sorted(keys, key=lambda key: -(sources[key].get("score") or 0))
+    lines, used = [], 0
+    for i, key in enumerate(ranked):
+        source = sources[key]
+        fields = [source["sid"], source.get("title") or "No Title"]
+        if with_url:
+            fields.append(source.get("url") or key)
+        fields.append(_snippet(source.get("content", "")))
+        line = " | ".join(fields)
+        tokens = count_tokens(line)
+        if used + tokens > token_budget:
+            lines.append(f"... {len(ranked) - i} more sources omitted")
+            break
+        lines.append(line)
+        used += tokens
+    return "\n".join(lines)
+
+
+def expand_citations(text: str, sources: Dict[str, dict]) -> str:
+    """
+    Replace the [S<n>] source ids cited in generated text with markdown links to the sources. Unknown ids are kept.
+    """
+    if not text or "[S" not in text:
+        return text
+    by_id = {source["sid"]: (key, source) for key, source in sources.items() if source.get("sid")}
+
+    def link(match):
+        if match.group(1) not in by_id:
+            return match.group(0)
+        key, source = by_id[match.group(1)]
+        return f"[{source.get('title') or key}]({source.get('url') or key})"
+
+    return CITATION_PATTERN.sub(link, text)
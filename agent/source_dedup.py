@@ -0,0 +1,159 @@
+import hashlib
+import re
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Description: URL canonicalization and near-duplicate detection for merging search results
+
+# Only parameters that are known to be added by ad and analytics platforms, generic names like "ref" or "source"
+# select content on some sites
+TRACKING_PARAMS = re.compile(
+    r"^(utm_.*|fbclid|gclid|gbraid|wbraid|dclid|msclkid|twclid|ttclid|li_fat_id|mc_cid|mc_eid|yclid|igshid|"
+    r"_ga|_gl|_hsenc|_hsmi|mkt_tok|ref_src)$",
+    re.IGNORECASE,
+)
+SIMHASH_BITS = 64
+# Fingerprints at most this many bits apart are near-duplicates. With 4 bands of 16 bits, any two
+# fingerprints within 3 bits share at least one band, so candidates can be found by band lookups.
+SIMHASH_DISTANCE = 3
+SIMHASH_BANDS = 4
+MIN_WORDS = 30  # shorter texts are too small to fingerprint reliably
+
+
+@lru_cache(maxsize=16384)
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize a URL so trivially different links to the same page compare equal: scheme, www./amp./m. host
+    prefixes, tracking parameters, parameter order, fragments, AMP suffixes and trailing slashes are ignored.
+    A host prefix is only dropped when at least two labels remain, so m.com is not confused with com.
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    for prefix in ("www.", "amp.", "m."):
+        if host.startswith(prefix) and "." in host[len(prefix):]:
+            host = host[len(prefix):]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    path = re.sub(r"/+", "/", parts.path or "/")
+    path = re.sub(r"(/amp|\.amp|/amp\.html)/?$", "", path, flags=re.IGNORECASE)
+    path = re.sub(r"/index\.(html?|php)$", "", path, flags=re.IGNORECASE)
+    path = path.rstrip("/") or "/"
+
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                             if not TRACKING_PARAMS.match(k)))
+    return urlunsplit(("https", host, path, query, ""))
+
+
+@lru_cache(maxsize=4096)
+def simhash(text: str) -> Optional[int]:
+    """
+    64-bit SimHash over word 3-shingles, or None when the text is too short.
+    """
+    # Imported on first use, NumPy is not needed to start the graph
+    import numpy as np
+
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < MIN_WORDS:
+        return None
+    digests = b"".join(hashlib.blake2b(" ".join(words[i:i + 3]).encode("utf-8"), digest_size=8).digest()
+                       for i in range(len(words) - 2))
+    # One row of 64 bits per shingle, a bit of the fingerprint is set when most shingles have it set
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    majority = bits.sum(axis=0) * 2 > len(bits)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+def _bands(fingerprint: int):
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    return [(band, fingerprint >> (band * width) & ((1 << width) - 1)) for band in range(SIMHASH_BANDS)]
+
+
+def source_fingerprint_text(source: dict) -> str:
+    return source.get("raw_content") or source.get("content") or ""
+
+
+class SourceDeduplicator:
+    """
+    Merges new search results into a state["sources"] dict, collapsing results that point to the same
+    canonical URL or have near-identical content. The highest scoring copy is kept as the representative
+    and the URLs of the others are kept in its "aliases" list, so citations of any copy still resolve.
+    """
+    def __init__(self, sources: Dict[str, dict]):
+        self.sources = sources
+        self.canonical: Dict[str, str] = {}
+        self.bands: Dict[Tuple[int, int], set] = {}
+        self.fingerprints: Dict[str, int] = {}
+        for key, source in sources.items():
+            self._index(key, source)
+
+    def _index(self, key: str, source: dict):
+        for url in [key, *source.get("aliases", [])]:
+            self.canonical[canonicalize_url(url)] = key
+        fingerprint = simhash(source_fingerprint_text(source))
+        if fingerprint is not None:
+            self.fingerprints[key] = fingerprint
+            for band in _bands(fingerprint):
+                self.bands.setdefault(band, set()).add(key)
+
+    def _unindex(self, key: str):
+        fingerprint = self.fingerprints.pop(key, None)
+        if fingerprint is not None:
+            for band in _bands(fingerprint):
+                self.bands.get(band, set()).discard(key)
+
+    def find_duplicate(self, source: dict) -> Optional[str]:
+        """
+        Return the key of an existing source that the given one duplicates, if any.
+        """
+        key = self.canonical.get(canonicalize_url(source["url"]))
+        if key is not None:
+            return key
+        fingerprint = simhash(source_fingerprint_text(source))
+        if fingerprint is None:
+            return None
+        candidates = set().union(*(self.bands.get(band, set()) for band in _bands(fingerprint)))
+        for candidate in candidates:
+            if bin(self.fingerprints[candidate] ^ fingerprint).count("1") <= SIMHASH_DISTANCE:
+                return candidate
+        return None
+
+    def add(self, source: dict) -> Tuple[str, bool]:
+        """
+        Merge a search result. Returns the key of its representative and whether it was added as a new source.
+        """
+        duplicate = self.find_duplicate(source)
+        if duplicate is None:
+            self.sources[source["url"]] = source
+            self._index(source["url"], source)
+            return source["url"], True
+
+        existing = self.sources[duplicate]
+        if source["url"] == duplicate or source.get("score", 0) <= existing.get("score", 0):
+            if source["url"] != duplicate and source["url"] not in existing.setdefault("aliases", []):
+                existing["aliases"].append(source["url"])
+                self.canonical[canonicalize_url(source["url"])] = duplicate
+            return duplicate, False
+
+        # The new copy scores higher, it becomes the representative and inherits the old one's data
+        representative = {**existing, **source}
+        representative["aliases"] = [url for url in [*existing.get("aliases", []), duplicate] if url != source["url"]]
+        del self.sources[duplicate]
+        self._unindex(duplicate)
+        self.sources[source["url"]] = representative
+        self._index(source["url"], representative)
+        return source["url"], False
+
+
+def resolve_source_key(sources: Dict[str, dict], url: str) -> Optional[str]:
+    """
+    Return the key under which a URL, one of its aliases or any variant of it is stored in sources.
+    """
+    if url in sources:
+        return url
+    canonical = canonicalize_url(url)
+    for key, source in sources.items():
+        if canonicalize_url(key) == canonical or any(canonicalize_url(alias) == canonical for alias in source.get("aliases", [])):
+            return key
+    return None
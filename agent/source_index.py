@@ -0,0 +1,382 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from content_store import get_content_store, load_raw_content, make_content_ref
+from request_scheduler import current_session
+from tokens import count_tokens
+
+# Description: Incremental BM25 index over chunked source content, one per session
+
+SOURCE_INDEX_MAX_SESSIONS = int(os.getenv("SOURCE_INDEX_MAX_SESSIONS", 32))
+# Replaced chunks are compacted away once they are more than half of the index and at least this many
+COMPACT_MIN_DEAD = 1000
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+WORD_PATTERN = re.compile(r"\S+")
+CONTROL_PATTERN = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def clean_text(text: str) -> str:
+    """
+    Normalize an extracted page body: drop control characters, collapse runs of spaces and blank lines and
+    remove lines repeated right after each other, which is how navigation and footer boilerplate usually shows up.
+    """
+    text = CONTROL_PATTERN.sub("", text)
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if line and lines and line == lines[-1]:
+            continue
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def chunk_spans(text: str, chunk_words: int = 200, overlap: int = 40) -> List[tuple]:
+    """
+    Split a text into overlapping word windows. Returns (start, end) character offsets of each window.
+    """
+    words = [match.span() for match in WORD_PATTERN.finditer(text)]
+    if not words:
+        return []
+    step = max(chunk_words - overlap, 1)
+    spans = []
+    for start in range(0, len(words), step):
+        # The first window starts at offset 0, so the leading chunk of a text is always the one at 0
+        spans.append((words[start][0] if start else 0, words[min(start + chunk_words, len(words)) - 1][1]))
+        if start + chunk_words >= len(words):
+            break
+    return spans
+
+
+def chunk_text(text: str, chunk_words: int = 200, overlap: int = 40) -> List[tuple]:
+    """
+    Split a text into overlapping word windows. Returns (start, chunk) tuples, start being a character offset.
+    """
+    return [(start, text[start:end]) for start, end in chunk_spans(text, chunk_words, overlap)]
+
+
+def source_text(source: dict) -> str:
+    """
+    Return all indexable text of a source: the search snippet and the extracted body, if any.
+    """
+    parts = [source.get("content") or "", load_raw_content(source)]
+    return "\n".join(part for part in parts if part)
+
+
+def source_chunks(source: dict, chunk_words: int = 200, overlap: int = 40) -> List[tuple]:
+    """
+    Return (start, chunk, tokens, body_span) for every chunk of source_text(). The extracted body reuses the chunk
+    offsets and token counts computed when it was ingested, tokens is None for chunks that were not measured yet.
+    body_span is the (start, end) of a chunk in the stored body, None for chunks that are not part of it.
+    """
+    snippet = source.get("content") or ""
+    body = load_raw_content(source)
+    spans = (source.get("raw_content_ref") or {}).get("chunks")
+    if not body or spans is None or source.get("raw_content"):
+        return [(start, chunk, None, None) for start, chunk in chunk_text(source_text(source), chunk_words, overlap)]
+    chunks = [(start, chunk, None, None) for start, chunk in chunk_text(snippet, chunk_words, overlap)]
+    offset = len(snippet) + 1 if snippet else 0
+    chunks += [(offset + start, body[start:end], tokens, (start, end)) for start, end, tokens in spans]
+    return chunks
+
+
+def source_version(source: dict) -> str:
+    """
+    Cheap fingerprint of a source's indexable content, used to skip re-indexing unchanged sources.
+    """
+    ref = source.get("raw_content_ref") or {}
+    raw = ref.get("digest") or hashlib.sha256((source.get("raw_content") or "").encode("utf-8")).hexdigest()
+    content = hashlib.sha256((source.get("content") or "").encode("utf-8")).hexdigest()
+    return f"{content}:{raw}"
+
+
+class SourceIndex:
+    """
+    In-process BM25 index over chunks of the sources of one session.
+
+    Chunks are appended as sources are added and the postings are packed into NumPy arrays lazily,
+    the first time a search runs after a change. Chunks of extracted bodies only keep their offsets in the
+    body, the text is loaded from the content store for the chunks a search returns. Chunks of replaced
+    sources are dropped from the postings once they make up a large part of the index.
+    """
+    def __init__(self, chunk_words: int = 200, overlap: int = 40, k1: float = 1.5, b: float = 0.75):
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self.k1 = k1
+        self.b = b
+
+        self.vocab: Dict[str, int] = {}
+        self.url_ids: Dict[str, int] = {}
+        self.chunks: List[dict] = []
+        self._versions: Dict[str, str] = {}
+        self._url_chunks: Dict[str, List[int]] = {}
+
+        # Growing COO triplets (term, chunk, term frequency) and per-chunk metadata
+        self._terms: List[int] = []
+        self._chunk_ids: List[int] = []
+        self._tfs: List[int] = []
+        self._doc_len: List[int] = []
+        self._chunk_url: List[int] = []
+        self._alive: List[bool] = []
+        self._dead = 0
+
+        self._packed = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.chunks) - self._dead
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._versions
+
+    def add_source(self, url: str, source: dict) -> bool:
+        """
+        Index the source, replacing any earlier version of it. Returns False when it was already up to date.
+        """
+        version = source_version(source)
+        with self._lock:
+            if self._versions.get(url) == version:
+                return False
+        # Chunking and tokenizing happen outside the lock, searches can go on meanwhile
+        ref = source.get("raw_content_ref") or {}
+        chunks = []
+        for start, chunk, tokens, body_span in source_chunks(source, self.chunk_words, self.overlap):
+            terms = tokenize(chunk)
+            counts: Dict[str, int] = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            record = {"url": url, "title": source.get("title", ""), "start": start, "tokens": tokens}
+            if body_span is None:
+                record["text"] = chunk
+            else:
+                record["digest"], record["span"] = ref["digest"], body_span
+            chunks.append((record, counts, len(terms)))
+
+        with self._lock:
+            # Another thread may have indexed the same version in the meantime
+            if self._versions.get(url) == version:
+                return False
+            for chunk_id in self._url_chunks.pop(url, []):
+                self._alive[chunk_id] = False
+                self._dead += 1
+            url_id = self.url_ids.setdefault(url, len(self.url_ids))
+            chunk_ids = []
+            for record, counts, length in chunks:
+                chunk_id = len(self.chunks)
+                term_ids = [self.vocab.setdefault(term, len(self.vocab)) for term in counts]
+                self._terms.extend(term_ids)
+                self._chunk_ids.extend([chunk_id] * len(term_ids))
+                self._tfs.extend(counts.values())
+                self._doc_len.append(length)
+                self._chunk_url.append(url_id)
+                self._alive.append(True)
+                self.chunks.append(record)
+                chunk_ids.append(chunk_id)
+            self._url_chunks[url] = chunk_ids
+            self._versions[url] = version
+            if self._dead > COMPACT_MIN_DEAD and self._dead > len(self.chunks) // 2:
+                self._compact()
+            self._packed = None
+        return True
+
+    def _compact(self):
+        """
+        Drop the chunks of replaced sources and their postings, renumbering the live chunks. Called with the lock held.
+        """
+        remap = {}
+        for chunk_id, alive in enumerate(self._alive):
+            if alive:
+                remap[chunk_id] = len(remap)
+        postings = [(term, remap[chunk_id], tf) for term, chunk_id, tf in zip(self._terms, self._chunk_ids, self._tfs)
+                    if chunk_id in remap]
+        self._terms = [term for term, _, _ in postings]
+        self._chunk_ids = [chunk_id for _, chunk_id, _ in postings]
+        self._tfs = [tf for _, _, tf in postings]
+        live = list(remap)
+        # New lists rather than in-place edits, a search running on the previous pack keeps consistent chunks
+        self.chunks = [self.chunks[i] for i in live]
+        self._doc_len = [self._doc_len[i] for i in live]
+        self._chunk_url = [self._chunk_url[i] for i in live]
+        self._alive = [True] * len(live)
+        self._url_chunks = {url: [remap[i] for i in ids] for url, ids in self._url_chunks.items()}
+        self._dead = 0
+
+    def add_sources(self, sources: Dict[str, dict]) -> int:
+        """
+        Index every source of a state["sources"] dict. Returns the number of (re)indexed sources.
+        """
+        return sum(self.add_source(url, source) for url, source in sources.items())
+
+    def prepare_body(self, raw_content: str) -> dict:
+        """
+        Clean an extracted page body, store it and return its content reference with the offsets and token counts
+        of its chunks, so the body does not have to be re-chunked or re-tokenized when it is indexed or retrieved.
+        """
+        text = clean_text(raw_content)
+        ref = make_content_ref(text)
+        ref["chunks"] = [[start, end, count_tokens(text[start:end])]
+                         for start, end in chunk_spans(text, self.chunk_words, self.overlap)]
+        return ref
+
+    def _pack(self):
+        """
+        Pack the postings into term-sorted NumPy arrays (a CSC-style layout) and compute IDF weights.
+        """
+        # Imported on first use, NumPy is not needed to start the graph
+        import numpy as np
+
+        with self._lock:
+            if self._packed is not None:
+                return self._packed
+            terms = np.asarray(self._terms, dtype=np.int64)
+            chunk_ids = np.asarray(self._chunk_ids, dtype=np.int64)
+            tfs = np.asarray(self._tfs, dtype=np.float64)
+            alive = np.asarray(self._alive, dtype=bool)
+            doc_len = np.asarray(self._doc_len, dtype=np.float64)
+
+            order = np.argsort(terms, kind="stable")
+            terms, chunk_ids, tfs = terms[order], chunk_ids[order], tfs[order]
+            indptr = np.searchsorted(terms, np.arange(len(self.vocab) + 1))
+
+            n_alive = int(alive.sum())
+            df = np.bincount(terms[alive[chunk_ids]], minlength=len(self.vocab)) if len(terms) else np.zeros(len(self.vocab))
+            idf = np.log(1.0 + (n_alive - df + 0.5) / (df + 0.5))
+            avgdl = doc_len[alive].mean() if n_alive else 1.0
+            norm = self.k1 * (1.0 - self.b + self.b * doc_len / max(avgdl, 1.0))
+
+            self._packed = {
+                "chunks": self.chunks,
+                "chunk_ids": chunk_ids,
+                "tfs": tfs,
+                "indptr": indptr,
+                "idf": idf,
+                "norm": norm,
+                "alive": alive,
+                "chunk_url": np.asarray(self._chunk_url, dtype=np.int64),
+            }
+            return self._packed
+
+    def search(self, query: str, urls: Optional[Iterable[str]] = None, k: int = 8, token_budget: int = 3000) -> List[dict]:
+        """
+        Return up to k of the best matching chunks whose combined size fits in the token budget.
+        When urls is given, only chunks of those sources are considered.
+        """
+        import numpy as np
+
+        if not self.chunks:
+            return []
+        packed = self._pack()
+        chunks = packed["chunks"]
+        scores = np.zeros(len(packed["alive"]), dtype=np.float64)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            # Terms added after the last pack have no postings yet
+            if term_id is None or term_id >= len(packed["idf"]):
+                continue
+            start, end = packed["indptr"][term_id], packed["indptr"][term_id + 1]
+            ids, tfs = packed["chunk_ids"][start:end], packed["tfs"][start:end]
+            scores[ids] += packed["idf"][term_id] * tfs * (self.k1 + 1.0) / (tfs + packed["norm"][ids])
+
+        mask = packed["alive"].copy()
+        if urls is not None:
+            allowed = [self.url_ids[url] for url in urls if url in self.url_ids]
+            mask &= np.isin(packed["chunk_url"], allowed)
+
+        candidates = np.flatnonzero(mask & (scores > 0))
+        ranked = list(candidates[np.argsort(-scores[candidates], kind="stable")])
+        # Fall back to the leading chunk of each source when the query matches too little
+        if len(ranked) < k:
+            seen = set(ranked)
+            ranked += [i for i in np.flatnonzero(mask) if i not in seen and chunks[i]["start"] == 0]
+
+        bodies: Dict[str, str] = {}
+        results, used = [], 0
+        for chunk_id in ranked:
+            chunk = chunks[chunk_id]
+            text = chunk_text_of(chunk, bodies)
+            if text is None:
+                continue
+            if chunk["tokens"] is None:
+                chunk["tokens"] = count_tokens(text)
+            tokens = chunk["tokens"]
+            if used + tokens > token_budget:
+                continue
+            results.append({"url": chunk["url"], "title": chunk["title"], "start": chunk["start"], "text": text,
+                            "tokens": tokens, "score": float(scores[chunk_id])})
+            used += tokens
+            if len(results) >= k:
+                break
+        return results
+
+
+def chunk_text_of(chunk: dict, bodies: Dict[str, str]) -> Optional[str]:
+    """
+    Text of an indexed chunk, sliced from its stored body when the chunk only keeps offsets. Bodies are loaded
+    once per bodies dict. None when the body is missing from the content store.
+    """
+    if "text" in chunk:
+        return chunk["text"]
+    digest = chunk["digest"]
+    if digest not in bodies:
+        bodies[digest] = get_content_store().get(digest)
+    body = bodies[digest]
+    if body is None:
+        return None
+    start, end = chunk["span"]
+    return body[start:end]
+
+
+# Indexes of the most recently used sessions, the least recently used one is dropped beyond SOURCE_INDEX_MAX_SESSIONS.
+# A dropped index is rebuilt from the session's state, spilled sources included, the next time its sections are written.
+_source_indexes: "OrderedDict[str, SourceIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_source_index(session: Optional[str] = None) -> SourceIndex:
+    """
+    Return the source index of a session, by default the one of the current request context, creating it on first use.
+    """
+    session = current_session() if session is None else session
+    with _indexes_lock:
+        index = _source_indexes.get(session)
+        if index is None:
+            index = _source_indexes[session] = SourceIndex(
+                chunk_words=int(os.getenv("SOURCE_INDEX_CHUNK_WORDS", 200)),
+                overlap=int(os.getenv("SOURCE_INDEX_CHUNK_OVERLAP", 40)),
+            )
+            while len(_source_indexes) > SOURCE_INDEX_MAX_SESSIONS:
+                _source_indexes.popitem(last=False)
+        else:
+            _source_indexes.move_to_end(session)
+        return index
+
+
+def render_chunks(chunks: List[dict], source_ids: Optional[Dict[str, str]] = None) -> str:
+    """
+    Render retrieved chunks for a prompt, grouped under their source. Sources are identified by their
+    short id instead of their URL when source_ids is given.
+    """
+    by_url: Dict[str, List[dict]] = {}
+    for chunk in chunks:
+        by_url.setdefault(chunk["url"], []).append(chunk)
+    lines = []
+    for url, url_chunks in by_url.items():
+        if source_ids and url in source_ids:
+            lines.append(f"- [{source_ids[url]}] title: {url_chunks[0]['title']}")
+        else:
+            lines.append(f"- title: {url_chunks[0]['title']} url: {url}")
+        for chunk in sorted(url_chunks, key=lambda c: c["start"]):
+            lines.append(f"  > {chunk['text']}")
+    return "\n".join(lines)
@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from content_store import get_content_store
+from metrics import SOURCE_EVICTIONS
+from source_dedup import canonicalize_url
+
+# Description: Bounded state["sources"], the least valuable sources are spilled to disk and restored on demand
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the limit
+SOURCES_MAX_COUNT = int(os.getenv("SOURCES_MAX_COUNT", 300))
+SOURCES_MAX_BYTES = int(os.getenv("SOURCES_MAX_BYTES", 4 * 2 ** 20))
+# Weight of the search score against recency of use when choosing which sources to keep
+SOURCE_SCORE_WEIGHT = float(os.getenv("SOURCE_SCORE_WEIGHT", 0.5))
+# Stubs of spilled sources kept in the state, the oldest ones are forgotten beyond this. 0 disables the limit
+EVICTED_SOURCES_MAX_COUNT = int(os.getenv("EVICTED_SOURCES_MAX_COUNT", 2000))
+
+# Set on restored sources: the blob they were restored from and the hash of their content at that time, so a
+# source spilled again unchanged keeps pointing to that blob instead of being written again
+SPILL_FIELDS = ("spill_digest", "spill_hash")
+
+URL_PATTERN = re.compile(r"https?://[^\s)\]>\"']+")
+
+
+def touch(source: dict):
+    """
+    Record that the source was just used, so it is kept over sources that were not used for a while.
+    """
+    source["last_used"] = time.time()
+
+
+def cited_urls(sections: List[dict]) -> Set[str]:
+    """
+    Canonical URLs cited in the footers of the written sections.
+    """
+    return {canonicalize_url(url) for section in sections for url in URL_PATTERN.findall(section.get("footer") or "")}
+
+
+def _is_cited(key: str, source: dict, cited: Set[str]) -> bool:
+    return bool(cited) and any(canonicalize_url(url) in cited for url in [key, *source.get("aliases", [])])
+
+
+def _source_size(source: dict) -> int:
+    # Close enough to the serialized size, sources are mostly text
+    return sum(len(value) if isinstance(value, str) else 16 for value in source.values())
+
+
+def _content_hash(source: dict) -> str:
+    data = {key: value for key, value in source.items() if key not in ("last_used", *SPILL_FIELDS)}
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+async def spill_sources(state: dict, keys: List[str]):
+    """
+    Move sources out of state["sources"] into the content store, keeping a small stub to restore each one from.
+    The sources spilled together are stored as one blob, which is far cheaper than a file per source. Sources
+    that were restored and did not change since keep pointing to the blob they were restored from.
+    Blobs are never deleted here: checkpoints of this thread, its forks and other threads may still refer to them.
+    """
+    spilled = {key: state["sources"].pop(key) for key in keys}
+    hashes = {key: _content_hash(source) for key, source in spilled.items()}
+    store = get_content_store()
+    reused = {key: source["spill_digest"] for key, source in spilled.items()
+              if source.get("spill_digest") and source.get("spill_hash") == hashes[key]}
+    reused = await asyncio.to_thread(lambda: {key: digest for key, digest in reused.items() if store.touch(digest)})
+    written = {key: {k: v for k, v in source.items() if k not in SPILL_FIELDS}
+               for key, source in spilled.items() if key not in reused}
+    digest = await asyncio.to_thread(lambda: store.put(json.dumps(written, default=str))) if written else None
+    evicted = state.setdefault("evicted_sources", {})
+    for key, source in spilled.items():
+        evicted[key] = {
+            "digest": reused.get(key, digest),
+            "hash": hashes[key],
+            "sid": source.get("sid"),
+            "title": source.get("title", ""),
+            "score": source.get("score", 0),
+            "canonical": canonicalize_url(key),
+        }
+    forget_evicted(state)
+
+
+def forget_evicted(state: dict) -> List[str]:
+    """
+    Drop the oldest stubs beyond EVICTED_SOURCES_MAX_COUNT, those sources can no longer be restored from this
+    state. The stub with the highest source id is always kept, so forgotten ids are not given out again.
+    Returns the keys of the dropped stubs.
+    """
+    evicted = state.get("evicted_sources") or {}
+    excess = len(evicted) - EVICTED_SOURCES_MAX_COUNT
+    if not EVICTED_SOURCES_MAX_COUNT or excess <= 0:
+        return []
+    highest = max(evicted, key=lambda key: int((evicted[key].get("sid") or "S0")[1:]))
+    # Stubs are added in spill order, the first ones were spilled the longest ago
+    dropped = [key for key in evicted if key != highest][:excess]
+    for key in dropped:
+        del evicted[key]
+    return dropped
+
+
+async def enforce_source_limits(state: dict) -> List[str]:
+    """
+    Spill sources until state["sources"] fits SOURCES_MAX_COUNT and SOURCES_MAX_BYTES. Sources cited in a section are
+    never spilled, the others go in order of a mix of their search score and how recently they were used.
+    Returns the keys of the spilled sources.
+    """
+    sources = state.get("sources") or {}
+    max_count = SOURCES_MAX_COUNT or float("inf")
+    max_bytes = SOURCES_MAX_BYTES or float("inf")
+    if len(sources) <= max_count and max_bytes == float("inf"):
+        return []
+    sizes = {key: _source_size(source) for key, source in sources.items()}
+    total = sum(sizes.values())
+    if len(sources) <= max_count and total <= max_bytes:
+        return []
+
+    cited = cited_urls(state.get("sections", []))
+    by_recency = sorted(sources, key=lambda key: sources[key].get("last_used", 0))
+    recency = {key: i / max(len(by_recency) - 1, 1) for i, key in enumerate(by_recency)}
+    candidates = [key for key in sources if not _is_cited(key, sources[key], cited)]
+    candidates.sort(key=lambda key: SOURCE_SCORE_WEIGHT * (sources[key].get("score") or 0)
+                    + (1 - SOURCE_SCORE_WEIGHT) * recency[key])
+
+    count = len(sources)
+    spilled = []
+    for key in candidates:
+        if count <= max_count and total <= max_bytes:
+            break
+        count -= 1
+        total -= sizes[key]
+        spilled.append(key)
+    if spilled:
+        await spill_sources(state, spilled)
+        SOURCE_EVICTIONS.inc(len(spilled), outcome="spilled")
+    return spilled
+
+
+def _load_blobs(digests: Set[str]) -> Dict[str, Optional[dict]]:
+    blobs = {}
+    for digest in digests:
+        data = get_content_store().get(digest)
+        blobs[digest] = json.loads(data) if data is not None else None
+    return blobs
+
+
+def _report_missing(keys: List[str]):
+    SOURCE_EVICTIONS.inc(len(keys), outcome="missing")
+    logger.warning("Spilled sources could not be loaded, their blobs are missing from the content store: %s",
+                   ", ".join(keys))
+
+
+async def load_spilled_sources(state: dict, keys: Iterable[str]) -> Dict[str, dict]:
+    """
+    Load spilled sources from their blobs without restoring them into the state, for instance to index them.
+    The blobs are loaded and parsed in a thread.
+    """
+    evicted = state.get("evicted_sources") or {}
+    stubs = {key: evicted[key] for key in keys if key in evicted}
+    if not stubs:
+        return {}
+    blobs = await asyncio.to_thread(_load_blobs, {stub["digest"] for stub in stubs.values()})
+    sources = {key: (blobs.get(stub["digest"]) or {}).get(key) for key, stub in stubs.items()}
+    missing = [key for key, source in sources.items() if source is None]
+    if missing:
+        _report_missing(missing)
+    return {key: source for key, source in sources.items() if source is not None}
+
+
+async def rehydrate_sources(state: dict, urls: Iterable[str]) -> List[str]:
+    """
+    Restore the spilled sources among the given URLs, or variants of them, into state["sources"].
+    The blobs are loaded and parsed in a thread. Returns the keys of the restored sources.
+    """
+    evicted = state.get("evicted_sources") or {}
+    if not evicted:
+        return []
+    by_canonical: Dict[str, str] = {stub.get("canonical") or canonicalize_url(key): key for key, stub in evicted.items()}
+    keys = []
+    for url in urls:
+        key = url if url in evicted else by_canonical.get(canonicalize_url(url))
+        if key is not None and key not in keys:
+            keys.append(key)
+    if not keys:
+        return []
+
+    blobs = await asyncio.to_thread(_load_blobs, {evicted[key]["digest"] for key in keys})
+    restored = []
+    missing = []
+    for key in keys:
+        # Another coroutine may have restored the source while the blobs were loading
+        stub = evicted.get(key)
+        if stub is None:
+            continue
+        source = (blobs.get(stub["digest"]) or {}).get(key)
+        if source is None:
+            # The stub is kept, so the source id stays reserved
+            missing.append(key)
+            continue
+        del evicted[key]
+        source["spill_digest"], source["spill_hash"] = stub["digest"], stub.get("hash")
+        touch(source)
+        state["sources"][key] = source
+        restored.append(key)
+    if restored:
+        SOURCE_EVICTIONS.inc(len(restored), outcome="rehydrated")
+    if missing:
+        _report_missing(missing)
+    return restored
@@ -0,0 +1,127 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import time
+import weakref
+from typing import Dict, List, Optional
+
+from langchain_core.messages import HumanMessage
+
+from metrics import SPECULATIVE_DRAFTS
+from request_scheduler import request_context
+
+# Description: Speculative drafting of the proposed sections while the user reviews the proposal
+
+SPECULATIVE_DRAFTS_ENABLED = os.getenv("SPECULATIVE_DRAFTS", "false").lower() in ("1", "true", "yes")
+# Cost cap: at most this many sections are drafted per proposal, each one is an LLM call that may be thrown away
+SPECULATIVE_MAX_SECTIONS = int(os.getenv("SPECULATIVE_MAX_SECTIONS", 3))
+# Drafts written at once across all threads, so the number of reviews in progress does not multiply the load
+SPECULATIVE_CONCURRENCY = int(os.getenv("SPECULATIVE_CONCURRENCY", 2))
+# Drafts of proposals that were never reviewed are dropped after this many seconds
+SPECULATIVE_DRAFT_TTL = int(os.getenv("SPECULATIVE_DRAFT_TTL", 30 * 60))
+
+# Drafts in progress by thread id: the proposal signature, when they were started and the draft of each section key
+_speculations: Dict[str, dict] = {}
+# Shared by the drafts of every thread, by event loop since an asyncio semaphore is bound to the loop it is used on
+_draft_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _proposal_signature(proposal: dict) -> str:
+    return hashlib.sha256(json.dumps(proposal.get("sections", {}), sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _discard(speculation: dict):
+    for _, _, task in speculation["drafts"].values():
+        task.cancel()
+    SPECULATIVE_DRAFTS.inc(len(speculation["drafts"]), outcome="discarded")
+    speculation["drafts"] = {}
+
+
+def _prune_expired():
+    now = time.monotonic()
+    for thread_id, speculation in list(_speculations.items()):
+        if now - speculation["started"] > SPECULATIVE_DRAFT_TTL:
+            _discard(_speculations.pop(thread_id))
+
+
+async def _draft(thread_id: str, research_query: str, section_title: str, idx: int, state: dict) -> Optional[dict]:
+    from tools.section_writer import write_section
+
+    loop = asyncio.get_running_loop()
+    semaphore = _draft_semaphores.setdefault(loop, asyncio.Semaphore(max(SPECULATIVE_CONCURRENCY, 1)))
+    async with semaphore:
+        try:
+            # Speculative work only uses the rate limits left over by every other request, and the thread's source index.
+            # Drafts run outside of the graph, nothing would receive their stream
+            with request_context(priority="speculative", session=thread_id):
+                return await write_section(research_query, section_title, idx, state, stream=False)
+        except Exception as e:
+            print(f"Error occurred while drafting section '{section_title}': {str(e)}")
+            return None
+
+
+def start_drafts(thread_id: Optional[str], state: dict):
+    """
+    Start drafting, in the background, the sections of the pending proposal that are approved by default.
+    Calling it again for the same proposal is a no-op, so it can run before every interrupt of the review.
+    """
+    proposal = state.get("proposal") or {}
+    sections = proposal.get("sections")
+    if not SPECULATIVE_DRAFTS_ENABLED or not thread_id or not isinstance(sections, dict) or proposal.get("approved"):
+        return
+    _prune_expired()
+    signature = _proposal_signature(proposal)
+    current = _speculations.get(thread_id)
+    if current is not None:
+        if current["signature"] == signature:
+            return
+        _discard(current)
+
+    outline = {k: {'title': v['title'], 'description': v['description']} for k, v in sections.items()
+               if isinstance(v, dict) and v.get('approved')}
+    research_query = next((m.content for m in reversed(state.get("messages", [])) if isinstance(m, HumanMessage)), "")
+    loop = asyncio.get_running_loop()
+
+    drafts = {}
+    for idx, (key, section) in enumerate(list(outline.items())[:SPECULATIVE_MAX_SECTIONS]):
+        # Each draft works on its own copy of the sources: writing a section restores spilled sources and assigns
+        # ids, which must not change the state of the graph run or of the other drafts
+        draft_state = {
+            "outline": outline,
+            "sources": {url: dict(source) for url, source in state.get("sources", {}).items()},
+            "evicted_sources": dict(state.get("evicted_sources", {})),
+            "sections": [],
+            "messages": {},
+        }
+        # An empty context keeps the drafts out of the callbacks and emitter of the interrupted run
+        task = loop.create_task(_draft(thread_id, str(research_query), section['title'], idx, draft_state),
+                                context=contextvars.Context())
+        drafts[key] = (section['title'], section['description'], task)
+    _speculations[thread_id] = {"signature": signature, "started": time.monotonic(), "drafts": drafts}
+    SPECULATIVE_DRAFTS.inc(len(drafts), outcome="started")
+
+
+async def take_drafts(thread_id: Optional[str], outline: dict) -> List[dict]:
+    """
+    Return the drafts of the sections the reviewed outline kept unchanged, with their final idx, waiting for
+    drafts still in progress. Drafts of sections that were rejected, retitled or redescribed are cancelled.
+    """
+    speculation = _speculations.pop(thread_id, None) if thread_id else None
+    if speculation is None:
+        return []
+
+    sections = []
+    for idx, (key, section) in enumerate(outline.items()):
+        title, description, task = speculation["drafts"].get(key, (None, None, None))
+        if task is None or (title, description) != (section.get('title'), section.get('description')):
+            continue
+        del speculation["drafts"][key]
+        draft = await task
+        if draft is None:
+            continue
+        sections.append({**draft, "idx": idx})
+        SPECULATIVE_DRAFTS.inc(outcome="committed")
+    _discard(speculation)
+    return sections
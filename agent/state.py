@@ -8,8 +8,10 @@ class ResearchState(CopilotKitState):
     proposal: Dict[str, Union[str, bool, Dict[str, Union[str, bool]]]]  # Stores proposed structure before user approval
     outline: dict
     sections: List[dict]  # list of dicts with 'title','content',and 'idx'
+    sections_version: int  # highest section version given out by section_store.py
     footnotes: str
     sources: Dict[str, Dict[str, Union[str, float]]]
+    evicted_sources: Dict[str, dict]  # stubs of sources spilled to disk by source_memory.py, by URL
     tool: str
     logs: List[dict]  # list of dicts logs to be sent to frontend with 'message', 'status'
 
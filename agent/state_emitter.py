@@ -0,0 +1,180 @@
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from copilotkit.langchain import copilotkit_emit_state
+from langchain_core.runnables import RunnableConfig
+
+from metrics import STATE_EMITS, STATE_EMIT_BYTES
+
+# Description: Coalescing state emitter that only sends state to the frontend when it changed
+
+EMIT_WINDOW = int(os.getenv("STATE_EMIT_WINDOW_MS", 50)) / 1000
+# The window grows to this many times the cost of the last emit, so large states are not emitted back to back
+EMIT_COST_FACTOR = 4
+
+# Keys that are not sent to the frontend as part of the state
+IGNORED_KEYS = ("messages",)
+
+
+def _fingerprint(value: Any, leaves: list) -> int:
+    """
+    Flatten value into leaves: the shape of every container and the scalars themselves, kept by reference.
+    Comparing two fingerprints is cheap, unchanged scalars are the same objects and compare by identity.
+    Returns an estimate of the serialized size.
+    """
+    if isinstance(value, dict):
+        # Sections kept by the SectionStore carry a content hash and version, they stand for the whole section
+        if "hash" in value and "version" in value:
+            leaves.extend((dict, value["hash"], value["version"]))
+            return sum(len(v) if isinstance(v, str) else 8 for v in value.values())
+        leaves.extend((dict, len(value)))
+        size = 2
+        for key, item in value.items():
+            leaves.append(key)
+            if isinstance(item, (dict, list, tuple)):
+                size += 12 + _fingerprint(item, leaves)
+            else:
+                leaves.append(item)
+                size += 12 + (len(item) if isinstance(item, str) else 8)
+        return size
+    if isinstance(value, (list, tuple)):
+        leaves.extend((list, len(value)))
+        return 2 + sum(_fingerprint(item, leaves) + 1 for item in value)
+    leaves.append(value)
+    return len(value) + 2 if isinstance(value, str) else 8
+
+
+def _cache_key(key: str, value: Any, state: dict) -> Optional[tuple]:
+    """
+    Cheap stand-in for the fingerprint of the large keys of the state, or None for keys that are always walked.
+    Sections only change through the SectionStore, which bumps state["sections_version"]. Sources are added,
+    replaced or restored as new dicts, and the tools that change a source in place touch() it.
+    """
+    if key == "sections" and isinstance(value, list) and "sections_version" in state:
+        return id(value), len(value), state["sections_version"]
+    if key == "sources" and isinstance(value, dict):
+        return tuple((url, id(source), source.get("last_used")) for url, source in value.items())
+    return None
+
+
+class StateEmitter:
+    """
+    Wraps copilotkit_emit_state for a single run.
+
+    Emits are skipped when no key of the state changed since the last emit, which is checked against a
+    fingerprint of each key instead of a copy of the state. The fingerprints of the sections and sources are reused
+    as long as their cache key is unchanged, only forced emits walk them again. Emits that arrive within the
+    coalescing window of the previous one are merged into a single trailing emit of the latest state. Sending a large state blocks the
+    event loop, so the window is stretched to a multiple of the last emit's cost.
+    Call flush() before a node returns so no trailing emit is left behind.
+    """
+    def __init__(self, window: float = EMIT_WINDOW):
+        self.window = window
+        self.last_fingerprints: Optional[Dict[str, list]] = None
+        # Per key: the cache key, fingerprint and size estimate it was last computed for
+        self._fingerprint_cache: Dict[str, Tuple[tuple, list, int]] = {}
+        self.last_emit_at = 0.0
+        self.last_emit_cost = 0.0
+        self.emits = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self._pending = None
+        self._trailing: Optional[asyncio.Task] = None
+
+    async def emit(self, config: RunnableConfig, state: dict, force: bool = False):
+        """
+        Request an emit of the state. Sent right away unless a previous emit happened within the window.
+        """
+        self._pending = (config, state)
+        if force or time.monotonic() - self.last_emit_at >= self.current_window():
+            await self.flush(full=force)
+        elif self._trailing is None or self._trailing.done():
+            self._trailing = asyncio.create_task(self._flush_later())
+        else:
+            self.coalesced += 1
+            STATE_EMITS.inc(outcome="coalesced")
+
+    def current_window(self) -> float:
+        return max(self.window, self.last_emit_cost * EMIT_COST_FACTOR)
+
+    async def _flush_later(self):
+        await asyncio.sleep(max(self.current_window() - (time.monotonic() - self.last_emit_at), 0))
+        self._trailing = None
+        await self.flush()
+
+    async def flush(self, full: bool = False):
+        """
+        Send the pending emit, if any, and cancel the trailing one. full ignores the cached fingerprints, so changes
+        made in place without updating a cache key are sent too.
+        """
+        if self._trailing is not None and self._trailing is not asyncio.current_task():
+            self._trailing.cancel()
+            self._trailing = None
+        if self._pending is None:
+            return
+        config, state = self._pending
+        self._pending = None
+
+        start = time.monotonic()
+        fingerprints, size = {}, 0
+        for key, value in state.items():
+            if key in IGNORED_KEYS:
+                continue
+            cache_key = _cache_key(key, value, state)
+            cached = self._fingerprint_cache.get(key)
+            if not full and cache_key is not None and cached is not None and cached[0] == cache_key:
+                fingerprints[key], key_size = cached[1], cached[2]
+            else:
+                fingerprints[key] = []
+                key_size = _fingerprint(value, fingerprints[key])
+                if cache_key is not None:
+                    self._fingerprint_cache[key] = (cache_key, fingerprints[key], key_size)
+            size += key_size
+        if fingerprints == self.last_fingerprints:
+            self.last_emit_cost = time.monotonic() - start
+            self.skipped += 1
+            STATE_EMITS.inc(outcome="skipped")
+            return
+        self.last_fingerprints = fingerprints
+        self.last_emit_at = time.monotonic()
+        self.emits += 1
+        STATE_EMITS.inc(outcome="sent")
+        STATE_EMIT_BYTES.observe(size)
+        # The CopilotKit protocol replaces the whole frontend state, so the full state is sent
+        await copilotkit_emit_state(config, state)
+        self.last_emit_cost = time.monotonic() - start
+
+
+_current_emitter: ContextVar[Optional[StateEmitter]] = ContextVar("state_emitter", default=None)
+
+
+def get_state_emitter() -> StateEmitter:
+    """
+    Return the emitter of the current run, creating one if the run has none yet.
+    """
+    emitter = _current_emitter.get()
+    if emitter is None:
+        emitter = StateEmitter()
+        _current_emitter.set(emitter)
+    return emitter
+
+
+def set_state_emitter(emitter: StateEmitter):
+    """
+    Make the emitter the current one for this context. Returns a token for reset_state_emitter().
+    """
+    return _current_emitter.set(emitter)
+
+
+def reset_state_emitter(token):
+    _current_emitter.reset(token)
+
+
+async def emit_state(config: RunnableConfig, state: dict, force: bool = False):
+    """
+    Drop-in replacement for copilotkit_emit_state that goes through the current run's emitter.
+    """
+    await get_state_emitter().emit(config, state, force=force)
@@ -0,0 +1,63 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from checkpointer import ResearchCheckpointer
+
+
+@pytest.fixture
+def checkpointer(tmp_path):
+    return ResearchCheckpointer(str(tmp_path / "checkpoints.sqlite"))
+
+
+def _sources(n, changed=None):
+    return {f"https://example.com/{i}": {"title": f"Source {i}", "content": ("text " * 200) + (changed if i == 0 and changed else ""),
+                                         "score": 0.5} for i in range(n)}
+
+
+def test_unchanged_items_are_stored_once(checkpointer):
+    checkpointer._encode("thread", "sources", _sources(10))
+    assert checkpointer.stats()["objects"] == 10
+    checkpointer._encode("thread", "sources", _sources(10))
+    assert checkpointer.stats()["objects"] == 10
+    checkpointer._encode("thread", "sources", _sources(10, changed="edit"))
+    assert checkpointer.stats()["objects"] == 11
+
+
+def test_values_round_trip_through_manifests(checkpointer):
+    sources = _sources(3)
+    messages = [HumanMessage(content="question"), AIMessage(content="", tool_calls=[{"name": "t", "args": {"a": 1}, "id": "1"}])]
+    rows = [checkpointer._encode("thread", "sources", sources), checkpointer._encode("thread", "messages", messages),
+            checkpointer._encode("thread", "title", "Report")]
+    decoded = checkpointer._decode_many(rows)
+    assert decoded[0] == sources
+    assert [(type(m), m.content) for m in decoded[1]] == [(HumanMessage, "question"), (AIMessage, "")]
+    assert decoded[1][1].tool_calls[0]["args"] == {"a": 1}
+    assert decoded[2] == "Report"
+
+
+def test_item_changed_in_place_is_stored_again(checkpointer):
+    message = AIMessage(content="", tool_calls=[{"name": "t", "args": {"a": 1}, "id": "1"}])
+    first = checkpointer._put_object("thread", message)
+    assert checkpointer._put_object("thread", message) == first
+    message.tool_calls[0]["args"]["state"] = None
+    assert checkpointer._put_object("thread", message) != first
+
+
+def test_equal_values_of_different_types_are_not_confused(checkpointer):
+    assert checkpointer._put_object("thread", {"score": 1}) != checkpointer._put_object("thread", {"score": 1.0})
+
+
+def test_object_cache_is_bounded_by_bytes(checkpointer, monkeypatch):
+    monkeypatch.setattr("checkpointer.OBJECT_CACHE_BYTES", 5000)
+    monkeypatch.setattr("checkpointer.ITEM_CACHE_BYTES", 5000)
+    checkpointer._encode("thread", "sources", _sources(20))
+    assert 0 < checkpointer._object_cache_bytes <= 5000
+    assert 0 < checkpointer._item_digests_bytes <= 5000
+    assert checkpointer._decode_many([checkpointer._encode("thread", "sources", _sources(20))])[0] == _sources(20)
+
+
+def test_delete_thread_keeps_objects_shared_with_other_threads(checkpointer):
+    checkpointer._encode("a", "sources", _sources(2))
+    checkpointer._encode("b", "sources", _sources(3))
+    checkpointer.delete_thread("b")
+    assert checkpointer.stats()["objects"] == 2
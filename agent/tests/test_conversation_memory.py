@@ -0,0 +1,66 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+import conversation_memory
+from conversation_memory import compact_messages, split_turns
+
+
+@pytest.fixture(autouse=True)
+def summary_cache(monkeypatch):
+    # Summaries are cached by message id, the tests reuse ids
+    monkeypatch.setattr(conversation_memory, "_summary_cache", conversation_memory.OrderedDict())
+
+
+def _turn(n, output="result"):
+    return [
+        HumanMessage(content=f"request {n}", id=f"h{n}"),
+        AIMessage(content="", tool_calls=[{"name": "search", "args": {"q": str(n)}, "id": f"call{n}"}], id=f"a{n}"),
+        ToolMessage(content=output, tool_call_id=f"call{n}", name="search", id=f"t{n}"),
+        AIMessage(content=f"answer {n}", id=f"r{n}"),
+    ]
+
+
+def _tool_pairs_are_complete(messages):
+    calls = {call["id"] for m in messages if isinstance(m, AIMessage) for call in m.tool_calls}
+    results = {m.tool_call_id for m in messages if isinstance(m, ToolMessage)}
+    return calls == results
+
+
+def test_turns_start_at_user_messages():
+    messages = [AIMessage(content="hello", id="greeting"), *_turn(1), *_turn(2)]
+    assert [[m.id for m in turn] for turn in split_turns(messages)] == [
+        ["greeting"], ["h1", "a1", "t1", "r1"], ["h2", "a2", "t2", "r2"],
+    ]
+
+
+def test_older_turns_are_folded_into_a_summary():
+    messages = [message for n in range(5) for message in _turn(n)]
+    compacted = compact_messages(messages, recent_turns=2)
+    assert isinstance(compacted[0], SystemMessage)
+    assert "request 0" in compacted[0].content and "answer 2" in compacted[0].content
+    assert "Tools used: search" in compacted[0].content
+    assert [m.id for m in compacted[1:]] == [m.id for m in messages[-8:]]
+    assert _tool_pairs_are_complete(compacted[1:])
+
+
+def test_tool_calls_and_results_are_kept_together():
+    # A turn in progress: the last tool call has not been answered by the model yet
+    messages = [*_turn(0), *_turn(1)[:3]]
+    compacted = compact_messages(messages, recent_turns=1)
+    assert [m.id for m in compacted[1:]] == ["h1", "a1", "t1"]
+    assert _tool_pairs_are_complete(compacted[1:])
+
+
+def test_answered_tool_outputs_are_cut_short():
+    long_output = "x" * 5000
+    messages = [*_turn(0, long_output), *_turn(1, long_output)[:3]]
+    compacted = compact_messages(messages, recent_turns=2)
+    answered, pending = [m for m in compacted if isinstance(m, ToolMessage)]
+    assert len(answered.content) < 1000 and "omitted" in answered.content
+    # The model has not responded to the last output yet, it is sent in full
+    assert pending.content == long_output
+
+
+def test_at_least_the_last_turn_is_kept():
+    messages = _turn(0)
+    assert [m.id for m in compact_messages(messages, recent_turns=0)] == [m.id for m in messages]
@@ -0,0 +1,75 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+import fast_path
+from fast_path import REPORT_DONE_MESSAGE, fast_route
+
+OUTLINE = {"intro": {"title": "Intro", "description": "Intro"}, "body": {"title": "Body", "description": "Body"}}
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(fast_path, "FAST_PATH_ROUTING", True)
+
+
+def _section(idx):
+    return {"idx": idx, "id": str(idx), "title": f"Section {idx}", "content": "text", "footer": ""}
+
+
+def _approved_state(**proposal):
+    return {
+        "messages": [HumanMessage(content="research glaciers"), SystemMessage(content="The proposal was approved")],
+        "proposal": {"approved": True, **proposal},
+        "outline": OUTLINE,
+        "sections": [],
+    }
+
+
+def _batch_written_state(content="Wrote 2 sections", sections=(0, 1)):
+    return {
+        "messages": [HumanMessage(content="research glaciers"),
+                     ToolMessage(content=content, name="section_batch_writer", tool_call_id="call")],
+        "outline": OUTLINE,
+        "sections": [_section(idx) for idx in sections],
+    }
+
+
+def test_approved_outline_writes_the_sections():
+    message = fast_route(_approved_state())
+    assert message.tool_calls[0]["name"] == "section_batch_writer"
+    assert message.tool_calls[0]["args"] == {"research_query": "research glaciers"}
+
+
+def test_remarks_or_a_rejection_go_to_the_router():
+    assert fast_route(_approved_state(remarks="Add a section on sea level")) is None
+    state = _approved_state()
+    state["proposal"]["approved"] = False
+    assert fast_route(state) is None
+
+
+def test_written_report_is_confirmed():
+    assert fast_route(_batch_written_state()).content == REPORT_DONE_MESSAGE
+
+
+def test_errors_and_missing_sections_go_to_the_router():
+    assert fast_route(_batch_written_state(content="Error occurred while writing section 1")) is None
+    assert fast_route(_batch_written_state(sections=(0,))) is None
+    # The sections are already written, nothing is left to batch
+    state = _approved_state()
+    state["sections"] = [_section(0), _section(1)]
+    assert fast_route(state) is None
+
+
+def test_disabled_fast_path_always_goes_to_the_router(monkeypatch):
+    monkeypatch.setattr(fast_path, "FAST_PATH_ROUTING", False)
+    assert fast_route(_approved_state()) is None
+    assert fast_route(_batch_written_state()) is None
+    assert fast_route({"messages": []}) is None
+
+
+def test_user_messages_go_to_the_router():
+    state = _batch_written_state()
+    state["messages"].append(HumanMessage(content="Make the intro shorter"))
+    assert fast_route(state) is None
+    state["messages"][-1] = AIMessage(content="Sure")
+    assert fast_route(state) is None
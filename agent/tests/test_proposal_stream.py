@@ -0,0 +1,46 @@
+import json
+
+from tools.outline_writer import ProposalStreamParser, parse_json
+
+PROPOSAL = {
+    "sections": {
+        "intro": {"title": "Intro {with braces}", "description": "Say \"hi\" \\ here", "approved": True},
+        "body": {"title": "Body", "description": "Details", "approved": False},
+    },
+}
+
+
+def _feed_in_chunks(text, size):
+    parser = ProposalStreamParser()
+    completed = []
+    for start in range(0, len(text), size):
+        completed.append(parser.feed(text[start:start + size]))
+    return completed
+
+
+def test_sections_are_returned_as_soon_as_they_close():
+    text = json.dumps(PROPOSAL, indent=2)
+    completed = _feed_in_chunks(text, 1)
+    sections = [item for batch in completed for item in batch]
+    assert sections == list(PROPOSAL["sections"].items())
+    first_done = next(i for i, batch in enumerate(completed) if batch)
+    # The first section is complete before the second one starts streaming
+    assert first_done < text.index('"body"')
+
+
+def test_chunk_boundaries_do_not_change_the_result():
+    text = json.dumps(PROPOSAL)
+    for size in (1, 3, 7, len(text)):
+        assert [item for batch in _feed_in_chunks(text, size) for item in batch] == list(PROPOSAL["sections"].items())
+
+
+def test_objects_outside_sections_are_ignored():
+    text = json.dumps({"meta": {"a": {"b": 1}}, **PROPOSAL})
+    assert [key for batch in _feed_in_chunks(text, 5) for key, _ in batch] == ["intro", "body"]
+
+
+def test_trailing_commas_are_parsed_as_json5():
+    text = '{"sections": {"intro": {"title": "Intro", "description": "D", "approved": true,},},}'
+    assert [item for batch in _feed_in_chunks(text, 4) for item in batch] == \
+        [("intro", {"title": "Intro", "description": "D", "approved": True})]
+    assert parse_json(text)["sections"]["intro"]["title"] == "Intro"
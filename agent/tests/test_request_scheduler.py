@@ -0,0 +1,64 @@
+import asyncio
+
+from request_scheduler import ProviderScheduler, TokenBucket
+
+
+def test_token_bucket_refills_at_its_rate_up_to_capacity():
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    assert bucket.wait_time(1) == 1.0
+    bucket.refill(bucket.updated + 30)
+    assert bucket.level == 30
+    bucket.refill(bucket.updated + 600)
+    assert bucket.level == 60
+
+
+def test_token_bucket_oversized_request_waits_for_a_full_bucket():
+    bucket = TokenBucket(120)
+    bucket.take(1000)
+    assert bucket.level == 0
+    assert bucket.wait_time(1000) == 60.0
+
+
+def _run_queue(scheduler, requests):
+    """
+    Queue the requests (priority, session) while the provider is paused and return the order they are granted in.
+    """
+    order = []
+
+    async def request(name, priority, session):
+        await scheduler.acquire(1, priority, session)
+        order.append(name)
+
+    async def main():
+        scheduler.penalize(0.05)
+        await asyncio.gather(*(request(name, priority, session) for name, (priority, session) in requests.items()))
+
+    asyncio.run(main())
+    return order
+
+
+def test_scheduler_serves_by_priority_then_round_robin_across_sessions():
+    scheduler = ProviderScheduler("test", rpm=6000, tpm=0)
+    order = _run_queue(scheduler, {
+        "bulk-a1": ("bulk", "a"),
+        "bulk-a2": ("bulk", "a"),
+        "bulk-b1": ("bulk", "b"),
+        "interactive-c": ("interactive", "c"),
+        "speculative-d": ("speculative", "d"),
+    })
+    assert order == ["interactive-c", "bulk-a1", "bulk-b1", "bulk-a2", "speculative-d"]
+
+
+def test_scheduler_holds_requests_beyond_the_limit():
+    scheduler = ProviderScheduler("test", rpm=60, tpm=0)
+    scheduler.requests.take(60)
+
+    async def main():
+        task = asyncio.ensure_future(scheduler.acquire(1))
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        task.cancel()
+
+    asyncio.run(main())
+    assert not scheduler._waiters
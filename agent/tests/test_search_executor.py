@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+import pytest
+
+from search_executor import DeadlineExceeded, SearchExecutor, is_transient
+
+
+def _status_error(status):
+    request = httpx.Request("POST", "https://api.tavily.com/search")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+def _flaky(errors, result="ok", delay=0.0):
+    """
+    A request that raises the given errors on its first attempts and then returns result.
+    """
+    attempts = []
+
+    async def request():
+        attempts.append(len(attempts))
+        await asyncio.sleep(delay)
+        if len(attempts) <= len(errors):
+            raise errors[len(attempts) - 1]
+        return result
+
+    return request, attempts
+
+
+def test_transient_errors_are_retried():
+    request, attempts = _flaky([httpx.ConnectError("reset"), _status_error(503)])
+    executor = SearchExecutor(retries=2, backoff=0)
+    assert asyncio.run(executor.submit(request)) == "ok"
+    assert len(attempts) == 3
+
+
+def test_last_error_is_raised_once_retries_are_exhausted():
+    request, attempts = _flaky([_status_error(429)] * 3)
+    executor = SearchExecutor(retries=1, backoff=0)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(executor.submit(request))
+    assert len(attempts) == 2
+
+
+def test_exhausted_quota_is_not_retried():
+    from tavily.errors import UsageLimitExceededError
+
+    assert not is_transient(UsageLimitExceededError("quota exceeded"))
+    assert not is_transient(_status_error(432))
+    request, attempts = _flaky([_status_error(432)])
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(SearchExecutor(retries=3, backoff=0).submit(request))
+    assert len(attempts) == 1
+
+
+def test_slow_request_is_hedged():
+    calls = []
+
+    async def request():
+        calls.append(len(calls))
+        # Only the first copy is slow
+        await asyncio.sleep(1 if len(calls) == 1 else 0)
+        return f"copy {len(calls)}"
+
+    executor = SearchExecutor(hedge_after=0.05, retries=0)
+    assert asyncio.run(executor.submit(request)) == "copy 2"
+    assert len(calls) == 2
+
+
+def test_requests_stop_at_the_deadline():
+    async def slow():
+        await asyncio.sleep(1)
+        return "late"
+
+    async def fast():
+        return "early"
+
+    async def main():
+        executor = SearchExecutor(deadline=0.1, retries=0)
+        results = await executor.gather([executor.submit(fast), executor.submit(slow)], default=None)
+        assert results == ["early", None]
+        with pytest.raises(DeadlineExceeded):
+            await executor.submit(fast)
+
+    asyncio.run(main())
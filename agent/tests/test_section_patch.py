@@ -0,0 +1,71 @@
+import pytest
+
+from section_patch import PatchError, SectionEdit, apply_edits, locate
+
+CONTENT = (
+    "Intro paragraph.\n\n"
+    "## Background\n"
+    "Some history [^1].\n\n"
+    "### Details\n"
+    "Fine print.\n\n"
+    "## Results\n"
+    "The numbers."
+)
+SECTION = {"title": "Findings", "content": CONTENT, "footer": "[^1]: A source", "idx": 0, "id": "abc"}
+
+
+def test_locate_exact_match():
+    start, end = locate(CONTENT, "Fine print.")
+    assert CONTENT[start:end] == "Fine print."
+
+
+def test_locate_ignores_whitespace_differences():
+    start, end = locate(CONTENT, "Intro   paragraph.")
+    assert CONTENT[start:end] == "Intro paragraph."
+
+
+def test_locate_heading_extends_to_next_heading_of_same_level():
+    start, end = locate(CONTENT, "## Background")
+    block = CONTENT[start:end]
+    assert block.startswith("## Background") and "### Details" in block and "## Results" not in block
+
+
+def test_locate_rejects_missing_ambiguous_and_empty_anchors():
+    with pytest.raises(PatchError, match="not found"):
+        locate(CONTENT, "Nowhere")
+    with pytest.raises(PatchError, match="not unique"):
+        locate("same and same", "same")
+    with pytest.raises(PatchError, match="Empty"):
+        locate(CONTENT, "  ")
+
+
+def test_apply_edits_in_order_on_a_copy():
+    edits = [
+        SectionEdit(op="replace", anchor="The numbers.", text="The new numbers."),
+        SectionEdit(op="insert_after", anchor="The new numbers.", text=" More."),
+        SectionEdit(op="insert_before", anchor="Intro paragraph.", text="Lead. "),
+    ]
+    patched = apply_edits(SECTION, edits)
+    assert patched["content"].startswith("Lead. Intro paragraph.")
+    assert patched["content"].endswith("The new numbers. More.")
+    assert SECTION["content"] == CONTENT
+
+
+def test_apply_edits_delete_heading_block_collapses_blank_lines():
+    patched = apply_edits(SECTION, [SectionEdit(op="delete", anchor="### Details")])
+    assert "Fine print." not in patched["content"]
+    assert "\n\n\n" not in patched["content"]
+
+
+def test_apply_edits_edits_the_footer():
+    patched = apply_edits(SECTION, [SectionEdit(op="replace", field="footer", anchor="A source", text="Another source")])
+    assert patched["footer"] == "[^1]: Another source"
+
+
+def test_apply_edits_rejects_undefined_footnotes_and_empty_content():
+    with pytest.raises(PatchError, match="Footnotes"):
+        apply_edits(SECTION, [SectionEdit(op="insert_after", anchor="Fine print.", text=" See [^2].")])
+    with pytest.raises(PatchError, match="no content"):
+        apply_edits({**SECTION, "content": "Only text."}, [SectionEdit(op="delete", anchor="Only text.")])
+    with pytest.raises(PatchError, match="No edits"):
+        apply_edits(SECTION, [])
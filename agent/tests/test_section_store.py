@@ -0,0 +1,36 @@
+from section_store import SectionStore
+
+
+def _section(idx, content="text"):
+    return {"idx": idx, "id": f"id{idx}", "title": f"Section {idx}", "content": content, "footer": ""}
+
+
+def test_versions_only_change_with_the_content():
+    store = SectionStore([_section(1), _section(0)])
+    assert [sec["idx"] for sec in store.sections] == [0, 1]
+    assert store.version == 2
+    unchanged = store.upsert({**_section(0), "id": "another id"})
+    assert unchanged is store.get(0) and store.version == 2
+    changed = store.upsert(_section(0, "new text"))
+    assert changed["version"] == 3 and store.get(0) is changed
+
+
+def test_stored_hashes_are_trusted_and_versions_increase_after_removals():
+    state = {}
+    store = SectionStore([_section(0), _section(1), _section(2)])
+    store.save(state)
+    first = state["sections"][0]
+    # A section removed on the frontend, the next section written must not reuse its version
+    state["sections"] = state["sections"][:2]
+    store = SectionStore.from_state(state)
+    assert store.get(0) is first
+    assert store.upsert(_section(3))["version"] == 4
+
+
+def test_sections_edited_on_the_frontend_are_hashed_again():
+    state = {}
+    SectionStore([_section(0)]).save(state)
+    state["sections"] = [{**state["sections"][0], "content": "edited", "hash": None}]
+    store = SectionStore.from_state(state)
+    assert store.get(0)["version"] == 2
+    assert store.upsert({**_section(0, "edited")}) is store.get(0)
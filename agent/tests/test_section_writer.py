@@ -0,0 +1,36 @@
+import asyncio
+
+from tools import section_writer
+from tools.section_writer import WriteSection, call_section_tool
+
+ARGS = {"title": "Glaciers", "content": "Glaciers retreat [^1].", "footer": "[^1]: [S1]"}
+
+
+class FakeCache:
+    def get(self, key, kind):
+        return dict(ARGS)
+
+
+def test_cached_section_is_emitted_through_the_stream_keys(monkeypatch):
+    emitted = []
+
+    async def emit_state(config, state):
+        emitted.append(dict(state))
+
+    monkeypatch.setattr(section_writer, "get_llm_cache", lambda: FakeCache())
+    monkeypatch.setattr(section_writer, "emit_state", emit_state)
+    state = {}
+    stream_keys = {"content": "section_stream.content.0.id.Glaciers", "footer": "section_stream.footer.0.id.Glaciers"}
+    args = asyncio.run(call_section_tool([{"role": "user", "content": "write"}], WriteSection, {}, state, stream_keys))
+    assert args == ARGS
+    assert emitted == [{"section_stream.content.0.id.Glaciers": ARGS["content"],
+                        "section_stream.footer.0.id.Glaciers": ARGS["footer"]}]
+
+
+def test_cached_section_without_stream_keys_is_not_emitted(monkeypatch):
+    async def emit_state(config, state):
+        raise AssertionError("emitted")
+
+    monkeypatch.setattr(section_writer, "get_llm_cache", lambda: FakeCache())
+    monkeypatch.setattr(section_writer, "emit_state", emit_state)
+    assert asyncio.run(call_section_tool([{"role": "user", "content": "write"}], WriteSection, {})) == ARGS
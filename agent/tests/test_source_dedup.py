@@ -0,0 +1,62 @@
+from source_dedup import SourceDeduplicator, canonicalize_url, resolve_source_key, simhash
+
+ARTICLE = " ".join(f"word{i} appears in the article about topic{i % 7}" for i in range(40))
+
+
+def test_canonicalize_url_ignores_trivial_differences():
+    canonical = canonicalize_url("https://example.com/post")
+    for variant in (
+        "http://www.example.com/post/",
+        "https://m.example.com/post?utm_source=news&fbclid=abc",
+        "https://example.com/post/amp#comments",
+        "https://example.com/post/index.html",
+    ):
+        assert canonicalize_url(variant) == canonical
+
+
+def test_canonicalize_url_keeps_meaningful_differences():
+    assert canonicalize_url("https://example.com/post?id=1") != canonicalize_url("https://example.com/post?id=2")
+    assert canonicalize_url("https://example.com/a") != canonicalize_url("https://example.com/b")
+    assert canonicalize_url("https://example.com/?b=2&a=1") == canonicalize_url("https://example.com/?a=1&b=2")
+
+
+def test_canonicalize_url_keeps_hosts_of_two_labels():
+    assert canonicalize_url("https://m.com/post") != canonicalize_url("https://com/post")
+    assert canonicalize_url("https://www.m.com/post") == canonicalize_url("https://m.com/post")
+    assert canonicalize_url("https://amp.co/post") == "https://amp.co/post"
+
+
+def test_canonicalize_url_only_drops_known_tracking_parameters():
+    assert canonicalize_url("https://example.com/post?gclid=1&_ga=2&utm_term=x") == "https://example.com/post"
+    for param in ("ref", "source", "amp", "outputtype", "cmpid"):
+        assert canonicalize_url(f"https://example.com/post?{param}=1") != canonicalize_url("https://example.com/post")
+
+
+def test_simhash_of_near_identical_texts_is_close():
+    original = simhash(ARTICLE)
+    edited = simhash(ARTICLE.replace("word12 ", "word12b "))
+    unrelated = simhash(" ".join(f"other{i} text on a different subject{i % 5}" for i in range(40)))
+    assert bin(original ^ edited).count("1") <= 3
+    assert bin(original ^ unrelated).count("1") > 3
+    assert simhash("too short") is None
+
+
+def test_deduplicator_merges_url_variants_as_aliases():
+    sources = {}
+    deduplicator = SourceDeduplicator(sources)
+    assert deduplicator.add({"url": "https://example.com/post", "content": "a", "score": 0.9}) == ("https://example.com/post", True)
+    assert deduplicator.add({"url": "https://www.example.com/post/?utm_medium=x", "content": "a", "score": 0.5}) == \
+        ("https://example.com/post", False)
+    assert sources["https://example.com/post"]["aliases"] == ["https://www.example.com/post/?utm_medium=x"]
+    assert resolve_source_key(sources, "http://example.com/post?utm_campaign=y") == "https://example.com/post"
+
+
+def test_deduplicator_keeps_the_higher_scoring_near_duplicate():
+    sources = {}
+    deduplicator = SourceDeduplicator(sources)
+    deduplicator.add({"url": "https://a.com/story", "content": ARTICLE, "score": 0.4, "sid": "S1"})
+    key, is_new = deduplicator.add({"url": "https://b.com/copy", "content": ARTICLE + " Extra.", "score": 0.8})
+    assert (key, is_new) == ("https://b.com/copy", False)
+    assert list(sources) == ["https://b.com/copy"]
+    assert sources[key]["aliases"] == ["https://a.com/story"]
+    assert sources[key]["sid"] == "S1"
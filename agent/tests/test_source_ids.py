@@ -0,0 +1,104 @@
+import asyncio
+import copy
+import logging
+import os
+
+import pytest
+
+import content_store
+import source_memory
+from source_catalog import assign_source_ids
+from source_memory import forget_evicted, rehydrate_sources, spill_sources
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(content_store, "_content_store", content_store.ContentStore(str(tmp_path / "content")))
+
+
+def _state(n):
+    sources = {f"https://example.com/{i}": {"title": f"Source {i}", "content": f"text {i}", "score": i / 10}
+               for i in range(1, n + 1)}
+    assign_source_ids(sources)
+    return {"sources": sources, "sections": []}
+
+
+def test_ids_follow_discovery_order_and_stay_stable():
+    state = _state(3)
+    assert assign_source_ids(state["sources"]) == {f"https://example.com/{i}": f"S{i}" for i in range(1, 4)}
+    state["sources"]["https://example.com/new"] = {"title": "New"}
+    assert assign_source_ids(state["sources"])["https://example.com/new"] == "S4"
+
+
+def test_ids_of_evicted_sources_are_not_reissued():
+    state = _state(3)
+    asyncio.run(spill_sources(state, ["https://example.com/3"]))
+    state["sources"]["https://example.com/new"] = {"title": "New"}
+    ids = assign_source_ids(state["sources"], state["evicted_sources"])
+    assert ids["https://example.com/new"] == "S4"
+
+
+def test_rehydrated_sources_keep_their_id():
+    state = _state(3)
+    asyncio.run(spill_sources(state, ["https://example.com/2"]))
+    assert asyncio.run(rehydrate_sources(state, ["http://www.example.com/2/"])) == ["https://example.com/2"]
+    assert state["sources"]["https://example.com/2"]["sid"] == "S2"
+    assert assign_source_ids(state["sources"], state["evicted_sources"])["https://example.com/2"] == "S2"
+
+
+def test_forgotten_stubs_keep_the_highest_id(monkeypatch):
+    monkeypatch.setattr(source_memory, "EVICTED_SOURCES_MAX_COUNT", 1)
+    state = _state(3)
+    # The highest id is spilled first, it would be forgotten first without the guard
+    asyncio.run(spill_sources(state, ["https://example.com/3"]))
+    asyncio.run(spill_sources(state, ["https://example.com/1"]))
+    assert list(state["evicted_sources"]) == ["https://example.com/3"]
+    state["sources"]["https://example.com/new"] = {"title": "New"}
+    assert assign_source_ids(state["sources"], state["evicted_sources"])["https://example.com/new"] == "S4"
+    assert forget_evicted(state) == []
+
+
+def test_unchanged_source_spilled_again_reuses_its_blob():
+    state = _state(2)
+    asyncio.run(spill_sources(state, ["https://example.com/1"]))
+    digest = state["evicted_sources"]["https://example.com/1"]["digest"]
+    asyncio.run(rehydrate_sources(state, ["https://example.com/1"]))
+    asyncio.run(spill_sources(state, ["https://example.com/1"]))
+    assert state["evicted_sources"]["https://example.com/1"]["digest"] == digest
+    assert content_store.get_content_store().exists(digest)
+
+
+def test_blobs_of_older_states_are_kept():
+    state = _state(2)
+    asyncio.run(spill_sources(state, ["https://example.com/1"]))
+    # A checkpoint taken now still points to the first blob after the source changes and is spilled again
+    checkpoint = copy.deepcopy(state)
+    asyncio.run(rehydrate_sources(state, ["https://example.com/1"]))
+    state["sources"]["https://example.com/1"]["title"] = "Edited"
+    asyncio.run(spill_sources(state, ["https://example.com/1"]))
+    old_digest = checkpoint["evicted_sources"]["https://example.com/1"]["digest"]
+    assert state["evicted_sources"]["https://example.com/1"]["digest"] != old_digest
+    assert asyncio.run(rehydrate_sources(checkpoint, ["https://example.com/1"])) == ["https://example.com/1"]
+    assert checkpoint["sources"]["https://example.com/1"]["title"] == "Source 1"
+
+
+def test_missing_blob_is_logged_and_keeps_the_stub(caplog):
+    state = _state(2)
+    asyncio.run(spill_sources(state, ["https://example.com/1"]))
+    store = content_store.get_content_store()
+    os.remove(store._path(state["evicted_sources"]["https://example.com/1"]["digest"]))
+    with caplog.at_level(logging.WARNING, logger="source_memory"):
+        assert asyncio.run(rehydrate_sources(state, ["https://example.com/1"])) == []
+    assert "https://example.com/1" in caplog.text
+    assert "https://example.com/1" in state["evicted_sources"]
+
+
+def test_content_store_collects_only_unused_blobs():
+    store = content_store.get_content_store()
+    old, fresh = store.put("old text"), store.put("fresh text")
+    os.utime(store._path(old), (0, 0))
+    os.utime(store._path(fresh), (0, 0))
+    store.get(fresh)
+    assert store.collect_garbage(3600) == 1
+    assert not store.exists(old)
+    assert store.get(fresh) == "fresh text"
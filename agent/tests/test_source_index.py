@@ -0,0 +1,78 @@
+import pytest
+
+import content_store
+import source_index
+from request_scheduler import request_context
+from source_index import SourceIndex, get_source_index
+
+SOURCES = {
+    "https://example.com/glaciers": {"title": "Glaciers", "content": "Alpine glaciers retreat faster every summer."},
+    "https://example.com/markets": {"title": "Markets", "content": "Stock markets rallied after the rate decision."},
+    "https://example.com/coral": {"title": "Coral", "content": "Coral reefs bleach when the ocean warms."},
+}
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(content_store, "_content_store", content_store.ContentStore(str(tmp_path / "content")))
+
+
+def test_search_ranks_matching_chunks_first():
+    index = SourceIndex()
+    assert index.add_sources(SOURCES) == 3
+    results = index.search("why do glaciers retreat", k=1)
+    assert [result["url"] for result in results] == ["https://example.com/glaciers"]
+    assert results[0]["text"] == SOURCES["https://example.com/glaciers"]["content"]
+
+
+def test_search_is_limited_to_the_given_sources_and_the_token_budget():
+    index = SourceIndex()
+    index.add_sources(SOURCES)
+    results = index.search("glaciers markets coral", urls=["https://example.com/markets", "https://example.com/coral"])
+    assert {result["url"] for result in results} == {"https://example.com/markets", "https://example.com/coral"}
+    assert len(index.search("glaciers markets coral", token_budget=12)) == 1
+
+
+def test_unchanged_sources_are_not_indexed_again():
+    index = SourceIndex()
+    index.add_sources(SOURCES)
+    assert index.add_sources(SOURCES) == 0
+    assert index.add_source("https://example.com/coral", {"title": "Coral", "content": "Reefs recover slowly."})
+    assert len(index) == 3
+    assert [result["url"] for result in index.search("reefs recover")][:1] == ["https://example.com/coral"]
+
+
+def test_extracted_bodies_are_sliced_from_the_content_store():
+    index = SourceIndex(chunk_words=20, overlap=5)
+    body = " ".join(f"word{i}" for i in range(60)) + " glacier melt"
+    source = {"title": "Body", "content": "", "raw_content_ref": index.prepare_body(body)}
+    index.add_source("https://example.com/body", source)
+    assert all("text" not in chunk for chunk in index.chunks)
+    assert index.search("glacier melt", k=1)[0]["text"].endswith("glacier melt")
+
+
+def test_replaced_chunks_are_compacted(monkeypatch):
+    monkeypatch.setattr(source_index, "COMPACT_MIN_DEAD", 2)
+    index = SourceIndex()
+    index.add_sources(SOURCES)
+    for version in range(3):
+        index.add_source("https://example.com/coral", {"title": "Coral", "content": f"Reefs version {version}"})
+    # 3 dead chunks out of 6 are not more than half of the index yet
+    assert (len(index.chunks), index._dead) == (6, 3)
+    index.add_source("https://example.com/coral", {"title": "Coral", "content": "Reefs version 3"})
+    assert (len(index.chunks), index._dead) == (3, 0)
+    assert index.search("reefs version 3", k=1)[0]["text"] == "Reefs version 3"
+    assert {chunk["url"] for chunk in index.chunks} == set(SOURCES)
+
+
+def test_indexes_are_scoped_to_the_request_session(monkeypatch):
+    monkeypatch.setattr(source_index, "_source_indexes", source_index.OrderedDict())
+    monkeypatch.setattr(source_index, "SOURCE_INDEX_MAX_SESSIONS", 2)
+    with request_context(session="a"):
+        get_source_index().add_sources(SOURCES)
+    with request_context(session="b"):
+        assert len(get_source_index()) == 0
+    assert get_source_index("a") is get_source_index("a")
+    # The least recently used session is dropped beyond the limit
+    get_source_index("c")
+    assert list(source_index._source_indexes) == ["a", "c"]
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+import content_store
+from request_scheduler import request_context
+from source_index import get_source_index
+from source_memory import spill_sources
+from tools.section_writer import index_sources, retrieve_section_sources
+
+OUTLINE = {"climate": {"title": "Glaciers", "description": "How fast glaciers retreat"}}
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(content_store, "_content_store", content_store.ContentStore(str(tmp_path / "content")))
+
+
+def _state():
+    return {"sources": {
+        "https://example.com/glaciers": {"title": "Glaciers", "content": "glaciers retreat fast in the alps", "score": 0.9,
+                                         "sid": "S1"},
+        "https://example.com/markets": {"title": "Markets", "content": "stock markets rallied today", "score": 0.5,
+                                        "sid": "S2"},
+    }, "sections": []}
+
+
+def test_rebuilt_index_covers_spilled_sources():
+    state = _state()
+
+    async def main():
+        await spill_sources(state, ["https://example.com/glaciers"])
+        # A session the worker has not indexed yet, as after the index was dropped from the LRU
+        with request_context(session="rebuilt-index"):
+            await index_sources(state)
+            assert "https://example.com/glaciers" in get_source_index()
+            return await retrieve_section_sources("Glaciers", 0, OUTLINE, state, indexed=True)
+
+    rendered = asyncio.run(main())
+    assert "glaciers retreat fast" in rendered
+    # The source a chunk was retrieved from is restored, so the section can cite it
+    assert "https://example.com/glaciers" in state["sources"]
+    assert "https://example.com/glaciers" not in state["evicted_sources"]
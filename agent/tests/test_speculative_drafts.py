@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+import request_scheduler
+import speculative_drafts
+from speculative_drafts import start_drafts, take_drafts
+from tools import section_writer
+
+
+@pytest.fixture
+def drafted(monkeypatch):
+    monkeypatch.setattr(speculative_drafts, "SPECULATIVE_DRAFTS_ENABLED", True)
+    monkeypatch.setattr(speculative_drafts, "_speculations", {})
+    calls = []
+
+    async def write_section(research_query, section_title, idx, state, indexed=False, stream=True):
+        calls.append({"title": section_title, "idx": idx, "stream": stream,
+                      "session": request_scheduler.current_session(), "priority": request_scheduler._priority.get()})
+        state["sources"]["https://example.com/a"]["sid"] = "S9"
+        await asyncio.sleep(0.01)
+        return {"title": section_title, "content": f"Draft of {section_title}", "footer": "", "idx": idx,
+                "id": section_title}
+
+    monkeypatch.setattr(section_writer, "write_section", write_section)
+    return calls
+
+
+def _state(approved=("intro", "body", "outlook")):
+    sections = {key: {"title": key.title(), "description": f"About {key}", "approved": key in approved}
+                for key in ("intro", "body", "outlook", "appendix")}
+    return {
+        "proposal": {"sections": sections, "approved": False},
+        "sources": {"https://example.com/a": {"title": "A", "content": "text"}},
+        "messages": [HumanMessage(content="research glaciers")],
+    }
+
+
+def test_drafts_of_unchanged_sections_are_taken_with_their_final_idx(drafted):
+    state = _state()
+
+    async def main():
+        start_drafts("thread", state)
+        # The reviewer drops the intro and changes the description of the outlook
+        outline = {"body": {"title": "Body", "description": "About body"},
+                   "outlook": {"title": "Outlook", "description": "What comes next"}}
+        return await take_drafts("thread", outline)
+
+    sections = asyncio.run(main())
+    assert [(section["title"], section["idx"]) for section in sections] == [("Body", 0)]
+    assert {call["title"] for call in drafted} <= {"Intro", "Body", "Outlook"}
+    assert all(call["session"] == "thread" and call["priority"] == "speculative" and not call["stream"]
+               for call in drafted)
+    # Drafts work on copies of the sources
+    assert "sid" not in state["sources"]["https://example.com/a"]
+
+
+def test_only_approved_sections_up_to_the_limit_are_drafted(drafted, monkeypatch):
+    monkeypatch.setattr(speculative_drafts, "SPECULATIVE_MAX_SECTIONS", 2)
+
+    async def main():
+        start_drafts("thread", _state())
+        # Starting again for the same proposal is a no-op
+        start_drafts("thread", _state())
+        await asyncio.sleep(0.05)
+        await take_drafts("thread", {})
+
+    asyncio.run(main())
+    assert [call["title"] for call in drafted] == ["Intro", "Body"]
+
+
+def test_changed_proposal_replaces_the_drafts(drafted):
+    async def main():
+        start_drafts("thread", _state())
+        start_drafts("thread", _state(approved=("appendix",)))
+        return await take_drafts("thread", {"appendix": {"title": "Appendix", "description": "About appendix"},
+                                            "intro": {"title": "Intro", "description": "About intro"}})
+
+    sections = asyncio.run(main())
+    assert [(section["title"], section["idx"]) for section in sections] == [("Appendix", 0)]
+
+
+def test_expired_drafts_are_dropped(drafted, monkeypatch):
+    async def main():
+        start_drafts("old", _state())
+        monkeypatch.setattr(speculative_drafts, "SPECULATIVE_DRAFT_TTL", -1)
+        # Expired drafts are pruned whenever drafts are started
+        start_drafts("new", _state())
+        monkeypatch.setattr(speculative_drafts, "SPECULATIVE_DRAFT_TTL", 30 * 60)
+        assert await take_drafts("old", {"intro": {"title": "Intro", "description": "About intro"}}) == []
+        assert len(await take_drafts("new", {"intro": {"title": "Intro", "description": "About intro"}})) == 1
+
+    asyncio.run(main())
+
+
+def test_disabled_or_approved_proposals_are_not_drafted(drafted, monkeypatch):
+    async def main():
+        state = _state()
+        state["proposal"]["approved"] = True
+        start_drafts("thread", state)
+        monkeypatch.setattr(speculative_drafts, "SPECULATIVE_DRAFTS_ENABLED", False)
+        start_drafts("other", _state())
+        await asyncio.sleep(0.02)
+
+    asyncio.run(main())
+    assert drafted == [] and speculative_drafts._speculations == {}
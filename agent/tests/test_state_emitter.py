@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+import state_emitter
+from section_store import SectionStore
+from state_emitter import StateEmitter
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    states = []
+
+    async def emit(config, state):
+        states.append(state)
+
+    monkeypatch.setattr(state_emitter, "copilotkit_emit_state", emit)
+    # Emits are not coalesced because of how long the previous one took
+    monkeypatch.setattr(state_emitter, "EMIT_COST_FACTOR", 0)
+    return states
+
+
+def _state(sections=3, sources=3):
+    state = {"logs": [], "sources": {f"https://example.com/{i}": {"title": f"Source {i}", "content": "text"}
+                                     for i in range(sources)}}
+    SectionStore([{"idx": i, "id": str(i), "title": f"Section {i}", "content": "text"} for i in range(sections)]).save(state)
+    return state
+
+
+def _count_walks(monkeypatch):
+    walked = []
+    fingerprint = state_emitter._fingerprint
+
+    def counting(value, leaves):
+        walked.append(value)
+        return fingerprint(value, leaves)
+
+    monkeypatch.setattr(state_emitter, "_fingerprint", counting)
+    return walked
+
+
+def test_unchanged_sections_and_sources_are_not_walked_again(sent, monkeypatch):
+    emitter = StateEmitter(window=0)
+    state = _state()
+    asyncio.run(emitter.emit({}, state))
+    walked = _count_walks(monkeypatch)
+    state["logs"].append({"message": "step", "done": False})
+    asyncio.run(emitter.emit({}, state))
+    assert len(sent) == 2
+    assert state["sections"] not in walked and state["sources"] not in walked
+
+
+def test_section_and_source_changes_are_sent(sent):
+    emitter = StateEmitter(window=0)
+    state = _state()
+    asyncio.run(emitter.emit({}, state))
+    store = SectionStore.from_state(state)
+    store.upsert({"idx": 1, "id": "1", "title": "Section 1", "content": "new text"})
+    store.save(state)
+    asyncio.run(emitter.emit({}, state))
+    state["sources"]["https://example.com/new"] = {"title": "New", "content": "text"}
+    asyncio.run(emitter.emit({}, state))
+    assert len(sent) == 3
+
+
+def test_forced_emit_sends_changes_made_in_place(sent):
+    emitter = StateEmitter(window=0)
+    state = _state()
+    asyncio.run(emitter.emit({}, state))
+    state["sources"]["https://example.com/0"]["sid"] = "S1"
+    asyncio.run(emitter.emit({}, state))
+    assert len(sent) == 1
+    asyncio.run(emitter.emit({}, state, force=True))
+    assert len(sent) == 2
+
+
+def test_emits_without_changes_are_skipped(sent):
+    emitter = StateEmitter(window=0)
+    state = _state()
+    asyncio.run(emitter.emit({}, state))
+    asyncio.run(emitter.emit({}, state))
+    asyncio.run(emitter.emit({}, {**state, "messages": ["not sent to the frontend"]}))
+    assert len(sent) == 1
+    assert emitter.skipped == 2
+
+
+def test_emits_within_the_window_are_coalesced_into_the_latest_state(sent):
+    emitter = StateEmitter(window=0.05)
+    state = _state()
+
+    async def main():
+        for step in range(5):
+            state["logs"] = [{"message": f"step {step}", "done": False}]
+            await emitter.emit({}, state)
+        assert len(sent) == 1
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert len(sent) == 2
+    assert sent[-1]["logs"][0]["message"] == "step 4"
+    assert emitter.coalesced == 3
+
+
+def test_forced_emit_and_flush_send_the_pending_state_right_away(sent):
+    emitter = StateEmitter(window=10)
+    state = _state()
+
+    async def main():
+        await emitter.emit({}, state)
+        state["logs"] = [{"message": "step", "done": False}]
+        await emitter.emit({}, state)
+        assert len(sent) == 1
+        # flush() sends the trailing emit without waiting for the window
+        await emitter.flush()
+        assert len(sent) == 2
+        state["logs"] = [{"message": "done", "done": True}]
+        await emitter.emit({}, state, force=True)
+        assert len(sent) == 3
+        await emitter.flush()
+
+    asyncio.run(main())
+    assert len(sent) == 3
@@ -0,0 +1,38 @@
+import logging
+from functools import lru_cache
+
+# Description: Token counting helpers shared by the prompt builders
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed, token counts are estimated from the text length")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # tiktoken downloads its encodings on first use, which fails on offline workers unless they are pre-cached
+        # in TIKTOKEN_CACHE_DIR (see .env.example)
+        logger.error("Could not load the tokenizer for '%s', token counts are estimated from the text length. "
+                     "Pre-cache the encodings in TIKTOKEN_CACHE_DIR on offline workers: %s", model, e)
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """
+    Count the tokens of a text with the model's tokenizer, or estimate them when tiktoken is not available.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
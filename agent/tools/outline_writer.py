@@ -1,13 +1,15 @@
-import json5 as json
+import asyncio
+import json
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 
-from langchain_community.adapters.openai import convert_openai_messages
 from langchain_core.tools import tool
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
+from clients import get_chat_model
+from source_catalog import render_catalog
+from llm_cache import get_llm_cache, make_prompt_key
 
-from copilotkit.langchain import copilotkit_emit_state
+from state_emitter import emit_state
 from langchain_core.runnables import RunnableConfig
 
 
@@ -26,6 +28,67 @@ PROPOSAL_FORMAT = {
 
 PROPOSAL_KEYS = list(PROPOSAL_FORMAT.keys())
 
+def parse_json(text: str):
+    """
+    Parse the model's JSON output. The model may emit JSON5 (trailing commas, comments), the much slower
+    json5 parser is only used when the standard one fails.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        import json5
+        return json5.loads(text)
+
+
+class ProposalStreamParser:
+    """
+    Incrementally scans a streamed JSON proposal and returns each entry of "sections" as soon as its object is closed.
+    """
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.last_string = {}  # last string literal seen at each depth, i.e. the key of the next value
+        self.section_start = None
+        self.section_key = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, dict]]:
+        self.text += chunk
+        completed = []
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    self.last_string[self.depth] = self.text[self.string_start:self.pos]
+            elif char == '"':
+                self.in_string = True
+                self.string_start = self.pos + 1
+            elif char == "{":
+                self.depth += 1
+                # A section entry is an object at depth 3 whose grandparent key is "sections"
+                if self.depth == 3 and self.last_string.get(1) == "sections":
+                    self.section_start = self.pos
+                    self.section_key = self.last_string.get(2)
+            elif char == "}":
+                if self.depth == 3 and self.section_start is not None:
+                    try:
+                        completed.append((self.section_key, parse_json(self.text[self.section_start:self.pos + 1])))
+                    except ValueError:
+                        pass
+                    self.section_start = None
+                self.depth -= 1
+            self.pos += 1
+        return completed
+
+
 class OutlineWriterInput(BaseModel):
     research_query: str = Field(description="Research query")
     state: Optional[Dict] = Field(description="State of the research")
@@ -33,13 +96,14 @@ class OutlineWriterInput(BaseModel):
 @tool("outline_writer", args_schema=OutlineWriterInput, return_direct=True)
 async def outline_writer(research_query, state):
     """Writes a research outline proposal based on the research query"""
+    # Imported on first use, they are not needed to start the graph
+    import json5
+    from langchain_community.adapters.openai import convert_openai_messages
+
     # Get sources from state
     sources = state.get("sources", {})
-    sources_summary = ""
-    for url, source in sources.items():
-        sources_summary += f"- title: {source['title']}"
-        sources_summary += f" url:  {source['url']}"
-        sources_summary += f" content:  {source['content']}\n"
+    # A compact table of the best sources, the full sources are only needed to write the sections
+    sources_summary = render_catalog(sources, evicted=state.get("evicted_sources"))
 
     # Check if a current proposal exists
     current_proposal = state.get('proposal', None)
@@ -55,7 +119,7 @@ async def outline_writer(research_query, state):
         approved_sections = approved_sections.rstrip(", ")
         non_approved_sections = non_approved_sections.rstrip(", ")
         current_proposal_text = (
-            f"Current proposal:\n{json.dumps(current_proposal, indent=2)}\n\n"
+            f"Current proposal:\n{json5.dumps(current_proposal, indent=2)}\n\n"
             "Consider the user's remarks when drafting the revised proposal and generating new sections. ")
         if approved_sections:
             current_proposal_text += (
@@ -79,7 +143,7 @@ async def outline_writer(research_query, state):
                    f"Create a detailed proposal that includes report's sections. "
                    f"Please return nothing but a JSON in the "
                    f"following format:\n"
-                   f"{json.dumps(PROPOSAL_FORMAT, indent=2)}\n"
+                   f"{json5.dumps(PROPOSAL_FORMAT, indent=2)}\n"
                    f"{current_proposal_text}"
                    f"Here are some relevant sources to consider while planning the proposal:\n"
                    f"{sources_summary}\n\n"
@@ -92,14 +156,14 @@ async def outline_writer(research_query, state):
         "message": "💭 Thinking of a research proposal",
         "done": False
     })
-    await copilotkit_emit_state(config, state)
+    await emit_state(config, state)
 
     state["logs"].append({
         "message": "✨ Generating a research proposal outline",
         "done": False
     })
     state["logs"][-2]["done"] = True
-    await copilotkit_emit_state(config, state)
+    await emit_state(config, state)
 
     try:
 
@@ -108,13 +172,40 @@ async def outline_writer(research_query, state):
             "response_format": {"type": "json_object"}
         }
 
-        response = ChatOpenAI(model='gpt-4o-mini', max_retries=1, model_kwargs=optional_params).invoke(lc_messages, config).content
+        # Identical prompts, e.g. retries or replayed tool calls, are answered from the cache
+        cache = get_llm_cache()
+        cache_key = make_prompt_key('gpt-4o-mini', prompt, **optional_params)
+        cached_response = await asyncio.to_thread(cache.get, cache_key, "llm_outline") if cache else None
+
+        # Stream the proposal and emit every section as soon as it is complete, so the frontend does not wait for the whole document.
+        # The partial proposal goes in its own state key, state["proposal"] only ever holds a complete proposal.
+        model = get_chat_model('gpt-4o-mini', max_retries=1, model_kwargs=optional_params)
+        parser = ProposalStreamParser()
+        partial_sections = {}
+
+        async def emit_partial(completed):
+            for key, section in completed:
+                partial_sections[key] = section
+                state["proposal_stream"] = {"sections": dict(partial_sections), "partial": True}
+                await emit_state(config, state)
+
+        response = cached_response or ""
+        if cached_response is None:
+            async for chunk in model.astream(lc_messages, config):
+                if not isinstance(chunk.content, str) or not chunk.content:
+                    continue
+                response += chunk.content
+                await emit_partial(parser.feed(chunk.content))
+        else:
+            # A cached proposal is emitted section by section too, so the frontend sees the same updates
+            await emit_partial(parser.feed(cached_response))
+        state.pop("proposal_stream", None)
 
         for i, log in enumerate(state["logs"]):
             state["logs"][i]["done"] = True
-        await copilotkit_emit_state(config, state)
+        await emit_state(config, state)
 
-        proposal = json.loads(response)
+        proposal = parse_json(response)
 
         # Validate proposal structure using module-level keys
         if not all(key in proposal for key in PROPOSAL_KEYS):
@@ -125,15 +216,19 @@ async def outline_writer(research_query, state):
         proposal["approved"] = False
         proposal["remarks"] = ""   # Reset user remarks if the model included them in the new proposal
 
+        if cache and cached_response is None:
+            await asyncio.to_thread(cache.set, cache_key, response)
+
         tool_msg = f"Generated the following outline proposal:\n{response}"
         state["proposal"] = proposal
 
         # Clear logs
         state["logs"] = []
-        await copilotkit_emit_state(config, state)
+        await emit_state(config, state)
 
         return state, tool_msg
     except Exception as e:
+        state.pop("proposal_stream", None)
         # Create fallback structure using same keys
         fallback = {
             key: [] for key in PROPOSAL_KEYS
@@ -146,6 +241,6 @@ async def outline_writer(research_query, state):
 
         # Clear logs
         state["logs"] = []
-        await copilotkit_emit_state(config, state)
+        await emit_state(config, state)
 
         return state, f"Error generating outline proposal: {e}"
\ No newline at end of file
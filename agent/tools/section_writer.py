@@ -1,22 +1,77 @@
 from datetime import datetime
-from typing import Optional, Dict, cast
-from langchain_core.messages import AIMessage, ToolMessage
-from langchain_community.adapters.openai import convert_openai_messages
+from typing import Optional, Dict, List, cast
+from langchain_core.messages import AIMessage
 from langchain_core.tools import tool
 from langchain_core.runnables import RunnableConfig
-from langchain_openai import ChatOpenAI
+from clients import get_chat_model
+from llm_cache import get_llm_cache, make_prompt_key
+from metrics import SECTION_EDITS, SECTION_PATCH_RATIO
+from section_patch import PatchError, SectionEdit, apply_edits, edits_size
+from request_scheduler import request_context
+from section_store import SectionStore
 from pydantic import BaseModel, Field
 import random
 import string
-from copilotkit.langchain import copilotkit_customize_config, copilotkit_emit_state
+from copilotkit.langchain import copilotkit_customize_config
+from state_emitter import emit_state
+import asyncio
+import os
+from source_catalog import assign_source_ids, expand_citations
+from source_index import get_source_index, render_chunks
+from source_memory import load_spilled_sources, rehydrate_sources, touch
 
 @tool
 def WriteSection(title: str, content: str, section_number: int, footer: str = ""): # pylint: disable=invalid-name,unused-argument
     """Write a section with content and footer containing references"""
 
+@tool
+def EditSection(edits: List[SectionEdit], title: Optional[str] = None): # pylint: disable=invalid-name,unused-argument
+    """Edit a section with a list of local edits, each one anchored on text copied from the section"""
+
+# "patch" asks the model for local edits to an existing section and falls back to a full rewrite, "rewrite" always rewrites
+SECTION_EDIT_MODE = os.getenv("SECTION_EDIT_MODE", "patch")
+
 def generate_random_id(length=6):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
+async def index_sources(state):
+    """
+    Make sure sources from earlier sessions or a restarted worker are indexed too, this is a no-op for known sources.
+    Spilled sources missing from the index, after it was dropped or on another worker, are loaded from their blobs.
+    The index thread gets a snapshot, other coroutines may add or restore sources in the meantime.
+    """
+    index = get_source_index()
+    spilled = await load_spilled_sources(state, [key for key in state.get("evicted_sources") or {} if key not in index])
+    await asyncio.to_thread(index.add_sources, {**spilled, **state.get("sources", {})})
+
+async def retrieve_section_sources(section_title, idx, outline, state, indexed=False):
+    """
+    Retrieve only the source chunks relevant to this section, within a token budget, instead of every source.
+    Spilled sources are searched too, and the ones a chunk is retrieved from are restored into the state.
+    indexed tells the sources of the state were just indexed by the caller.
+    """
+    description = next((v.get('description', '') for v in outline.values() if v.get('title') == section_title), None)
+    if description is None and 0 <= idx < len(outline):
+        description = list(outline.values())[idx].get('description', '')
+
+    sources = state.setdefault("sources", {})
+    if not indexed:
+        await index_sources(state)
+    chunks = await asyncio.to_thread(
+        get_source_index().search,
+        f"{section_title} {description or ''}",
+        urls=[*sources.keys(), *state.get("evicted_sources", {}).keys()],
+        k=int(os.getenv("SECTION_SOURCES_TOP_K", 8)),
+        token_budget=int(os.getenv("SECTION_SOURCES_TOKEN_BUDGET", 3000)),
+    )
+    # The section may cite these sources, they have to be in the state to expand the citations
+    await rehydrate_sources(state, {chunk["url"] for chunk in chunks if chunk["url"] not in sources})
+    for url in {chunk["url"] for chunk in chunks}:
+        if url in sources:
+            touch(sources[url])
+    source_ids = assign_source_ids(sources, state.get("evicted_sources"))
+    return render_chunks(chunks, source_ids)
+
 class SectionWriterInput(BaseModel):
     research_query: str = Field(description="The research query or topic for the section.")
     section_title: str = Field(description="The title of the specific section to write.")
@@ -24,19 +79,95 @@ class SectionWriterInput(BaseModel):
     state: Optional[Dict] = Field(description="State of the research")
 
 
-@tool("section_writer", args_schema=SectionWriterInput, return_direct=True)
-async def section_writer(research_query, section_title, idx, state):
-    """Writes a specific section of a research report based on the query, section title, and provided sources."""
+class SectionBatchWriterInput(BaseModel):
+    research_query: str = Field(description="The research query or topic of the report.")
+    state: Optional[Dict] = Field(description="State of the research")
 
-    config = RunnableConfig()
-    # Log search queries
-    state["logs"] = state.get("logs", [])
-    state["logs"].append({
-        "message": f"📝 Writing the {section_title} section...",
-        "done": False
-    })
-    await copilotkit_emit_state(config, state)
 
+async def call_section_tool(prompt, section_tool, config, state=None, stream_keys=None):
+    """
+    Ask the model to call the given tool and return the call's arguments, or None if it did not call it.
+    Identical prompts, e.g. retries or replayed tool calls, are answered from the cache.
+    stream_keys maps tool arguments to the state keys they are streamed to, cached arguments are emitted to them.
+    """
+    cache = get_llm_cache()
+    cache_key = make_prompt_key("gpt-4o-mini", prompt, tools=[section_tool.name])
+    args = await asyncio.to_thread(cache.get, cache_key, "llm_section") if cache else None
+
+    if args is not None and stream_keys:
+        # A cached section goes through the same stream keys, so the frontend shows it like a generated one
+        for argument, state_key in stream_keys.items():
+            state[state_key] = args.get(argument, "")
+        await emit_state(config, state)
+    elif args is None:
+        # Convert prompts for OpenAI API, the adapter is imported on first use to keep the graph's startup light
+        from langchain_community.adapters.openai import convert_openai_messages
+        lc_messages = convert_openai_messages(prompt)
+
+        # Invoke OpenAI's model with tool
+        model = get_chat_model("gpt-4o-mini", max_retries=1)
+        response = await model.bind_tools([section_tool]).ainvoke(lc_messages, config)
+
+        ai_message = cast(AIMessage, response)
+        if ai_message.tool_calls and ai_message.tool_calls[0]["name"] == section_tool.name:
+            args = ai_message.tool_calls[0]["args"]
+            if cache:
+                await asyncio.to_thread(cache.set, cache_key, args)
+    return args
+
+
+async def edit_section(current_section, user_request, config):
+    """
+    Ask the model for local edits to the section and apply them. Returns the edited section,
+    or None when the model returned no edits or they could not be applied cleanly.
+    """
+    prompt = [{
+        "role": "system",
+        "content": (
+            "You are an AI assistant that makes changes to a given section of a research report in markdown format. "
+            "Use the edit_section tool to describe only the changes that were requested by the user, do not rewrite the section.\n\n"
+            "Each edit has an op (replace, insert_before, insert_after or delete), a field (content or footer), "
+            "an anchor and the new text:\n"
+            "- The anchor must be copied exactly from the section and occur only once in it. Keep it short, "
+            "a sentence, a list item or a table row is usually enough.\n"
+            "- To replace or delete everything under a heading, use the full heading line as the anchor.\n"
+            "- When the change adds a citation, also add its [^n] reference to the footer with an edit of the footer.\n"
+            "- Only set the title when the user explicitly asks to change it.\n\n"
+            "The given section:\n"
+            f"Title : {current_section['title']}\n"
+            f"Content : {current_section['content']}\n"
+            f"Footer : {current_section['footer']}\n\n"
+            f"The user request : {user_request}"
+        )
+    }, {
+        "role": "user",
+        "content": "Edit the given section of the report using the edit_section tool, changing only what the user requested."
+    }]
+
+    args = await call_section_tool(prompt, EditSection, config)
+    try:
+        edits = [SectionEdit.model_validate(edit) for edit in (args or {}).get("edits", [])]
+        edited = apply_edits(current_section, edits)
+    except (PatchError, ValueError) as e:
+        print(f"Error occurred while applying edits to section '{current_section['title']}', rewriting it instead: {str(e)}")
+        SECTION_EDITS.inc(outcome="fallback")
+        return None
+
+    if args.get("title"):
+        edited["title"] = args["title"]
+    full_size = sum(len(current_section.get(key) or "") for key in ("title", "content", "footer"))
+    SECTION_EDITS.inc(outcome="patched")
+    SECTION_PATCH_RATIO.observe(edits_size(edits, args.get("title")) / max(full_size, 1))
+    return edited
+
+
+async def write_section(research_query, section_title, idx, state, indexed=False, stream=True):
+    """
+    Generate a single section with the LLM. The content and footer are streamed to the frontend through
+    the section's own section_stream.* state keys, unless stream is False. Returns the new section without adding
+    it to state.
+    """
+    config = RunnableConfig()
     section_id = generate_random_id()
     section = {
         "title": section_title,
@@ -63,10 +194,10 @@ async def section_writer(research_query, section_title, idx, state):
     )
 
     outline = state.get("outline", {})
-    sources = state.get("sources").values()
-    section_exists = True if section['idx'] in [sec['idx'] for sec in state['sections']] else False
+    sources = await retrieve_section_sources(section_title, idx, outline, state, indexed)
+    current_section_state = SectionStore.from_state(state).get(section['idx'])
 
-    if not section_exists:
+    if current_section_state is None:
         # Define the system and user prompts
         prompt = [{
             "role": "system",
@@ -115,12 +246,21 @@ async def section_writer(research_query, section_title, idx, state):
                 "Use appropriate markdown formatting to create a professional academic document. "
                 "Only use footnotes when citing sources or referencing external material. "
                 "If footnotes are used, they must start from [^1] in this section. "
-                "References must be defined in the footer field, not in the content. Each reference should link to a source URL."
+                "References must be defined in the footer field, not in the content. Each reference must cite its source "
+                "by the id shown in brackets in the sources, e.g. [^1]: [S3]."
             )
         }]
     else:
-        # get the current content of the section we want to update
-        current_section_state = state['sections'][section['idx']]
+        user_request = [message_content for message_type, message_content in state['messages'].items() if message_type == 'HumanMessage'][-1]
+
+        # Try local edits first, the output then scales with the size of the change instead of the section
+        if SECTION_EDIT_MODE == "patch":
+            edited = await edit_section(current_section_state, user_request, config)
+            if edited is not None:
+                section.update(title=edited["title"], content=edited["content"],
+                               footer=expand_citations(edited["footer"], state.get("sources", {})))
+                return section
+
         prompt = [{
             "role": "system",
             "content": (
@@ -132,7 +272,7 @@ async def section_writer(research_query, section_title, idx, state):
                 f"Content : {current_section_state['content']}\n"
                 f"Footer : {current_section_state['footer']}\n\n"
                 "Now use the user's request to alter the given section."
-                f"The user request : {[message_content for message_type, message_content in state['messages'].items() if message_type == 'HumanMessage'][-1]}"
+                f"The user request : {user_request}"
             )
         }, {
             "role": "user",
@@ -145,39 +285,48 @@ async def section_writer(research_query, section_title, idx, state):
             )
         }]
 
-    try:
-        # Convert prompts for OpenAI API
-        lc_messages = convert_openai_messages(prompt)
+    stream_keys = {info["tool_argument"]: info["state_key"] for info in (content_state, footer_state)} if stream else None
+    args = await call_section_tool(prompt, WriteSection, config, state, stream_keys)
+    if args:
+        section["title"] = args.get("title", "")
+        section["content"] = args.get("content", "")
+        # Sources are cited by id in the footer, expanding them locally saves the model from writing out every URL
+        section["footer"] = expand_citations(args.get("footer", ""), state.get("sources", {}))
 
-        # Invoke OpenAI's model with tool
-        model = ChatOpenAI(model="gpt-4o-mini", max_retries=1)
-        response = await model.bind_tools([WriteSection]).ainvoke(lc_messages, config)
+    # Process each stream state
+    stream_states = {
+        "content": content_state,
+        "footer": footer_state
+    }
 
-        state["logs"][-1]["done"] = True
-        await copilotkit_emit_state(config, state)
+    for stream_type, stream_info in stream_states.items():
+        if stream_info["state_key"] in state:
+            state[stream_info["state_key"]] = None
 
-        ai_message = cast(AIMessage, response)
-        if ai_message.tool_calls:
-            if ai_message.tool_calls[0]["name"] == "WriteSection":
-                section["title"] = ai_message.tool_calls[0]["args"].get("title", "")
-                section["content"] = ai_message.tool_calls[0]["args"].get("content", "")
-                section["footer"] = ai_message.tool_calls[0]["args"].get("footer", "")
-
-        if section_exists:
-            state["sections"][section['idx']] = section
-        else:
-            state["sections"].append(section)
-
-        # Process each stream state
-        stream_states = {
-            "content": content_state,
-            "footer": footer_state
-        }
-
-        for stream_type, stream_info in stream_states.items():
-            if stream_info["state_key"] in state:
-                state[stream_info["state_key"]] = None
-        await copilotkit_emit_state(config, state)
+    return section
+
+
+@tool("section_writer", args_schema=SectionWriterInput, return_direct=True)
+async def section_writer(research_query, section_title, idx, state):
+    """Writes a specific section of a research report based on the query, section title, and provided sources."""
+
+    config = RunnableConfig()
+    # Log search queries
+    state["logs"] = state.get("logs", [])
+    state["logs"].append({
+        "message": f"📝 Writing the {section_title} section...",
+        "done": False
+    })
+    await emit_state(config, state)
+
+    try:
+        section = await write_section(research_query, section_title, idx, state)
+
+        state["logs"][-1]["done"] = True
+        store = SectionStore.from_state(state)
+        store.upsert(section)
+        store.save(state)
+        await emit_state(config, state)
 
         tool_msg = f"Wrote the {section_title} Section, idx: {idx}"
 
@@ -186,6 +335,60 @@ async def section_writer(research_query, section_title, idx, state):
 
         # Clear logs
         state["logs"] = []
-        await copilotkit_emit_state(config, state)
+        await emit_state(config, state)
 
         return state, f"Error generating section: {e}"
+
+
+@tool("section_batch_writer", args_schema=SectionBatchWriterInput, return_direct=True)
+async def section_batch_writer(research_query, state):
+    """Writes all the sections of the approved outline that were not written yet, concurrently."""
+
+    config = RunnableConfig()
+    outline = state.get("outline", {})
+    store = SectionStore.from_state(state)
+    store.save(state)
+    pending = [(idx, section['title']) for idx, section in enumerate(outline.values()) if idx not in store]
+    if not pending:
+        return state, "All the sections of the approved outline are already written."
+
+    state["logs"] = state.get("logs", [])
+    first_log = len(state["logs"])
+    for idx, section_title in pending:
+        state["logs"].append({
+            "message": f"📝 Writing the {section_title} section...",
+            "done": False
+        })
+    await emit_state(config, state)
+
+    # Limit how many sections are generated at once, each one is a separate LLM call
+    semaphore = asyncio.Semaphore(int(os.getenv("SECTION_WRITER_CONCURRENCY", 4)))
+
+    async def write_pending_section(i, idx, section_title):
+        async with semaphore:
+            try:
+                section = await write_section(research_query, section_title, idx, state, indexed=True)
+            except Exception as e:
+                # A failed section must not abort the others, report it in the tool message instead
+                print(f"Error occurred while writing section '{section_title}': {str(e)}")
+                state["logs"][first_log + i]["done"] = True
+                await emit_state(config, state)
+                return f"Error generating the {section_title} Section, idx: {idx}: {e}"
+
+        # Sections are stored by idx, so the report order does not depend on which call finishes first
+        store.upsert(section)
+        store.save(state)
+        state["logs"][first_log + i]["done"] = True
+        await emit_state(config, state)
+        return f"Wrote the {section_title} Section, idx: {idx}"
+
+    # Indexed once up front, the sections only search the index while they restore sources into the state
+    await index_sources(state)
+
+    # Bulk section writes queue behind interactive requests in the provider's rate limits
+    with request_context(priority="bulk"):
+        results = await asyncio.gather(*[
+            write_pending_section(i, idx, section_title) for i, (idx, section_title) in enumerate(pending)
+        ])
+
+    return state, "\n".join(results)
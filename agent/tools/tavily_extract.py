@@ -1,11 +1,21 @@
+import asyncio
+import os
 from langchain_core.tools import tool
 from pydantic import BaseModel, Field
-from tavily import AsyncTavilyClient
 from typing import List, Optional, Dict
-from copilotkit.langchain import copilotkit_emit_state
+from state_emitter import emit_state
 from langchain_core.runnables import RunnableConfig
+from clients import get_tavily_client
+from source_index import get_source_index
+from source_catalog import assign_source_ids
+from source_dedup import resolve_source_key
+from source_memory import rehydrate_sources, touch
+from search_executor import DeadlineExceeded, SearchExecutor
 
-tavily_client = AsyncTavilyClient()
+EXTRACT_BATCH_SIZE = int(os.getenv("EXTRACT_BATCH_SIZE", 5))
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", 3))
+EXTRACT_URL_TIMEOUT = float(os.getenv("EXTRACT_URL_TIMEOUT", 20))
+EXTRACT_DEADLINE = float(os.getenv("EXTRACT_DEADLINE", 90))
 
 
 class TavilyExtractInput(BaseModel):
@@ -17,30 +27,73 @@ class TavilyExtractInput(BaseModel):
 async def tavily_extract(urls, state):
     """Perform full scrape to a provided list of urls."""
 
-    try:
-        response = await tavily_client.extract(urls=urls)
-        results = response['results']
-        # Match and add raw_content to urls in state
-        tool_msg = "Extracted raw content to gather additional information from the following sources:\n"
-        for itm in results:
-            url = itm['url']
-            raw_content = itm['raw_content']
-            if url in state["sources"]:
-                state["sources"][url]['raw_content'] = raw_content
-            else:
-                state["sources"][url] = {'raw_content': raw_content}
-            tool_msg += f"{url}\n"
-
-        config = RunnableConfig()
-        state["logs"] = state.get("logs", [])
-        state["logs"].append({
-            "message": "🚀 Extracting additional content from valuable sources",
-            "done": True
-        })
-        await copilotkit_emit_state(config, state)
-        return state, tool_msg
-
-    except Exception as e:
-        print(f"Error occurred during extract: {str(e)}")
-        return state, ""
+    config = RunnableConfig()
+    index = get_source_index()
+    # Batches are not retried as a whole, a failed batch is split into single URL requests instead
+    executor = SearchExecutor(concurrency=EXTRACT_CONCURRENCY, query_timeout=EXTRACT_URL_TIMEOUT, retries=0,
+                              deadline=EXTRACT_DEADLINE)
+    extracted, failed = [], {}
 
+    state["logs"] = state.get("logs", [])
+    state["logs"].append({
+        "message": "🚀 Extracting additional content from valuable sources",
+        "done": False
+    })
+    log = state["logs"][-1]
+    await emit_state(config, state)
+
+    # Pages of sources that were spilled out of the state are added to the restored source
+    state["sources"] = state.get("sources", {})
+    await rehydrate_sources(state, urls)
+
+    async def ingest(itm):
+        url = itm['url']
+        # Keep only a reference to the cleaned and chunked body in state, the body itself lives in the content store
+        raw_content_ref = await asyncio.to_thread(index.prepare_body, itm.get('raw_content') or "")
+        # The URL may be an alias or a variant of a source that was deduplicated during search
+        key = resolve_source_key(state["sources"], url) or url
+        state["sources"].setdefault(key, {}).pop('raw_content', None)
+        state["sources"][key]['raw_content_ref'] = raw_content_ref
+        touch(state["sources"][key])
+        assign_source_ids(state["sources"], state.get("evicted_sources"))
+        await asyncio.to_thread(index.add_source, key, state["sources"][key])
+        extracted.append(url)
+        # Every page is sent to the frontend as soon as it is ready
+        await emit_state(config, state)
+
+    async def extract_batch(batch):
+        try:
+            response = await executor.submit(
+                lambda: get_tavily_client().extract(urls=batch, timeout=EXTRACT_URL_TIMEOUT))
+        except Exception as e:
+            if len(batch) > 1 and not isinstance(e, DeadlineExceeded):
+                # One slow or broken page fails the whole request, fetch the pages one by one to keep the others
+                await asyncio.gather(*(extract_batch([url]) for url in batch))
+                return
+            print(f"Error occurred during extract of {batch}: {str(e) or type(e).__name__}")
+            failed.update({url: str(e) or type(e).__name__ for url in batch})
+            return
+        for itm in response['results']:
+            try:
+                await ingest(itm)
+            except Exception as e:
+                print(f"Error occurred while storing extracted content of {itm.get('url')}: {str(e)}")
+                failed[itm.get('url')] = str(e)
+        for itm in response.get('failed_results', []):
+            failed[itm.get('url')] = itm.get('error', 'extraction failed')
+
+    batches = [urls[i:i + EXTRACT_BATCH_SIZE] for i in range(0, len(urls), EXTRACT_BATCH_SIZE)]
+    await executor.gather([extract_batch(batch) for batch in batches])
+    for url in urls:
+        if url not in extracted and url not in failed:
+            failed[url] = "did not finish in time"
+
+    log["done"] = True
+    await emit_state(config, state)
+
+    tool_msg = "Extracted raw content to gather additional information from the following sources:\n"
+    tool_msg += "".join(f"{url}\n" for url in extracted)
+    if failed:
+        tool_msg += "Could not extract the following sources:\n"
+        tool_msg += "".join(f"{url}: {error}\n" for url, error in failed.items())
+    return state, tool_msg
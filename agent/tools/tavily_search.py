@@ -1,15 +1,19 @@
 import asyncio
-from copilotkit.langchain import copilotkit_emit_state
+from state_emitter import emit_state
 from datetime import datetime
-from dotenv import load_dotenv
 import json
 from langchain_core.tools import tool
 from pydantic import BaseModel, Field
-from tavily import AsyncTavilyClient
 from typing import List, Dict, Optional
 from langchain_core.runnables import RunnableConfig
-load_dotenv('.env')
-tavily_client = AsyncTavilyClient()
+from clients import get_tavily_client
+from search_cache import get_search_cache, make_search_key
+from source_index import get_source_index
+from source_catalog import assign_source_ids, render_catalog
+from source_dedup import SourceDeduplicator
+from source_memory import rehydrate_sources, touch
+from search_executor import SearchExecutor
+from metrics import CACHE_REQUESTS, TAVILY_RESULTS
 
 # Add Tavily's arguments to enhance the web search tool's capabilities
 class TavilyQuery(BaseModel):
@@ -37,19 +41,32 @@ async def tavily_search(sub_queries: List[TavilyQuery], state):
             query_with_date = f"{itm.query} {datetime.now().strftime('%m-%Y')}"
             # state["logs"][index]["message"] = f"🌐 Searched: '{query.query}'",
             topic = itm.topic if itm.topic in ['general','news'] else "general"
-            tavily_response = await tavily_client.search(query=query_with_date, topic=topic, days=itm.days, max_results=10)
+            # Serve repeated sub-queries from the cache. Unfiltered results are cached so the score filter below applies to hits too.
+            cache_key = make_search_key(query_with_date, topic, itm.days, itm.domains, max_results=10)
+            results = await asyncio.to_thread(search_cache.get, cache_key)
+            CACHE_REQUESTS.inc(cache="search", result="miss" if results is None else "hit")
+            if results is None:
+                # Bounded concurrency, per-query timeouts, retries and hedging are handled by the executor
+                tavily_response = await executor.submit(lambda: get_tavily_client().search(
+                    query=query_with_date, topic=topic, days=itm.days, max_results=10))
+                results = tavily_response['results']
+                await asyncio.to_thread(search_cache.set, cache_key, topic, results)
             state["logs"][index]["done"] = True
-            tavily_response['results'] = [search for search in tavily_response['results'] if search['score'] > 0.45]
-            await copilotkit_emit_state(config, state)
-            return tavily_response['results']
+            TAVILY_RESULTS.inc(len(results), stage="returned")
+            results = [search for search in results if search['score'] > 0.45]
+            TAVILY_RESULTS.inc(len(results), stage="kept")
+            await emit_state(config, state)
+            return results
         except Exception as e:
             # Handle any exceptions, log them, and return an empty list
             print(f"Error occurred during search for query '{itm.query}': {str(e)}")
             state["logs"][index]["done"] = True
-            await copilotkit_emit_state(config, state)
+            await emit_state(config, state)
             return []
 
     config = RunnableConfig()
+    search_cache = get_search_cache()
+    executor = SearchExecutor()
     state["logs"] = state.get("logs", [])
     # Log search queries
     for query in sub_queries:
@@ -57,30 +74,45 @@ async def tavily_search(sub_queries: List[TavilyQuery], state):
             "message": f"🌐 Searching the web: '{query.query}'",
             "done": False
         })
-    await copilotkit_emit_state(config, state)
+    await emit_state(config, state)
 
-    # Run all the search tasks in parallel
+    # Run all the search tasks in parallel, searches still running at the deadline are dropped
     search_tasks = [perform_search(query, i) for i, query in enumerate(sub_queries)]
-    search_responses = await asyncio.gather(*search_tasks)
+    search_responses = await executor.gather(search_tasks)
 
 
-    # Combine the results from all the responses
+    # Combine the results from all the responses, collapsing duplicate URLs and near-identical content
     tool_msg = "In search, found the following new documents:\n"
     sources = state.get('sources', {})
+    state['sources'] = sources
+    # Results for sources that were spilled out of the state are merged into the restored source
+    await rehydrate_sources(state, [source['url'] for response in search_responses for source in response or []])
+    deduplicator = SourceDeduplicator(sources)
+    timed_out = [sub_queries[i].query for i, response in enumerate(search_responses) if response is None]
+    new_keys = []
     for i, response in enumerate(search_responses):
-        for source in response:
-            if not sources or source['url'] not in sources:
-                sources[source['url']] = source
-                tool_msg += json.dumps(source)
+        for source in response or []:
+            key, is_new = deduplicator.add(source)
+            touch(sources[key])
+            if is_new:
+                new_keys.append(key)
 
         state["logs"][i]["done"] = True
-        await copilotkit_emit_state(config, state)
+        await emit_state(config, state)
 
     for key,val in sources.items():
         if not sources[key].get('title',None):
             sources[key]['title'] = 'No Title, Invalid Link'
 
 
+    # The new sources are listed by id, title, URL and snippet, their full content stays in the state
+    assign_source_ids(sources, state.get('evicted_sources'))
+    tool_msg += render_catalog(sources, new_keys, with_url=True, evicted=state.get('evicted_sources'))
+
+    if timed_out:
+        tool_msg += "\nThe following searches did not finish in time and returned no results: " + json.dumps(timed_out)
+
     state['sources'] = sources
+    await asyncio.to_thread(get_source_index().add_sources, sources)
 
     return state, tool_msg
@@ -11,7 +11,7 @@ import SourcesModal from "@/components/resource-modal";
 import { useResearch } from "@/components/research-context";
 import { DocumentsView } from "@/components/documents-view";
 import { useStreamingContent } from '@/lib/hooks/useStreamingContent';
-import { ProposalViewer } from "@/components/structure-proposal-viewer";
+import { ProposalPreview, ProposalViewer } from "@/components/structure-proposal-viewer";
 
 const CHAT_MIN_WIDTH = 30;
 const CHAT_MAX_WIDTH = 50;
@@ -23,13 +23,20 @@ export default function HomePage() {
     const { state: researchState, setResearchState } = useResearch()
 
     // Handle all "logs" - The loading states that show what the agent is doing
+    // and the sections of a proposal as they are generated, until it is handed over for review
     useCoAgentStateRender<ResearchState>({
         name: 'agent',
         render: ({ state }) => {
-            if (state.logs?.length > 0) {
-                return <Progress logs={state.logs} />;
+            const proposalStream = state.proposal_stream?.partial ? state.proposal_stream.sections : null;
+            if (!state.logs?.length && !proposalStream) {
+                return null;
             }
-            return null;
+            return (
+                <>
+                    {state.logs?.length > 0 && <Progress logs={state.logs} />}
+                    {proposalStream && Object.keys(proposalStream).length > 0 && <ProposalPreview sections={proposalStream} />}
+                </>
+            );
         },
     }, [researchState]);
 
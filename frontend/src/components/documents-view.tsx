@@ -21,9 +21,11 @@ export function DocumentsView({ sections: sectionsArg, selectedSection, onSelect
     const [documentOptionsState, setDocumentOptionsState] = useState<DocumentOptionsState>({ mode: 'full', editMode: false })
 
     const handleSectionEdit = useCallback((editedSection: Section) => {
+        // Without its content hash the agent sees the section changed and gives it a new version
+        const changedSection = { ...editedSection, hash: undefined }
         setResearchState({
             ...state,
-            sections: state.sections.map(section => section.id === editedSection.id ? editedSection : section)
+            sections: state.sections.map(section => section.id === editedSection.id ? changedSection : section)
         })
     }, [setResearchState, state])
 
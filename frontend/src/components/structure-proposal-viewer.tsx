@@ -5,7 +5,7 @@ import { Checkbox } from "@/components/ui/checkbox"
 import { Button } from "@/components/ui/button"
 import { Card, CardContent, CardDescription, CardFooter, CardHeader, CardTitle } from "@/components/ui/card"
 import { ScrollArea } from "@/components/ui/scroll-area"
-import { Proposal, ProposalSection, ProposalSectionName } from "@/lib/types";
+import { IProposalItem, Proposal, ProposalSection, ProposalSectionName } from "@/lib/types";
 import { Textarea } from "@/components/ui/textarea";
 
 function ProposalItem({
@@ -135,3 +135,32 @@ export function ProposalViewer({
         </Card>
     )
 }
+
+// Read-only view of the sections of a proposal while it is being generated, before it can be reviewed
+export function ProposalPreview({
+    sections,
+}: {
+    sections: IProposalItem
+}) {
+    return (
+        <Card className="w-full max-w-4xl mx-auto border-black/10 shadow-none rounded-none">
+            <CardHeader>
+                <CardTitle>Research Paper Proposal</CardTitle>
+                <CardDescription>
+                    Drafting the proposal, the sections appear as they are written. You can review them once it is complete.
+                </CardDescription>
+            </CardHeader>
+            <CardContent>
+                <div className="space-y-2">
+                    <h3 className="text-lg font-semibold">Sections</h3>
+                    {Object.entries(sections).map(([key, section]) => (
+                        <div key={`${ProposalSectionName.Sections}-${key}`} className="grid gap-1.5 leading-none mb-2">
+                            <span className="text-sm font-medium leading-none">{section.title}</span>
+                            <p className="text-sm text-muted-foreground">{section.description}</p>
+                        </div>
+                    ))}
+                </div>
+            </CardContent>
+        </Card>
+    )
+}
@@ -1,16 +1,35 @@
-export interface Section { title: string; content: string; idx: number; footer?: string; id: string }
+export interface Section { title: string; content: string; idx: number; footer?: string; id: string; hash?: string; version?: number }
 // export interface Section { title: string; content: string; idx: number; footnotes?: string; id: string }
 
 
+// Reference to the extracted body of a source, the body itself stays in the agent's content store
+export interface ContentRef {
+    digest: string;
+    length: number;
+    preview: string;
+}
+
 export interface Source {
     content: string;
     published_date: string;
     score: number;
     title: string;
     url: string;
+    sid?: string; // short id the source is cited by, e.g. S3
+    raw_content_ref?: ContentRef;
 }
 export type Sources = Record<string, Source>
 
+// Stub of a source spilled out of the state, it is restored when used again
+export interface EvictedSource {
+    digest: string;
+    sid?: string;
+    title: string;
+    score: number;
+    canonical: string;
+    hash?: string;
+}
+
 export interface Log {
     message: string;
     done: boolean;
@@ -40,9 +59,12 @@ export interface ResearchState {
     title: string;
     outline: Record<string, unknown>;
     proposal: Proposal;
+    proposal_stream?: { [ProposalSectionName.Sections]: IProposalItem; partial: true }; // sections of a proposal being generated
     // structure: Record<string, unknown>;
     sections: Section[]; // Array of objects with 'title', 'content', and 'idx'
+    sections_version?: number;
     sources: Sources; // Dictionary with string keys and nested dictionaries
+    evicted_sources?: Record<string, EvictedSource>;
     tool: string;
     messages: { [key: string]: unknown }[]; // Array of AnyMessage objects with potential additional properties
     logs: Log[];